@@ -92,6 +92,13 @@ QUERY_PROCESSORS = {
     'default': 'avocado.query.pipeline.QueryProcessor',
 }
 
+# Toggle whether conditions on fields reached through to-many relationships
+# are applied as `pk IN (subquery)` filters on the root model rather than
+# joins. This keeps the joins out of the main query so rows are not
+# multiplied and DISTINCT is not required. This can be overridden per query
+# by passing `semi_join` when applying a context.
+SEMI_JOIN_TO_MANY = False
+
 # Custom validation error and warnings messages
 VALIDATION_ERRORS = {}
 VALIDATION_WARNINGS = {}
@@ -120,3 +127,16 @@ PERMISSIONS_ENABLED = None
 # the ad-hoc queries built from a context and view.
 DATA_CACHE = 'default'
 QUERY_CACHE = 'default'
+
+# Number of seconds queries compiled from a context and view are kept in the
+# query cache. Compiled queries are invalidated when fields and concepts
+# change, but not when the data changes, so values validated against the
+# data, e.g. the choices of a field, are only validated again once the
+# compiled query expires. See `avocado.query.compiled`.
+COMPILED_QUERY_TIMEOUT = 60 * 5
+
+# Dotted paths to the sinks that receive the per-stage timings of the query
+# and export pipeline, e.g. 'avocado.core.timing.LoggingSink'. Classes are
+# instantiated with no arguments. Timings are not measured if no sinks are
+# registered. See `avocado.core.timing`.
+TIMING_SINKS = ()
@@ -0,0 +1,226 @@
+"""Records the SQL statements issued by avocado operations.
+
+`capture_queries` records every statement executed on the current thread's
+database connections while it is active and groups them by their shape,
+i.e. the SQL with the parameters and literal values removed. A shape
+executed many times in one operation usually means a query is issued per
+object (N+1) rather than once for all of them. It can sample a fraction of
+operations and log the repeated shapes, so it can be left in place in
+production.
+
+`query_budget` is the equivalent for tests, which raises
+`QueryBudgetExceeded` if an operation issues more queries, or repeats a
+shape more often, than allowed.
+"""
+import re
+import time
+import random
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+from django.db.backends import util
+
+log = logging.getLogger(__name__)
+
+_string_re = re.compile(r"'(?:[^']|'')*'")
+_number_re = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+_in_re = re.compile(r'\bIN \((?:(?:%s|\?)(?:, )?)+\)', re.I)
+_space_re = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """Returns the shape of `sql` with literal strings and numbers replaced
+    by `?` and lists of parameters by `...`.
+    """
+    sql = _string_re.sub('?', sql)
+    sql = _number_re.sub('?', sql)
+    sql = _space_re.sub(' ', sql)
+    sql = _in_re.sub('IN (...)', sql)
+
+    return sql.strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryLog(object):
+    "The statements recorded by `capture_queries`."
+    def __init__(self, name=None, sampled=True):
+        self.name = name
+        self.sampled = sampled
+        self.queries = []
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def add(self, sql, params, seconds, alias):
+        self.queries.append({
+            'sql': sql,
+            'params': params,
+            'time': seconds,
+            'using': alias,
+        })
+
+    def groups(self):
+        """Returns a list of `(shape, queries)` pairs in the order the
+        shapes were first executed.
+        """
+        groups = {}
+        order = []
+
+        for query in self.queries:
+            shape = normalize(query['sql'])
+
+            if shape not in groups:
+                groups[shape] = []
+                order.append(shape)
+
+            groups[shape].append(query)
+
+        return [(s, groups[s]) for s in order]
+
+    def repeated(self, threshold=2):
+        """Returns a list of `(shape, count)` pairs for the shapes executed
+        at least `threshold` times, most frequent first.
+        """
+        counts = [(shape, len(queries)) for shape, queries in self.groups()
+                  if len(queries) >= threshold]
+
+        return sorted(counts, key=lambda x: -x[1])
+
+    def report(self, threshold=2):
+        "Returns a summary of the statements and the repeated shapes."
+        lines = ['{0}: {1} queries'.format(self.name or 'queries',
+                                           len(self.queries))]
+
+        for shape, count in self.repeated(threshold):
+            lines.append('  {0}x {1}'.format(count, shape))
+
+        return '\n'.join(lines)
+
+
+class RecordingCursor(object):
+    "Cursor wrapper that adds the statements it executes to a `QueryLog`."
+    def __init__(self, cursor, db, query_log):
+        self.cursor = cursor
+        self.db = db
+        self.query_log = query_log
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, sql, params=None):
+        start = time.time()
+
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.query_log.add(sql, params, time.time() - start,
+                               self.db.alias)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.query_log.add(sql, param_list, time.time() - start,
+                               self.db.alias)
+
+
+def _record(conn, query_log):
+    """Makes the cursors of `conn` record to `query_log` and returns a
+    function that undoes it.
+    """
+    debug = conn.use_debug_cursor or \
+        (conn.use_debug_cursor is None and settings.DEBUG)
+
+    # Set if a capture is already active on the connection.
+    previous = conn.__dict__.get('make_debug_cursor')
+    make_debug_cursor = conn.make_debug_cursor
+    use_debug_cursor = conn.use_debug_cursor
+
+    def make_cursor(cursor):
+        # Cursors are wrapped as they would be without the capture.
+        if debug:
+            cursor = make_debug_cursor(cursor)
+        else:
+            cursor = util.CursorWrapper(cursor, conn)
+
+        return RecordingCursor(cursor, conn, query_log)
+
+    conn.make_debug_cursor = make_cursor
+    conn.use_debug_cursor = True
+
+    def restore():
+        conn.use_debug_cursor = use_debug_cursor
+
+        if previous is None:
+            del conn.make_debug_cursor
+        else:
+            conn.make_debug_cursor = previous
+
+    return restore
+
+
+@contextmanager
+def capture_queries(name=None, using=None, sample_rate=1.0,
+                    repeat_threshold=None):
+    """Context manager that yields a `QueryLog` of the statements executed
+    within it on the connection `using`, or all connections, of the
+    current thread.
+
+    Only a `sample_rate` fraction of the blocks are recorded. The log of a
+    block that is not sampled is empty and has `sampled` set to false. If
+    `repeat_threshold` is given, shapes executed at least that many times
+    are logged as a warning.
+    """
+    if sample_rate < 1 and random.random() >= sample_rate:
+        yield QueryLog(name, sampled=False)
+        return
+
+    if using is None:
+        conns = connections.all()
+    else:
+        conns = [connections[using]]
+
+    query_log = QueryLog(name)
+    restores = [_record(conn, query_log) for conn in conns]
+
+    try:
+        yield query_log
+    finally:
+        for restore in reversed(restores):
+            restore()
+
+    if repeat_threshold and query_log.repeated(repeat_threshold):
+        log.warning(query_log.report(repeat_threshold))
+
+
+@contextmanager
+def query_budget(max_queries=None, max_repeats=None, name=None, using=None):
+    """Context manager that raises `QueryBudgetExceeded` if more than
+    `max_queries` statements are executed within it, or any shape is
+    executed more than `max_repeats` times. Yields the `QueryLog`.
+    """
+    with capture_queries(name=name, using=using) as query_log:
+        yield query_log
+
+    if max_queries is not None and len(query_log) > max_queries:
+        raise QueryBudgetExceeded('{0} queries executed, {1} allowed\n{2}'
+                                  .format(len(query_log), max_queries,
+                                          query_log.report()))
+
+    if max_repeats is not None and query_log.repeated(max_repeats + 1):
+        raise QueryBudgetExceeded('a query was repeated more than {0} '
+                                  'times\n{1}'.format(
+                                      max_repeats,
+                                      query_log.report(max_repeats + 1)))
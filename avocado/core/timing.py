@@ -0,0 +1,309 @@
+"""Per-stage timing of the query and export pipeline.
+
+Stages such as parsing, SQL execution, formatting and writing record their
+wall time, and where applicable the number of rows and bytes processed, as
+`Timing` records which are delivered to the registered sinks. A sink is any
+callable that takes a record, e.g. a `LoggingSink`, a `Collector` or a plain
+function. Sinks named in the `TIMING_SINKS` setting are registered when
+this module is loaded and others can be added with `add_sink`.
+
+Nothing is measured while no sinks are registered, so the instrumentation
+can be left in place at no cost.
+"""
+import time
+import logging
+import threading
+from functools import wraps
+from collections import namedtuple
+from contextlib import contextmanager
+from django.utils.importlib import import_module
+from avocado.conf import settings
+
+log = logging.getLogger(__name__)
+
+Timing = namedtuple('Timing', ('stage', 'seconds', 'rows', 'bytes', 'label'))
+
+# The registered sinks. The list is replaced rather than modified so it can
+# be iterated without holding the lock.
+_sinks = []
+_lock = threading.Lock()
+
+# The stages being timed in the current thread.
+_local = threading.local()
+
+
+def add_sink(sink):
+    "Registers `sink` to receive all timings."
+    global _sinks
+
+    with _lock:
+        _sinks = _sinks + [sink]
+
+
+def remove_sink(sink):
+    "Unregisters `sink`."
+    global _sinks
+
+    with _lock:
+        _sinks = [s for s in _sinks if s is not sink]
+
+
+def enabled():
+    "Returns true if any sinks are registered."
+    return bool(_sinks)
+
+
+def record(stage, seconds, rows=None, bytes=None, label=None):
+    "Delivers a timing to the registered sinks."
+    sinks = _sinks
+
+    if not sinks:
+        return
+
+    timing = Timing(stage, seconds, rows, bytes, label)
+
+    for sink in sinks:
+        try:
+            sink(timing)
+        except Exception:
+            log.exception('Error delivering timing to sink')
+
+
+class LoggingSink(object):
+    "Logs each timing to `logger` at `level`."
+    def __init__(self, logger='avocado.timing', level=logging.INFO):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def __call__(self, timing):
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        message = '{0} {1:.6f}s'.format(timing.stage, timing.seconds)
+
+        if timing.label:
+            message += ' label={0}'.format(timing.label)
+
+        if timing.rows is not None:
+            message += ' rows={0}'.format(timing.rows)
+
+        if timing.bytes is not None:
+            message += ' bytes={0}'.format(timing.bytes)
+
+        self.logger.log(self.level, message)
+
+
+class Collector(object):
+    "Keeps the timings it receives in memory."
+    def __init__(self):
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def __call__(self, timing):
+        with self._lock:
+            self.timings.append(timing)
+
+    def clear(self):
+        with self._lock:
+            self.timings = []
+
+    def stages(self):
+        "Returns the stages in the order they were first recorded."
+        stages = []
+
+        for timing in self.timings:
+            if timing.stage not in stages:
+                stages.append(timing.stage)
+
+        return stages
+
+    def totals(self):
+        """Returns a dict of the number of timings and the total seconds,
+        rows and bytes of each stage.
+        """
+        totals = {}
+
+        for timing in self.timings:
+            total = totals.setdefault(timing.stage, {
+                'count': 0,
+                'seconds': 0.0,
+                'rows': 0,
+                'bytes': 0,
+            })
+
+            total['count'] += 1
+            total['seconds'] += timing.seconds
+            total['rows'] += timing.rows or 0
+            total['bytes'] += timing.bytes or 0
+
+        return totals
+
+
+@contextmanager
+def collect():
+    "Context manager that yields a `Collector` registered for its duration."
+    collector = Collector()
+    add_sink(collector)
+
+    try:
+        yield collector
+    finally:
+        remove_sink(collector)
+
+
+class stage(object):
+    """Context manager timing the enclosed block as `name`. The `rows` and
+    `bytes` attributes may be set within the block.
+
+    Only the outermost block of a stage is timed if it is entered again
+    within itself in the same thread, e.g. by a recursive function.
+    """
+    __slots__ = ('name', 'label', 'rows', 'bytes', 'start')
+
+    def __init__(self, name, label=None):
+        self.name = name
+        self.label = label
+        self.rows = None
+        self.bytes = None
+        self.start = None
+
+    def __enter__(self):
+        if _sinks:
+            active = _local.__dict__.setdefault('stages', set())
+
+            if self.name not in active:
+                active.add(self.name)
+                self.start = time.time()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is not None:
+            _local.stages.discard(self.name)
+            record(self.name, time.time() - self.start, self.rows,
+                   self.bytes, self.label)
+
+
+def timed(name):
+    "Decorator that times each call of a function as `name`."
+    def decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return inner
+    return decorator
+
+
+class TimedIterator(object):
+    "Iterates over `iterable` and counts the items and the time taken."
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+        self.rows = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        start = time.time()
+
+        try:
+            item = next(self._iterator)
+        finally:
+            self.seconds += time.time() - start
+
+        self.rows += 1
+        return item
+
+
+def timed_iter(name, iterable, source=None, label=None):
+    """Generates the items of `iterable` and records the time taken to
+    produce them as `name` once it is exhausted or closed.
+
+    If `iterable` consumes the `TimedIterator` `source`, the time spent in
+    `source` is not included.
+    """
+    items = TimedIterator(iterable)
+
+    try:
+        for item in items:
+            yield item
+    finally:
+        seconds = items.seconds
+
+        if source is not None:
+            seconds -= source.seconds
+
+        record(name, seconds, items.rows, label=label)
+
+
+def timed_read(name):
+    """Decorator for exporter readers that records the time spent
+    formatting, excluding the time taken by the rows being read.
+    """
+    def decorator(func):
+        @wraps(func)
+        def inner(self, iterable, *args, **kwargs):
+            if not _sinks:
+                return func(self, iterable, *args, **kwargs)
+
+            source = TimedIterator(iterable)
+            rows = func(self, source, *args, **kwargs)
+
+            return timed_iter(name, rows, source, label=self.short_name)
+
+        return inner
+    return decorator
+
+
+def _size(buff):
+    "Returns the position of `buff`, if it is a file-like object."
+    try:
+        return buff.tell()
+    except Exception:
+        return None
+
+
+def timed_write(name):
+    """Decorator for exporter writers that records the time spent writing,
+    excluding the time taken by the rows being written, along with the
+    number of rows and the size of the output.
+    """
+    def decorator(func):
+        @wraps(func)
+        def inner(self, iterable, *args, **kwargs):
+            if not _sinks or iterable is None:
+                return func(self, iterable, *args, **kwargs)
+
+            source = TimedIterator(iterable)
+            start = time.time()
+
+            buff = func(self, source, *args, **kwargs)
+
+            record(name, time.time() - start - source.seconds, source.rows,
+                   _size(buff), self.short_name)
+
+            return buff
+
+        return inner
+    return decorator
+
+
+def _load_sinks():
+    for path in settings.TIMING_SINKS:
+        module_name, attr = path.rsplit('.', 1)
+        sink = getattr(import_module(module_name), attr)
+
+        # Classes are instantiated with no arguments.
+        if isinstance(sink, type):
+            sink = sink()
+
+        add_sink(sink)
+
+
+_load_sinks()
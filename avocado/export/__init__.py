@@ -1,10 +1,14 @@
 from avocado.core import loader
 from avocado.conf import OPTIONAL_DEPS
-from _base import BaseExporter  # noqa
+from _base import BaseExporter, FormatCache  # noqa
+from _pool import close_pools  # noqa
+from _checkpoint import Checkpoint  # noqa
+from _compress import CompressedFile, compress_chunks, codecs  # noqa
+from _progress import Progress, get_progress, clear_progress  # noqa
 from _csv import CSVExporter
 from _sas import SASExporter
 from _r import RExporter
-from _json import JSONExporter
+from _json import JSONExporter, NDJSONExporter
 from _html import HTMLExporter  # noqa
 
 registry = loader.Registry(register_instance=False)
@@ -13,6 +17,7 @@ registry.register(CSVExporter, CSVExporter.short_name.lower())
 registry.register(SASExporter, SASExporter.short_name.lower())
 registry.register(RExporter, RExporter.short_name.lower())
 registry.register(JSONExporter, JSONExporter.short_name.lower())
+registry.register(NDJSONExporter, NDJSONExporter.short_name.lower())
 # registry.register(HTMLExporter, HTMLExporter.short_name.lower())
 
 if OPTIONAL_DEPS['openpyxl']:
@@ -1,8 +1,145 @@
+import shutil
+import logging
+import threading
+import tempfile
 import functools
-from multiprocessing.pool import ThreadPool
+import cPickle as pickle
+from contextlib import contextmanager
+from itertools import chain, izip
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+from avocado.core.timing import timed_read
 from avocado.models import DataView
-from avocado.formatters import registry as formatters
+from avocado.formatters import registry as formatters, \
+    preload_concept_fields
 from cStringIO import StringIO
+from _pool import batches, get_pool, imap_batches, pool_size, \
+    process_pool
+from _distinct import UniqueRows
+from _compress import CompressedFile, compress_chunks, get_codec
+from _progress import Progress, tracked_read
+
+log = logging.getLogger(__name__)
+
+# Formatting plan of the export a worker process was started for.
+_worker_plan = None
+
+
+def format_row(plan, row, kwargs=None):
+    "Formats `row` with a plan compiled by `BaseExporter._get_plan`."
+    _row = []
+
+    for formatter, start, end in plan:
+        if formatter is None:
+            _row.extend(row[start:end])
+        else:
+            _row.extend(formatter(row[start:end], kwargs=kwargs))
+
+    return tuple(_row)
+
+
+def _init_plan(state):
+    "Unpickles the formatting plan once when a worker process starts."
+    global _worker_plan
+    _worker_plan = pickle.loads(state)
+
+
+def format_rows(args):
+    """Formats a list of rows in a worker process.
+
+    `args` is a tuple of the rows and the formatter kwargs. The rows are
+    formatted with the plan the worker was initialized with.
+    """
+    rows, kwargs = args
+
+    return [format_row(_worker_plan, row, kwargs) for row in rows]
+
+
+class FormatCache(object):
+    """Size-bounded LRU cache of the formatted segments of a formatter.
+
+    Hits and misses are counted. Once `min_samples` lookups have been made,
+    the cache disables itself if the hit rate is below `min_hit_rate`
+    since caching values that rarely repeat only costs memory.
+    """
+    def __init__(self, size=10000, min_hit_rate=0.1, min_samples=1000):
+        self.size = size
+        self.min_hit_rate = min_hit_rate
+        self.min_samples = min_samples
+
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+
+        if not lookups:
+            return None
+
+        return self.hits / float(lookups)
+
+    def get(self, key, func):
+        """Returns the value for `key`, calling `func` to produce it if it
+        is not cached.
+        """
+        if not self.enabled:
+            return func()
+
+        with self._lock:
+            try:
+                # Re-insert the value to mark it as most recently used
+                value = self._data.pop(key)
+            except KeyError:
+                pass
+            except TypeError:
+                # Unhashable values cannot be cached
+                return func()
+            else:
+                self._data[key] = value
+                self.hits += 1
+                return value
+
+        value = func()
+
+        with self._lock:
+            self.misses += 1
+
+            if self.enabled:
+                self._data[key] = value
+
+                if len(self._data) > self.size:
+                    self._data.popitem(last=False)
+
+                self._check()
+
+        return value
+
+    def _check(self):
+        if self.hits + self.misses < self.min_samples:
+            return
+
+        if self.hit_rate < self.min_hit_rate:
+            self.enabled = False
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'size': len(self._data),
+            'enabled': self.enabled,
+        }
 
 
 class BaseExporter(object):
@@ -12,20 +149,75 @@ class BaseExporter(object):
     content_type = 'text/plain'
     preferred_formats = ()
 
-    def __init__(self, concepts=None, preferred_formats=None):
+    # Default size in bytes of the chunks yielded by exporters that
+    # support streaming.
+    chunk_size = 64 * 1024
+
+    # Default number of rows sent to worker pools at a time by the
+    # parallel readers.
+    batch_size = 1000
+
+    # Maximum number of segments cached per formatter by the cached
+    # readers. Caching is turned off for a formatter if its hit rate is
+    # below the minimum after the given number of lookups.
+    format_cache_size = 10000
+    format_cache_min_hit_rate = 0.1
+    format_cache_min_samples = 1000
+
+    # Number of unique rows `manual_read` keeps in memory before tracking
+    # them on disk.
+    distinct_memory_rows = 100000
+
+    # True if `write` accepts `resume` to append rows to a partially
+    # written file, which is required by resumable exports.
+    resumable = False
+
+    # True if the output of `write` and `stream` can be compressed, which
+    # is the case for exporters that write a single stream of text.
+    compressible = False
+
+    # The `Progress` of the export, set by `track_progress`.
+    progress = None
+
+    def __init__(self, concepts=None, preferred_formats=None,
+                 compression=None, compression_level=None):
         if preferred_formats is not None:
             self.preferred_formats = preferred_formats
 
+        # The file extension and content type are those of the compressed
+        # file, e.g. `csv.gz` and `application/gzip`.
+        if compression is not None:
+            if not self.compressible:
+                raise ValueError('{0} exporter does not support compression'
+                                 .format(self.short_name))
+
+            codec = get_codec(compression)
+            self.file_extension = '{0}.{1}'.format(self.file_extension,
+                                                   codec.extension)
+            self.content_type = codec.content_type
+
+        self.compression = compression
+        self.compression_level = compression_level
+
         if concepts is None:
             concepts = ()
         elif isinstance(concepts, DataView):
             node = concepts.parse()
             concepts = node.get_concepts_for_select()
 
+        # Load the metadata needed by the formatters of all the concepts
+        # up front rather than per concept.
+        concepts = list(concepts)
+
+        if concepts:
+            preload_concept_fields(concepts)
+
         self.params = []
         self.row_length = 0
         self.concepts = concepts
 
+        self._plan = None
+
         self._header = []
 
         for concept in concepts:
@@ -50,6 +242,7 @@ class BaseExporter(object):
 
         params = (formatter, length)
         self.row_length += length
+        self._plan = None
 
         if index is not None:
             self.params.insert(index, params)
@@ -72,49 +265,170 @@ class BaseExporter(object):
     def header(self):
         return tuple(self._header)
 
+    def track_progress(self, name=None, total=None, callback=None,
+                       **kwargs):
+        """Tracks the progress of the export. The rows fetched, formatted
+        and written by the exporter's readers and writers are counted and
+        reported to `callback` and, if `name` is given, stored in the query
+        cache where they can be read with `get_progress`. `total` is the
+        expected number of rows. Returns the `Progress`.
+        """
+        self.progress = Progress(name=name, total=total, callback=callback,
+                                 label=self.short_name, **kwargs)
+
+        return self.progress
+
     def get_file_obj(self, name=None):
         if name is None:
-            return StringIO()
+            buff = StringIO()
+        elif isinstance(name, basestring):
+            buff = open(name, 'w+')
+        else:
+            buff = name
+
+        # The size of the output is read from the file while writing.
+        if self.progress is not None:
+            self.progress.buff = buff
+
+        return buff
+
+    @contextmanager
+    def seekable_file_obj(self, name=None):
+        """Context manager yielding a seekable file object for `name`.
+
+        Writers such as `ZipFile` need to seek in their output. If the file
+        object for `name` cannot seek, e.g. an `HttpResponse`, output is
+        spooled to a temporary file and copied to it on exit.
+        """
+        buff = self.get_file_obj(name)
+
+        if hasattr(buff, 'seek'):
+            yield buff
+            return
+
+        with tempfile.TemporaryFile() as spool:
+            yield spool
+            spool.seek(0)
+            shutil.copyfileobj(spool, buff)
+
+    @contextmanager
+    def compressed_file_obj(self, buff):
+        """Context manager yielding a file object that writes to `buff`,
+        compressing the data if the exporter has a compression set. The
+        end of the compressed stream is written on exit.
+        """
+        if self.compression is None:
+            yield buff
+            return
+
+        with CompressedFile(buff, self.compression, self.compression_level,
+                            chunk_size=self.chunk_size) as compressed:
+            yield compressed
+
+    def compress_stream(self, chunks):
+        "Compresses the chunks generated by `stream` if applicable."
+        if self.compression is None:
+            return chunks
+
+        return compress_chunks(chunks, self.compression,
+                               self.compression_level)
+
+    def _get_plan(self):
+        """Compiles the formatters into a plan of `(formatter, start, end)`
+        segments of the row.
+
+        Slice offsets are computed once rather than per row and adjacent
+        formatters that pass values through unchanged are merged into a
+        single segment with a formatter of `None`. Other formatters are
+        prepared, e.g. codebooks are resolved, before they are used.
+        """
+        if self._plan is not None:
+            return self._plan
+
+        plan = []
+        start = 0
+
+        for formatter, length in self.params:
+            end = start + length
+
+            if not formatter.passthrough:
+                formatter.prepare()
+                plan.append((formatter, start, end))
+            elif plan and plan[-1][0] is None and plan[-1][2] == start:
+                plan[-1] = (None, plan[-1][1], end)
+            else:
+                plan.append((None, start, end))
+
+            start = end
 
-        if isinstance(name, basestring):
-            return open(name, 'w+')
+        self._plan = tuple(plan)
 
-        return name
+        return self._plan
 
     def _format_row(self, row, kwargs=None):
-        _row = []
+        return format_row(self._get_plan(), row, kwargs)
+
+    def _reset_format_cache(self):
+        self._format_cache = {}
+
+        for formatter, start, end in self._get_plan():
+            if formatter is not None:
+                self._format_cache[formatter] = FormatCache(
+                    size=self.format_cache_size,
+                    min_hit_rate=self.format_cache_min_hit_rate,
+                    min_samples=self.format_cache_min_samples)
+
+    def format_cache_stats(self):
+        """Returns the hit and miss counts, hit rate, size and state of the
+        format cache of each formatter used by the last cached read.
+        """
+        stats = []
 
         for formatter, length in self.params:
-            values, row = row[:length], row[length:]
+            cache = self._format_cache.get(formatter)
 
-            _row.extend(formatter(values, kwargs=kwargs))
+            if cache is not None:
+                item = cache.stats()
+                item['formatter'] = formatter
+                stats.append(item)
 
-        return tuple(_row)
+        return stats
+
+    def _log_format_cache_stats(self):
+        for item in self.format_cache_stats():
+            formatter = item['formatter']
+            label = formatter.concept or u', '.join(formatter.field_names)
+
+            log.debug(u'format cache for {0}: {hits} hits, {misses} misses, '
+                      u'{size} entries, enabled={enabled}'
+                      .format(label, **item))
 
     def _cache_format_row(self, row, kwargs=None):
         _row = []
 
-        for formatter, length in self.params:
-            values, row = row[:length], row[length:]
+        for formatter, start, end in self._get_plan():
+            values = row[start:end]
 
-            key = (formatter, values)
+            if formatter is None:
+                _row.extend(values)
+                continue
 
-            if key not in self._format_cache:
-                segment = formatter(values, kwargs=kwargs)
-
-                self._format_cache[key] = segment
-            else:
-                segment = self._format_cache[key]
+            segment = self._format_cache[formatter].get(
+                values, functools.partial(formatter, values, kwargs=kwargs))
 
             _row.extend(segment)
 
         return tuple(_row)
 
+    @timed_read('export.format')
+    @tracked_read
     def read(self, iterable, *args, **kwargs):
         "Reads an iterable and generates formatted rows."
         for row in iterable:
             yield self._format_row(row, kwargs=kwargs)
 
+    @timed_read('export.format')
+    @tracked_read
     def cached_read(self, iterable, *args, **kwargs):
         """Reads an iterable and generates formatted rows.
 
@@ -122,44 +436,165 @@ class BaseExporter(object):
         values and can significantly speed up formatting at the expense of
         memory.
 
-        The benefit of this method is dependent on the data. If there is
-        high variability in the data, this method may not perform well.
+        The benefit of this method is dependent on the data. The cache of
+        each formatter holds at most `format_cache_size` segments and is
+        turned off if its hit rate falls below `format_cache_min_hit_rate`.
+        See `format_cache_stats`.
         """
-        self._format_cache = {}
+        self._reset_format_cache()
 
         for row in iterable:
             yield self._cache_format_row(row, kwargs=kwargs)
 
-    def threaded_read(self, iterable, threads=None, *args, **kwargs):
+        self._log_format_cache_stats()
+
+    @timed_read('export.format')
+    @tracked_read
+    def batch_read(self, iterable, batch_size=None, *args, **kwargs):
         """Reads an iterable and generates formatted rows.
 
-        This read implementation starts a pool of worker threads to format
-        the data in parallel.
+        This read implementation formats `batch_size` rows at a time a
+        column at a time using `Formatter.format_batch`, which lets format
+        methods with batch counterparts convert whole columns at once. The
+        rows are reassembled after each batch is formatted.
         """
-        pool = ThreadPool(threads)
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        plan = self._get_plan()
+
+        for batch in batches(iterable, batch_size):
+            segments = []
+
+            for formatter, start, end in plan:
+                values = [row[start:end] for row in batch]
+
+                if formatter is not None:
+                    values = formatter.format_batch(values, kwargs=kwargs)
+
+                segments.append(values)
+
+            for parts in izip(*segments):
+                yield tuple(chain.from_iterable(parts))
+
+    @timed_read('export.format')
+    @tracked_read
+    def threaded_read(self, iterable, threads=None, batch_size=None,
+                      *args, **kwargs):
+        """Reads an iterable and generates formatted rows.
+
+        This read implementation uses a shared pool of worker threads to
+        format the data in parallel. Rows are formatted in batches of
+        `batch_size` and generated in order.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        pool = get_pool(threads)
 
         f = functools.partial(self._format_row,
                               kwargs=kwargs)
 
-        for row in pool.map(f, iterable):
+        def submit(batch):
+            return pool.map_async(f, batch)
+
+        for row in imap_batches(submit, iterable, batch_size):
             yield row
 
-    def cached_threaded_read(self, iterable, threads=None, *args, **kwargs):
+    @timed_read('export.format')
+    @tracked_read
+    def cached_threaded_read(self, iterable, threads=None, batch_size=None,
+                             *args, **kwargs):
         """Reads an iterable and generates formatted rows.
 
         This read implementation combines the `cached_read` and `threaded_read`
         methods.
         """
-        self._format_cache = {}
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        self._reset_format_cache()
 
-        pool = ThreadPool(threads)
+        pool = get_pool(threads)
 
         f = functools.partial(self._cache_format_row,
                               kwargs=kwargs)
 
-        for row in pool.map(f, iterable):
+        def submit(batch):
+            return pool.map_async(f, batch)
+
+        for row in imap_batches(submit, iterable, batch_size):
             yield row
 
+        self._log_format_cache_stats()
+
+    def get_process_pool(self, processes=None):
+        """Returns a new pool of `processes` worker processes initialized
+        with the formatting plan, which can be passed to `process_read`. The
+        caller must close the pool.
+        """
+        state = pickle.dumps(self._get_plan(), pickle.HIGHEST_PROTOCOL)
+
+        return process_pool(processes, initializer=_init_plan,
+                            initargs=(state,))
+
+    @timed_read('export.format')
+    @tracked_read
+    def process_read(self, iterable, processes=None, batch_size=None,
+                     pool=None, *args, **kwargs):
+        """Reads an iterable and generates formatted rows.
+
+        This read implementation uses a pool of worker processes to format
+        the data in parallel which, unlike threads, is not limited by the
+        GIL. The compiled formatting plan is pickled once and passed to the
+        workers when they start, so formatters and `kwargs` must be
+        picklable. Rows are generated in order.
+
+        Unless a `pool` from `get_process_pool` is given, for instance to
+        share it between several readers, a pool is created and closed once
+        the rows have been read.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        shared = pool is not None
+
+        if not shared:
+            pool = self.get_process_pool(processes)
+
+        # Split each batch evenly across the workers.
+        workers = pool_size(processes)
+
+        def submit(batch):
+            size = -(-len(batch) // workers)
+
+            return pool.map_async(format_rows, [
+                (batch[i:i + size], kwargs)
+                for i in xrange(0, len(batch), size)
+            ])
+
+        done = False
+
+        try:
+            for rows in imap_batches(submit, iterable, batch_size):
+                for row in rows:
+                    yield row
+
+            done = True
+        finally:
+            # Workers of a pool created here that are still formatting are
+            # stopped if the reader failed or was closed before it was
+            # exhausted.
+            if not shared:
+                if done:
+                    pool.close()
+                else:
+                    pool.terminate()
+
+                pool.join()
+
+    @timed_read('export.format')
+    @tracked_read
     def manual_read(self, iterable, force_distinct=True, offset=None,
                     limit=None, *args, **kwargs):
         """Reads an iterable and generates formatted rows.
@@ -168,7 +603,9 @@ class BaseExporter(object):
         particular ordering, but are not part of the concepts being handled.
 
         If `force_distinct` is true, rows will be filtered based on the slice
-        of the row that is going to be formatted.
+        of the row that is going to be formatted. Rows are compared exactly.
+        Once more than `distinct_memory_rows` unique rows have been seen,
+        they are tracked in a temporary database on disk.
 
         If `offset` is defined, only rows that are produced after the offset
         index are returned.
@@ -177,26 +614,24 @@ class BaseExporter(object):
         iterator is exhausted), the loop will exit.
         """
         emitted = 0
-        unique_rows = set()
-
-        for i, row in enumerate(iterable):
-            if limit is not None and emitted >= limit:
-                break
+        unique_rows = UniqueRows(max_size=self.distinct_memory_rows)
 
-            _row = row[:self.row_length]
+        try:
+            for i, row in enumerate(iterable):
+                if limit is not None and emitted >= limit:
+                    break
 
-            if force_distinct:
-                _row_hash = hash(tuple(_row))
+                _row = row[:self.row_length]
 
-                if _row_hash in unique_rows:
+                if force_distinct and not unique_rows.add(_row):
                     continue
 
-                unique_rows.add(_row_hash)
-
-            if offset is None or i >= offset:
-                emitted += 1
+                if offset is None or i >= offset:
+                    emitted += 1
 
-                yield self._format_row(_row, kwargs=kwargs)
+                    yield self._format_row(_row, kwargs=kwargs)
+        finally:
+            unique_rows.close()
 
     def write(self, iterable, *args, **kwargs):
         for row in iterable:
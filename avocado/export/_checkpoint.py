@@ -0,0 +1,73 @@
+import os
+import json
+
+
+class Checkpoint(object):
+    """Progress of an export being written to a file on local disk.
+
+    The checkpoint is saved as JSON alongside the file, at `path` with a
+    `.checkpoint` suffix, and records the number of rows and bytes written
+    and the cursor of the last row written. The `signature` identifies the
+    export so a checkpoint is only resumed by the same export.
+    """
+    suffix = '.checkpoint'
+
+    def __init__(self, path, signature=None):
+        self.path = path
+        self.signature = signature
+        self.reset()
+
+    @property
+    def checkpoint_path(self):
+        return self.path + self.suffix
+
+    def reset(self):
+        "Resets the progress so the export starts from the beginning."
+        self.rows = 0
+        self.bytes = 0
+        self.cursor = None
+
+    @classmethod
+    def load(cls, path, signature=None):
+        """Returns the saved checkpoint for `path` if there is one for the
+        same `signature`, otherwise a new checkpoint.
+        """
+        checkpoint = cls(path, signature)
+
+        try:
+            with open(checkpoint.checkpoint_path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return checkpoint
+
+        if state.get('signature') == signature:
+            checkpoint.rows = state['rows']
+            checkpoint.bytes = state['bytes']
+            checkpoint.cursor = state['cursor']
+
+        return checkpoint
+
+    def save(self):
+        """Saves the checkpoint. The state is written to a temporary file
+        which replaces the previous checkpoint so it is never left partially
+        written.
+        """
+        tmp_path = self.checkpoint_path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'path': self.path,
+                'signature': self.signature,
+                'rows': self.rows,
+                'bytes': self.bytes,
+                'cursor': self.cursor,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(tmp_path, self.checkpoint_path)
+
+    def delete(self):
+        "Removes the saved checkpoint, if any."
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -0,0 +1,252 @@
+"""Streaming compression of exporter output.
+
+`CompressedFile` is a file-like object that compresses the data written to
+it and writes the result to another file object, and `compress_chunks`
+does the same for a generator of chunks. The data is buffered into chunks
+which are compressed by a background thread, so compression overlaps with
+fetching and formatting the rows. The codecs release the GIL while
+compressing.
+"""
+import bz2
+import sys
+import zlib
+import threading
+from Queue import Queue, Empty
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Put on the queue once all of the data has been put.
+_DONE = object()
+
+
+class Codec(object):
+    "A compression format supported by the exporters."
+    def __init__(self, name, extension, content_type, compressor,
+                 default_level):
+        self.name = name
+        self.extension = extension
+        self.content_type = content_type
+        self.default_level = default_level
+
+        self._compressor = compressor
+
+    def __repr__(self):
+        return u'<Codec: {0}>'.format(self.name)
+
+    def compressor(self, level=None):
+        """Returns a compressor object with `compress` and `flush` methods,
+        as defined by `zlib.compressobj`.
+        """
+        if level is None:
+            level = self.default_level
+
+        return self._compressor(level)
+
+
+def _gzip(level):
+    # A window size of 16 + MAX_WBITS writes the gzip header and trailer.
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+codecs = OrderedDict()
+
+codecs['gzip'] = Codec('gzip', 'gz', 'application/gzip', _gzip, 6)
+codecs['bzip2'] = Codec('bzip2', 'bz2', 'application/x-bzip2',
+                        bz2.BZ2Compressor, 9)
+
+if lzma is not None:
+    codecs['xz'] = Codec('xz', 'xz', 'application/x-xz',
+                         lambda level: lzma.LZMACompressor(preset=level), 6)
+
+
+def get_codec(name):
+    "Returns the codec named `name`."
+    try:
+        return codecs[name]
+    except KeyError:
+        raise ValueError(u'Unknown compression "{0}". Choices are: {1}'
+                         .format(name, ', '.join(codecs)))
+
+
+class _Compressor(threading.Thread):
+    """Compresses the chunks put on its queue and passes the output to
+    `output` in a background thread.
+
+    The queue holds at most `max_pending` chunks so memory is bounded if
+    the data is produced faster than it can be compressed. If compressing
+    or `output` fails, the exception is raised to the producer on its next
+    call.
+    """
+    def __init__(self, codec, level, output, max_pending):
+        super(_Compressor, self).__init__(name='avocado-compress')
+        self.daemon = True
+
+        self.compressor = codec.compressor(level)
+        self.output = output
+        self.queue = Queue(max_pending)
+        self.exc_info = None
+        self.aborted = False
+
+        self.start()
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+
+            # Once failed or aborted, the remaining chunks are discarded so
+            # the producer does not block on a full queue.
+            if self.exc_info is not None or self.aborted:
+                if chunk is _DONE:
+                    break
+                continue
+
+            try:
+                if chunk is _DONE:
+                    data = self.compressor.flush()
+                else:
+                    data = self.compressor.compress(chunk)
+
+                if data:
+                    self.output(data)
+            except Exception:
+                self.exc_info = sys.exc_info()
+
+            if chunk is _DONE:
+                break
+
+    def check(self):
+        if self.exc_info is not None:
+            exc_info = self.exc_info
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def put(self, chunk):
+        self.check()
+        self.queue.put(chunk)
+
+    def abort(self):
+        "Stops the thread without writing the rest of the output."
+        self.aborted = True
+        self.queue.put(_DONE)
+
+    def finish(self):
+        "Flushes the compressor and waits for the output to be passed on."
+        self.queue.put(_DONE)
+        self.join()
+        self.check()
+
+
+class CompressedFile(object):
+    """Write-only file-like object that compresses the data written to it
+    with the codec named `compression` and writes it to `fileobj`.
+
+    Writes are buffered into chunks of `chunk_size` bytes which are
+    compressed in a background thread. `close` must be called to write the
+    end of the compressed stream; it does not close `fileobj`. `tell`
+    returns the number of uncompressed bytes written.
+    """
+    def __init__(self, fileobj, compression='gzip', level=None,
+                 chunk_size=64 * 1024, max_pending=8):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+
+        self.closed = False
+
+        self._chunk = []
+        self._chunk_len = 0
+        self._size = 0
+        self._compressor = _Compressor(get_codec(compression), level,
+                                       fileobj.write, max_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif not self.closed:
+            # Stop the thread without masking the original exception.
+            self.closed = True
+            self._compressor.abort()
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        self._chunk.append(data)
+        self._chunk_len += len(data)
+        self._size += len(data)
+
+        if self._chunk_len >= self.chunk_size:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        """Hands the buffered data to the compressor. The compressed output
+        may lag behind until the file is closed.
+        """
+        if self._chunk:
+            self._compressor.put(''.join(self._chunk))
+            self._chunk = []
+            self._chunk_len = 0
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.flush()
+        self.closed = True
+        self._compressor.finish()
+
+
+def compress_chunks(chunks, compression='gzip', level=None, max_pending=8):
+    """Generates the compressed output of the generator of `chunks`.
+
+    The chunks are compressed in a background thread while the next ones
+    are produced. Compressed data is yielded as soon as it is available,
+    so the output chunks do not line up with the input ones.
+    """
+    output = Queue()
+    compressor = _Compressor(get_codec(compression), level, output.put,
+                             max_pending)
+
+    def ready():
+        while True:
+            try:
+                yield output.get_nowait()
+            except Empty:
+                break
+
+    finished = False
+
+    try:
+        for chunk in chunks:
+            if chunk:
+                compressor.put(chunk)
+
+            for data in ready():
+                yield data
+
+        compressor.finish()
+        finished = True
+    finally:
+        # Stop the thread if the chunks failed or the generator is closed.
+        if not finished and compressor.is_alive():
+            compressor.abort()
+
+    for data in ready():
+        yield data
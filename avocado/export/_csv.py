@@ -1,5 +1,9 @@
 import csv
+import tempfile
+from cStringIO import StringIO
+from avocado.core.timing import timed_write
 from _base import BaseExporter
+from _progress import tracked_write
 
 
 class UnicodeWriter(object):
@@ -35,13 +39,76 @@ class CSVExporter(BaseExporter):
 
     preferred_formats = ('csv', 'string')
 
-    def write(self, iterable, buff=None, *args, **kwargs):
-        buff = self.get_file_obj(buff)
+    resumable = True
+    compressible = True
+
+    def _get_writer(self, buff, header=True):
         writer = UnicodeWriter(buff, quoting=csv.QUOTE_MINIMAL)
 
-        writer.writerow([f['label'] for f in self.header])
+        if header:
+            writer.writerow([f['label'] for f in self.header])
+
+        return writer
+
+    @timed_write('export.write')
+    @tracked_write
+    def write(self, iterable, buff=None, resume=False, *args, **kwargs):
+        """Writes the header and rows as CSV. If `resume` is true, rows
+        have already been written to `buff` and only the rows are appended.
+        """
+        buff = self.get_file_obj(buff)
+
+        with self.compressed_file_obj(buff) as f:
+            writer = self._get_writer(f, header=not resume)
+
+            for row in iterable:
+                writer.writerow(row)
+
+        return buff
+
+    @tracked_write
+    def stream(self, iterable, chunk_size=None, *args, **kwargs):
+        """Generates the encoded CSV output in chunks of approximately
+        `chunk_size` bytes, or the compressed output if the exporter has
+        a compression set.
+
+        Only the current chunk is held in memory so this is suitable for
+        large exports. The generator can be passed directly to Django's
+        `StreamingHttpResponse`.
+        """
+        return self.compress_stream(
+            self._stream(iterable, chunk_size=chunk_size))
+
+    def _stream(self, iterable, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        buff = StringIO()
+        writer = self._get_writer(buff)
 
         for row in iterable:
             writer.writerow(row)
 
-        return buff
+            if buff.tell() >= chunk_size:
+                yield buff.getvalue()
+                buff.seek(0)
+                buff.truncate()
+
+        if buff.tell():
+            yield buff.getvalue()
+
+        buff.close()
+
+    def write_zip(self, iterable, zip_file, arcname, *args, **kwargs):
+        """Writes the CSV data as the `arcname` entry of `zip_file`.
+
+        The data is spooled to a temporary file on disk and added to the
+        archive from there, so the data is never held in memory.
+        """
+        with tempfile.NamedTemporaryFile(suffix='.csv') as data_file:
+            self.write(iterable, data_file, *args, **kwargs)
+            data_file.flush()
+
+            zip_file.write(data_file.name, arcname)
+
+        return zip_file
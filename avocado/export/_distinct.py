@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import tempfile
+import cPickle as pickle
+from decimal import Context, Decimal
+
+_NUMBERS = (int, long, float, Decimal)
+
+
+def _normalize(value):
+    """Returns the value in a canonical form so values that are equal, such
+    as 1, 1L, 1.0 and Decimal('1.00') or u'a' and 'a', are pickled the same.
+    """
+    if isinstance(value, str):
+        try:
+            return value.decode('ascii')
+        except UnicodeDecodeError:
+            return value
+
+    if isinstance(value, _NUMBERS):
+        try:
+            integral = int(value)
+        except (ValueError, OverflowError):
+            # NaN and infinity
+            return value
+
+        if integral == value:
+            return integral
+
+        if isinstance(value, Decimal):
+            # Only trailing zeros are removed, so the precision of the digits
+            # is enough to not round the value.
+            digits = len(value.as_tuple().digits)
+            return value.normalize(Context(prec=digits))
+
+    return value
+
+
+class UniqueRows(object):
+    """Exact set membership of rows in bounded memory.
+
+    Rows are compared by their pickled representation rather than by hash
+    so distinct rows are never mistaken for each other. Values are
+    normalized first so equal numbers and strings of different types are
+    not treated as distinct, as with a set of rows. Keys are kept in
+    memory until there are `max_size` of them, after which they are moved
+    to a temporary SQLite database on disk and all further lookups are
+    performed there.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+
+        self._keys = set()
+        self._path = None
+        self._db = None
+
+    def __len__(self):
+        if self._db is None:
+            return len(self._keys)
+
+        return self._db.execute('SELECT COUNT(*) FROM keys').fetchone()[0]
+
+    def add(self, row):
+        "Adds `row` to the set and returns true if it was not present."
+        key = pickle.dumps(tuple(_normalize(value) for value in row),
+                           pickle.HIGHEST_PROTOCOL)
+
+        if self._db is not None:
+            cursor = self._db.execute('INSERT OR IGNORE INTO keys VALUES (?)',
+                                      (sqlite3.Binary(key),))
+            return cursor.rowcount == 1
+
+        if key in self._keys:
+            return False
+
+        self._keys.add(key)
+
+        if len(self._keys) >= self.max_size:
+            self._spill()
+
+        return True
+
+    def _spill(self):
+        fd, self._path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+        self._db = sqlite3.connect(self._path)
+
+        # The database is temporary so durability is not a concern.
+        self._db.execute('PRAGMA journal_mode = OFF')
+        self._db.execute('PRAGMA synchronous = OFF')
+        self._db.execute('CREATE TABLE keys (key BLOB PRIMARY KEY)')
+        self._db.executemany('INSERT INTO keys VALUES (?)',
+                             ((sqlite3.Binary(k),) for k in self._keys))
+
+        self._keys = set()
+
+    def close(self):
+        "Removes the keys and the temporary database, if one was created."
+        self._keys = set()
+
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+            os.remove(self._path)
+            self._path = None
@@ -1,4 +1,3 @@
-from django.http import HttpResponse
 from django.core.exceptions import ImproperlyConfigured
 from avocado.conf import OPTIONAL_DEPS
 if not OPTIONAL_DEPS['openpyxl']:
@@ -6,7 +5,9 @@ if not OPTIONAL_DEPS['openpyxl']:
                                'exporter.')
 
 from openpyxl import Workbook
+from avocado.core.timing import timed_write
 from _base import BaseExporter
+from _progress import tracked_write
 
 
 class ExcelExporter(BaseExporter):
@@ -18,22 +19,48 @@ class ExcelExporter(BaseExporter):
 
     preferred_formats = ('excel', 'string')
 
+    # Maximum number of rows in a worksheet, including the header row.
+    # Rows beyond this are written to additional data sheets.
+    max_rows = 1048576
+
+    def _create_data_sheet(self, wb, index):
+        ws = wb.create_sheet()
+
+        if index == 1:
+            ws.title = 'Data'
+        else:
+            ws.title = 'Data ({0})'.format(index)
+
+        ws.append([f['name'] for f in self.header])
+
+        return ws
+
+    @timed_write('export.write')
+    @tracked_write
     def write(self, iterable, buff=None, *args, **kwargs):
         buff = self.get_file_obj(buff)
 
         # Reference the header
         header = self.header
 
+        # Rows are written to temporary files as they are appended rather
+        # than being held in memory.
         wb = Workbook(optimized_write=True)
 
-        ws_data = wb.create_sheet()
-        ws_data.title = 'Data'
-
-        # Create the data worksheet
-        ws_data.append([f['name'] for f in header])
+        # Create the data worksheets, starting a new sheet whenever the
+        # current one is full.
+        sheets = 1
+        ws_data = self._create_data_sheet(wb, sheets)
+        rows = 1
 
         for row in iterable:
+            if rows >= self.max_rows:
+                sheets += 1
+                ws_data = self._create_data_sheet(wb, sheets)
+                rows = 1
+
             ws_data.append(row)
+            rows += 1
 
         ws_dict = wb.create_sheet()
         ws_dict.title = 'Data Dictionary'
@@ -52,16 +79,9 @@ class ExcelExporter(BaseExporter):
                 f['description'],
             ))
 
-        # This hacked up implementation is due to `save_virtual_workbook`
-        # not behaving correctly. This function should handle the work
-        # https://bitbucket.org/ericgazoni/openpyxl/src/94b05cf9defb9787b4dfbf9e8dca7ba6e0b33d56/openpyxl/writer/excel.py?at=default#cl-154     # noqa
-        # however, no data is actually being saved to the worksheets..
-        if isinstance(buff, HttpResponse):
-            _buff = self.get_file_obj()
-            wb.save(_buff)
-            buff.content = _buff.getvalue()
-            _buff.close()
-        else:
-            wb.save(buff)
+        # The workbook is saved to a temporary file if the output cannot
+        # seek, e.g. an HttpResponse, and then copied into it.
+        with self.seekable_file_obj(buff) as f:
+            wb.save(f)
 
         return buff
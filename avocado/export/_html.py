@@ -1,6 +1,8 @@
 from django.template import Context
 from django.template.loader import get_template
+from avocado.core.timing import timed_write
 from _base import BaseExporter
+from _progress import tracked_write
 
 
 class HTMLExporter(BaseExporter):
@@ -12,6 +14,8 @@ class HTMLExporter(BaseExporter):
 
     preferred_formats = ('html', 'string')
 
+    @timed_write('export.write')
+    @tracked_write
     def write(self, iterable, template, buff=None, *args, **kwargs):
         buff = self.get_file_obj(buff)
 
@@ -1,6 +1,8 @@
 import inspect
 from django.core.serializers.json import DjangoJSONEncoder
+from avocado.core.timing import timed_write
 from _base import BaseExporter
+from _progress import tracked_write
 
 
 class JSONGeneratorEncoder(DjangoJSONEncoder):
@@ -21,6 +23,58 @@ class JSONExporter(BaseExporter):
 
     preferred_formats = ('json',)
 
+    resumable = True
+    compressible = True
+
+    @timed_write('export.write')
+    @tracked_write
+    def write(self, iterable, buff=None, resume=False, *args, **kwargs):
+        """Writes the rows as a JSON array of objects.
+
+        Each row is encoded and written as it is produced so the size of
+        the result set does not affect memory usage. If `resume` is true,
+        `buff` already contains the start of the array and at least one
+        row, and the remaining rows are appended to it.
+        """
+        buff = self.get_file_obj(buff)
+
+        encoder = JSONGeneratorEncoder()
+
+        keys = [f['name'] for f in self.header]
+
+        with self.compressed_file_obj(buff) as f:
+            if not resume:
+                f.write('[')
+
+            for i, values in enumerate(iterable):
+                if i > 0 or resume:
+                    f.write(', ')
+
+                for chunk in encoder.iterencode(dict(zip(keys, values))):
+                    f.write(chunk)
+
+            f.write(']')
+
+        return buff
+
+
+class NDJSONExporter(BaseExporter):
+    """Writes one JSON object per line for consumers that read record by
+    record rather than parsing the whole document.
+    """
+    short_name = 'NDJSON'
+    long_name = 'Newline Delimited JSON (NDJSON)'
+
+    file_extension = 'ndjson'
+    content_type = 'application/x-ndjson'
+
+    preferred_formats = ('json',)
+
+    resumable = True
+    compressible = True
+
+    @timed_write('export.write')
+    @tracked_write
     def write(self, iterable, buff=None, *args, **kwargs):
         buff = self.get_file_obj(buff)
 
@@ -28,9 +82,11 @@ class JSONExporter(BaseExporter):
 
         keys = [f['name'] for f in self.header]
 
-        data = [dict(zip(keys, values)) for values in iterable]
+        with self.compressed_file_obj(buff) as f:
+            for values in iterable:
+                for chunk in encoder.iterencode(dict(zip(keys, values))):
+                    f.write(chunk)
 
-        for chunk in encoder.iterencode(data):
-            buff.write(chunk)
+                f.write('\n')
 
         return buff
@@ -0,0 +1,117 @@
+"""Worker pools for the parallel exporter readers.
+
+Thread pools are created on first use, shared by all exporters and closed
+when the interpreter exits or `close_pools` is called. Process pools are
+created by `process_pool` for each export, since their workers are
+initialized with its state, and are closed by their caller. Rows are sent
+to the pools in fixed-size batches so the number of rows held in memory
+is bounded regardless of the size of the input.
+"""
+import atexit
+import threading
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from django.db import connections
+
+_pools = {}
+_lock = threading.Lock()
+
+# Database connections inherited from the parent by a worker process.
+_inherited = []
+
+
+def _init_worker(initializer=None, initargs=()):
+    """Detaches the database connections a worker process inherits from
+    the parent so the worker opens its own when needed, then calls
+    `initializer` with `initargs`, if given.
+
+    The inherited connections are kept referenced rather than closed since
+    closing them would affect the parent's connections.
+    """
+    for conn in connections.all():
+        if conn.connection is not None:
+            _inherited.append(conn.connection)
+            conn.connection = None
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def pool_size(workers=None):
+    "Returns the number of workers a pool with `workers` will have."
+    return workers or cpu_count()
+
+
+def get_pool(threads=None):
+    "Returns the shared thread pool with `threads` workers."
+    threads = pool_size(threads)
+
+    with _lock:
+        pool = _pools.get(threads)
+
+        if pool is None:
+            pool = _pools[threads] = ThreadPool(threads)
+
+    return pool
+
+
+def process_pool(processes=None, initializer=None, initargs=()):
+    """Returns a new process pool with `processes` workers that each call
+    `initializer` with `initargs` once when they start. The pool is not
+    shared and must be closed by the caller.
+    """
+    return Pool(pool_size(processes), initializer=_init_worker,
+                initargs=(initializer, initargs))
+
+
+def close_pools():
+    "Closes the shared thread pools and waits for the workers to exit."
+    with _lock:
+        pools = _pools.values()
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
+        pool.join()
+
+
+atexit.register(close_pools)
+
+
+def batches(iterable, size):
+    "Generates lists of up to `size` consecutive items of `iterable`."
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(islice(iterator, size))
+
+        if not batch:
+            break
+
+        yield batch
+
+
+def imap_batches(submit, iterable, size):
+    """Generates the results of `submit` applied to consecutive batches of
+    `iterable` in order.
+
+    `submit` takes a batch and returns an `AsyncResult` for a list. The
+    next batch is submitted before the results of the previous one are
+    yielded so the workers are kept busy, but no more than two batches
+    are in flight at once.
+    """
+    pending = None
+
+    for batch in batches(iterable, size):
+        result = submit(batch)
+
+        if pending is not None:
+            for item in pending.get():
+                yield item
+
+        pending = result
+
+    if pending is not None:
+        for item in pending.get():
+            yield item
@@ -0,0 +1,251 @@
+"""Progress reporting for running exports.
+
+An exporter tracks its progress once `BaseExporter.track_progress` is
+called. Its readers then count the rows fetched and formatted, and its
+writers count the rows and bytes written. Snapshots of the progress are
+passed to a callback and, for named exports, stored in the query cache so
+another request can poll them with `get_progress`.
+"""
+import time
+import inspect
+import threading
+from functools import wraps
+from django.core.cache import get_cache
+from avocado.conf import settings
+
+PROGRESS_KEY_PREFIX = 'avocado:export-progress:{0}'
+
+
+def _size(buff):
+    "Returns the position of `buff`, if it is a file-like object."
+    try:
+        return buff.tell()
+    except Exception:
+        return None
+
+
+def get_progress(name):
+    "Returns the last progress snapshot of the named export, if any."
+    cache = get_cache(settings.QUERY_CACHE)
+    return cache.get(PROGRESS_KEY_PREFIX.format(name))
+
+
+def clear_progress(name):
+    "Removes the progress of the named export from the cache."
+    cache = get_cache(settings.QUERY_CACHE)
+    cache.delete(PROGRESS_KEY_PREFIX.format(name))
+
+
+class Progress(object):
+    """Counts the rows fetched, formatted and written by an export.
+
+    `total` is the expected number of rows, if known. A snapshot is
+    reported at most every `interval` seconds while the export runs and
+    once more when it finishes or fails. Snapshots are passed to
+    `callback`, and stored in the query cache for `timeout` seconds if the
+    export has a `name`.
+    """
+    def __init__(self, name=None, total=None, callback=None, label=None,
+                 interval=1.0, timeout=60 * 60):
+        self.name = name
+        self.total = total
+        self.callback = callback
+        self.label = label
+        self.interval = interval
+        self.timeout = timeout
+
+        self.fetched = 0
+        self.formatted = 0
+        self.written = 0
+        self.bytes = None
+
+        # The file object being written to, set by `get_file_obj`.
+        self.buff = None
+
+        self.writing = False
+        self.state = 'running'
+        self.started = time.time()
+        self.finished = None
+
+        self._next_report = self.started + interval
+        self._lock = threading.Lock()
+
+    @property
+    def rows(self):
+        "The rows written or, if the rows are not being written, formatted."
+        if self.writing:
+            return self.written
+
+        return self.formatted
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def snapshot(self):
+        "Returns the progress as a dict."
+        elapsed = self.elapsed()
+        rows = self.rows
+
+        size = _size(self.buff)
+
+        if size is not None and self.finished is None:
+            self.bytes = size
+
+        rate = rows / elapsed if elapsed > 0 else None
+
+        percent = None
+        eta = None
+
+        if self.total:
+            percent = min(100.0, rows * 100.0 / self.total)
+
+            if rate and self.finished is None:
+                eta = max(0.0, (self.total - rows) / rate)
+
+        return {
+            'name': self.name,
+            'label': self.label,
+            'state': self.state,
+            'total': self.total,
+            'fetched': self.fetched,
+            'formatted': self.formatted,
+            'written': self.written,
+            'bytes': self.bytes,
+            'started': self.started,
+            'elapsed': elapsed,
+            'rows_per_second': rate,
+            'percent': percent,
+            'eta': eta,
+        }
+
+    def report(self):
+        "Passes a snapshot to the callback and the cache."
+        with self._lock:
+            self._next_report = time.time() + self.interval
+            snapshot = self.snapshot()
+
+        if self.callback is not None:
+            self.callback(snapshot)
+
+        if self.name is not None:
+            cache = get_cache(settings.QUERY_CACHE)
+            cache.set(PROGRESS_KEY_PREFIX.format(self.name), snapshot,
+                      self.timeout)
+
+        return snapshot
+
+    def _count(self, attr, iterable):
+        """Generates the items of `iterable`, adding them to the `attr`
+        count and reporting when the interval has passed.
+        """
+        lock = self._lock
+
+        for item in iterable:
+            with lock:
+                setattr(self, attr, getattr(self, attr) + 1)
+
+            if time.time() >= self._next_report:
+                self.report()
+
+            yield item
+
+    def count_fetched(self, iterable):
+        return self._count('fetched', iterable)
+
+    def count_formatted(self, iterable):
+        return self._count('formatted', iterable)
+
+    def count_written(self, iterable):
+        self.writing = True
+        return self._count('written', iterable)
+
+    def finish(self, bytes=None):
+        "Marks the export as done and reports it."
+        if bytes is None:
+            bytes = _size(self.buff)
+
+        if bytes is not None:
+            self.bytes = bytes
+
+        self.state = 'done'
+        self.finished = time.time()
+        self.buff = None
+
+        return self.report()
+
+    def fail(self):
+        "Marks the export as failed and reports it."
+        self.state = 'failed'
+        self.finished = time.time()
+        self.buff = None
+
+        return self.report()
+
+
+def tracked_read(func):
+    """Decorator for exporter readers that counts the rows fetched and
+    formatted if the exporter is tracking its progress.
+    """
+    @wraps(func)
+    def inner(self, iterable, *args, **kwargs):
+        progress = self.progress
+
+        if progress is None:
+            return func(self, iterable, *args, **kwargs)
+
+        rows = func(self, progress.count_fetched(iterable), *args, **kwargs)
+
+        return progress.count_formatted(rows)
+
+    return inner
+
+
+def tracked_write(func):
+    """Decorator for exporter writers that counts the rows written and
+    finishes the progress once the output is written. Writers that return
+    a generator of chunks, such as `stream`, finish once it is exhausted
+    and count the bytes generated.
+    """
+    @wraps(func)
+    def inner(self, iterable, *args, **kwargs):
+        progress = self.progress
+
+        if progress is None or iterable is None:
+            return func(self, iterable, *args, **kwargs)
+
+        try:
+            output = func(self, progress.count_written(iterable), *args,
+                          **kwargs)
+        except Exception:
+            progress.fail()
+            raise
+
+        if inspect.isgenerator(output):
+            return _tracked_chunks(progress, output)
+
+        progress.finish(_size(output))
+
+        return output
+
+    return inner
+
+
+def _tracked_chunks(progress, chunks):
+    size = 0
+    done = False
+
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            progress.bytes = size
+
+            yield chunk
+
+        done = True
+    finally:
+        # The generator failed or was closed before it was exhausted, e.g.
+        # if the client disconnected.
+        if not done:
+            progress.fail()
+
+    progress.finish(size)
@@ -1,9 +1,10 @@
 from zipfile import ZipFile
-from cStringIO import StringIO
 from string import punctuation
 from django.template import Context
 from django.template.loader import get_template
+from avocado.core.timing import timed_write
 from _base import BaseExporter
+from _progress import tracked_write
 from _csv import CSVExporter
 
 
@@ -57,10 +58,22 @@ class RExporter(BaseExporter):
 
         return factor, level
 
+    def get_data_exporter(self):
+        "Returns the exporter used to write the data file of the archive."
+        # The data file uses this exporter's preferred formats.
+        return CSVExporter(self.concepts,
+                           preferred_formats=self.preferred_formats)
+
+    @timed_write('export.write')
+    @tracked_write
     def write(self, iterable, buff=None, template_name='export/script.R',
-              *args, **kwargs):
+              data_file=None, *args, **kwargs):
+        """Writes the archive of the data file and script.
 
-        zip_file = ZipFile(self.get_file_obj(buff), 'w')
+        If `data_file` is given, it is the path of a data file that has
+        already been written by the exporter returned by
+        `get_data_exporter` and `iterable` is ignored.
+        """
 
         factors = []      # field names
         levels = []       # value dictionaries
@@ -75,25 +88,13 @@ class RExporter(BaseExporter):
             coded_labels = f['field'].coded_labels()
 
             if coded_labels:
-                codes = self._code_values(name, f['field'], coded_labels)
+                codes = self._code_values(name, coded_labels)
                 factors.append(codes[0])
                 levels.append(codes[1])
 
         data_filename = 'data.csv'
         script_filename = 'script.R'
 
-        # File buffers
-        data_buff = StringIO()
-
-        # Create the data file with this exporter's preferred formats.
-        data_exporter = CSVExporter(self.concepts,
-                                    preferred_formats=self.preferred_formats)
-
-        # Write the data file.
-        data_exporter.write(iterable, data_buff, *args, **kwargs)
-
-        zip_file.writestr(data_filename, data_buff.getvalue())
-
         template = get_template(template_name)
         context = Context({
             'data_filename': data_filename,
@@ -102,8 +103,18 @@ class RExporter(BaseExporter):
             'levels': levels,
         })
 
-        # Write script from template
-        zip_file.writestr(script_filename, template.render(context))
-        zip_file.close()
+        with self.seekable_file_obj(buff) as f:
+            zip_file = ZipFile(f, 'w', allowZip64=True)
+
+            # Stream the data file into the archive.
+            if data_file is not None:
+                zip_file.write(data_file, data_filename)
+            else:
+                self.get_data_exporter().write_zip(
+                    iterable, zip_file, data_filename, *args, **kwargs)
+
+            # Write script from template
+            zip_file.writestr(script_filename, template.render(context))
+            zip_file.close()
 
         return zip_file
@@ -6,6 +6,7 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 from collections import defaultdict, namedtuple
+from itertools import izip
 from django.utils.encoding import force_unicode
 from avocado.core import loader
 
@@ -18,6 +19,33 @@ class ExpectedFormatterException(Exception):
     """
 
 
+# Returned by batch format methods in place of values they cannot convert.
+# This is the batch equivalent of raising `ExpectedFormatterException`.
+UNFORMATTED = object()
+
+
+def _normalize_output(output):
+    "Converts the output of a format method into a tuple or list of values."
+    # Backwards compat for dicts.
+    if isinstance(output, dict):
+        warn('Formatter methods should return a tuple '
+             'of values', DeprecationWarning)
+
+        return tuple(output.values())
+
+    if not isinstance(output, (list, tuple)):
+        return (output,)
+
+    return output
+
+
+def _defining_class(cls, name):
+    "Returns the class in the MRO of `cls` that defines attribute `name`."
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass
+
+
 def _unique_dict(fields):
     """Takes a list of fields and returns an ordered dict with unique keys
     based on the field's natural key.
@@ -68,6 +96,64 @@ def _unique_dict(fields):
     return OrderedDict(pairs)
 
 
+class Codebook(object):
+    """Lookup of the values of a coded field by code.
+
+    Codes that are dense integers starting at zero, such as those of fields
+    with predefined choices, are looked up by index in a list.
+    """
+    def __init__(self, pairs):
+        self.mapping = dict(pairs)
+        self.array = None
+
+        keys = self.mapping.keys()
+
+        if all(type(key) is int for key in keys) and \
+                sorted(keys) == range(len(keys)):
+            self.array = [self.mapping[i] for i in xrange(len(keys))]
+
+    def get(self, key):
+        if self.array is not None and type(key) is int and \
+                0 <= key < len(self.array):
+            return self.array[key]
+
+        return self.mapping.get(key)
+
+
+def get_concept_fields(concept):
+    """Returns the concept fields of `concept`, with their fields, in order.
+
+    Concept fields loaded by `preload_concept_fields` are used if present.
+    """
+    preloaded = getattr(concept, '_preloaded_concept_fields', None)
+
+    if preloaded is not None:
+        return tuple(preloaded)
+
+    return tuple(concept.concept_fields.select_related('field')
+                 .order_by('order', 'name'))
+
+
+def preload_concept_fields(concepts):
+    """Loads the concept fields and fields of all `concepts` in a single
+    query so formatters do not query for each concept.
+    """
+    from avocado.models import DataConceptField
+
+    groups = defaultdict(list)
+
+    cfields = DataConceptField.objects\
+        .filter(concept__pk__in=[c.pk for c in concepts])\
+        .select_related('field')\
+        .order_by('order', 'name')
+
+    for cf in cfields:
+        groups[cf.concept_id].append(cf)
+
+    for concept in concepts:
+        concept._preloaded_concept_fields = groups[concept.pk]
+
+
 def process_multiple(func):
     "Decorator for marking a formatter method to process multiple values."
     func.process_multiple = True
@@ -95,9 +181,7 @@ class Formatter(object):
         self.concept = concept
 
         if concept:
-            self.concept_fields = tuple(concept.concept_fields
-                                        .select_related('field')
-                                        .order_by('order', 'name'))
+            self.concept_fields = get_concept_fields(concept)
 
             self.fields = _unique_dict(cf.field
                                        for cf in self.concept_fields)
@@ -123,6 +207,12 @@ class Formatter(object):
                 else:
                     self.single_formats.append(method)
 
+        # Codebooks of coded fields, resolved by `prepare`.
+        self._codebooks = None
+
+        # Batch counterparts of the single-value format methods.
+        self._batch_formats = self._get_batch_formats()
+
         # Keep track of fields/concepts that cause an error to prevent
         # logging the exception twice
         self._errors = set()
@@ -130,6 +220,51 @@ class Formatter(object):
         # Create a bare-bones record class.
         self._recordclass = namedtuple('record', self.field_names)
 
+        # Fields corresponding to each value by position. Fields are only
+        # defined for formatters bound to a concept.
+        self._field_list = tuple(self.fields.get(key)
+                                 for key in self.field_names)
+
+    def prepare(self):
+        """Resolves data the format methods would otherwise look up per
+        value. Exporters call this once before formatting.
+
+        If the `coded` format is used, the codebook of each coded field is
+        fetched up front.
+        """
+        if not any(m.__name__ == 'to_coded' for m in self.single_formats):
+            return
+
+        self._codebooks = {}
+
+        for field in self._field_list:
+            if field is None or field.pk in self._codebooks:
+                continue
+
+            coded_values = field.coded_values()
+
+            if coded_values is not None:
+                self._codebooks[field.pk] = Codebook(list(coded_values))
+
+    def __getstate__(self):
+        # Bound methods and the dynamically created record class cannot be
+        # pickled, so they are referenced by name and recreated.
+        state = self.__dict__.copy()
+        state['single_formats'] = [m.__name__ for m in self.single_formats]
+        state['multi_formats'] = [m.__name__ for m in self.multi_formats]
+        del state['_recordclass']
+        del state['_batch_formats']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.single_formats = [getattr(self, name)
+                               for name in self.single_formats]
+        self.multi_formats = [getattr(self, name)
+                              for name in self.multi_formats]
+        self._recordclass = namedtuple('record', self.field_names)
+        self._batch_formats = self._get_batch_formats()
+
     def __contains__(self, choice):
         return hasattr(self, 'to_{0}'.format(choice))
 
@@ -139,32 +274,31 @@ class Formatter(object):
     def __call__(self, values, kwargs=None):
         "Takes a tuple of values and format it with this prepared formatter."
 
-        # Create a record of the values.
-        record = self._recordclass(*values)
-
         # Process multi-value format methods first.
-        for method in self.multi_formats:
-            try:
-                output = self._process_multiple(method,
-                                                value=record,
-                                                kwargs=kwargs)
-            except ExpectedFormatterException:
-                continue
+        if self.multi_formats:
+            # Create a record of the values.
+            record = self._recordclass(*values)
+
+            for method in self.multi_formats:
+                try:
+                    output = self._process_multiple(method,
+                                                    value=record,
+                                                    kwargs=kwargs)
+                except ExpectedFormatterException:
+                    continue
 
-            return output
+                return output
 
         # Optimization. Return raw values if no single-value formatters
         # are being used.
         if not self.single_formats:
-            return tuple(record)
+            return tuple(values)
 
         # Process each value separately with the corresponding field.
         output = []
 
-        for i, key in enumerate(record._fields):
-            field = self.fields.get(key)
-
-            value = record[i]
+        for i, field in enumerate(self._field_list):
+            raw = value = values[i]
 
             for method in self.single_formats:
                 try:
@@ -180,37 +314,153 @@ class Formatter(object):
 
             # Fallback to the raw value
             else:
-                output.append(record[i])
+                output.append(raw)
 
         return tuple(output)
 
+    @property
+    def passthrough(self):
+        """True if the formatter returns the values it is given unchanged,
+        i.e. no format methods apply and `__call__` is not overridden.
+        """
+        if self.multi_formats or self.single_formats:
+            return False
+
+        return type(self).__call__ == Formatter.__call__
+
     def _process_single(self, method, value, field, kwargs):
         output = method(value, field=field, kwargs=kwargs)
+        return _normalize_output(output)
 
-        # Backwards compat for dicts.
-        if isinstance(output, dict):
-            warn('Formatter methods should return a tuple '
-                 'of values', DeprecationWarning)
+    def _process_multiple(self, method, value, kwargs):
+        output = method(value, fields=self.fields, kwargs=kwargs)
+        return _normalize_output(output)
 
-            return tuple(output.values())
+    def _get_batch_formats(self):
+        """Returns the batch methods of the single-value formats keyed by
+        the name of the single-value method.
 
-        if not isinstance(output, (list, tuple)):
-            return (output,)
+        A batch method is only used if it is defined by the same class as
+        the single-value method or a subclass of it, so overriding a
+        single-value method in a subclass is never bypassed.
+        """
+        batch_formats = {}
 
-        return output
+        for method in self.single_formats:
+            name = method.__name__
+            batch_name = '{0}_batch'.format(name)
 
-    def _process_multiple(self, method, value, kwargs):
-        output = method(value, fields=self.fields, kwargs=kwargs)
+            batch_class = _defining_class(type(self), batch_name)
+
+            if batch_class is None:
+                continue
+
+            if issubclass(batch_class, _defining_class(type(self), name)):
+                batch_formats[name] = getattr(self, batch_name)
+
+        return batch_formats
+
+    def _format_column(self, column, field, kwargs):
+        """Formats the values of one field.
+
+        Returns the output value for each input value and the set of
+        indexes whose output is a sequence of values to be expanded.
+        """
+        output = list(column)
+        expanded = set()
+        pending = range(len(column))
+
+        def store(i, value):
+            # Sequences are expanded the same way as by `__call__`.
+            if isinstance(value, (list, tuple, dict)):
+                value = _normalize_output(value)
+
+                if len(value) != 1:
+                    expanded.add(i)
+                    output[i] = value
+                    return
+
+                value = value[0]
+
+            output[i] = value
+
+        for method in self.single_formats:
+            if not pending:
+                break
+
+            batch = self._batch_formats.get(method.__name__)
+            remaining = []
+
+            if batch is not None:
+                values = [column[i] for i in pending]
+
+                try:
+                    values = batch(values, field=field, kwargs=kwargs)
+                except ExpectedFormatterException:
+                    continue
+
+                for i, value in izip(pending, values):
+                    if value is UNFORMATTED:
+                        remaining.append(i)
+                    else:
+                        store(i, value)
+            else:
+                for i in pending:
+                    try:
+                        value = method(column[i], field=field, kwargs=kwargs)
+                    except ExpectedFormatterException:
+                        remaining.append(i)
+                    else:
+                        store(i, value)
+
+            pending = remaining
+
+        # Values no format applies to keep the raw value, which output
+        # was initialized with.
+        return output, expanded
+
+    def format_batch(self, rows, kwargs=None):
+        """Formats a list of value tuples and returns the list of formatted
+        tuples. The output is the same as calling the formatter on each.
+
+        The values are processed a column at a time. Format methods with a
+        `to_<format>_batch` counterpart receive the whole column and return
+        a list of formatted values, with `UNFORMATTED` in place of values
+        that the next format should be tried for. Other format methods are
+        applied per value.
+        """
+        if self.multi_formats or type(self).__call__ != Formatter.__call__:
+            return [self(values, kwargs=kwargs) for values in rows]
+
+        if not self.single_formats:
+            return [tuple(values) for values in rows]
+
+        if not rows:
+            return []
+
+        columns = []
+        expanded = []
+
+        for column, field in izip(izip(*rows), self._field_list):
+            output, indexes = self._format_column(column, field, kwargs)
+            columns.append(output)
+            expanded.append(indexes)
+
+        if not any(expanded):
+            return zip(*columns)
+
+        output = []
 
-        # Backwards compat for dicts.
-        if isinstance(output, dict):
-            warn('Formatter methods should return a tuple '
-                 'of values', DeprecationWarning)
+        for i, row in enumerate(izip(*columns)):
+            _row = []
 
-            return tuple(output.values())
+            for j, value in enumerate(row):
+                if i in expanded[j]:
+                    _row.extend(value)
+                else:
+                    _row.append(value)
 
-        if not isinstance(output, (list, tuple)):
-            return (output,)
+            output.append(tuple(_row))
 
         return output
 
@@ -296,6 +546,25 @@ class Formatter(object):
 
         return force_unicode(value, strings_only=False)
 
+    def to_string_batch(self, values, **context):
+        output = []
+
+        for value in values:
+            kind = type(value)
+
+            # Shortcuts for the common types produce the same output as
+            # `force_unicode` without the overhead.
+            if kind is unicode:
+                output.append(value)
+            elif kind in (int, long, float, bool):
+                output.append(unicode(value))
+            elif value is None:
+                output.append(u'')
+            else:
+                output.append(force_unicode(value, strings_only=False))
+
+        return output
+
     def to_boolean(self, value, **context):
         # If value is native True or False value, return it
         if type(value) is bool:
@@ -303,6 +572,10 @@ class Formatter(object):
 
         raise ExpectedFormatterException('cannot be converted into a boolean')
 
+    def to_boolean_batch(self, values, **context):
+        return [value if type(value) is bool else UNFORMATTED
+                for value in values]
+
     def to_number(self, value, **context):
         # Attempts to convert a number. Starting with ints and floats
         # Eventually create to_decimal using the decimal library.
@@ -323,11 +596,39 @@ class Formatter(object):
 
         raise ExpectedFormatterException('cannot be converted into a number')
 
+    def to_number_batch(self, values, **context):
+        output = []
+
+        for value in values:
+            if isinstance(value, (int, float)):
+                output.append(value)
+            elif isinstance(value, Decimal):
+                output.append(float(unicode(value)))
+            elif isinstance(value, basestring):
+                if value.isdigit():
+                    output.append(int(value))
+                    continue
+
+                try:
+                    output.append(float(value))
+                except (ValueError, TypeError):
+                    output.append(UNFORMATTED)
+            else:
+                output.append(UNFORMATTED)
+
+        return output
+
     def to_coded(self, value, **context):
         # Attempts to convert value to its coded representation
         field = context.get('field')
 
-        if field:
+        if field and self._codebooks is not None:
+            codebook = self._codebooks.get(field.pk)
+
+            if codebook is not None:
+                return codebook.get(value)
+
+        elif field:
             coded_values = field.coded_values()
 
             if coded_values is not None:
@@ -335,6 +636,23 @@ class Formatter(object):
 
         raise ExpectedFormatterException('field does not support coded values')
 
+    def to_coded_batch(self, values, **context):
+        field = context.get('field')
+
+        if field and self._codebooks is not None:
+            codebook = self._codebooks.get(field.pk)
+
+            if codebook is not None:
+                return [codebook.get(value) for value in values]
+
+        elif field:
+            coded_values = field.coded_values()
+
+            if coded_values is not None:
+                return [coded_values.get(value) for value in values]
+
+        raise ExpectedFormatterException('field does not support coded values')
+
     def to_raw(self, value, **context):
         return value
 
@@ -9,7 +9,7 @@ from django.contrib.auth.models import User
 from django.utils.encoding import smart_unicode
 from django.db.models import Q
 from django.db.models.fields import FieldDoesNotExist
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.core.exceptions import ValidationError
 from avocado.core import utils
 from avocado.core.structures import ChoicesDict
@@ -21,6 +21,9 @@ from avocado import managers, history
 from avocado.query.translators import registry as translators
 from avocado.query.operators import registry as operators
 from avocado.query import oldparsers as parsers
+from avocado.query import bitmaps
+from avocado.query import compiled
+from avocado.query.canonical import fingerprint, query_cache_key
 from avocado.stats.agg import Aggregator
 from avocado import formatters
 
@@ -815,19 +818,46 @@ class DataContext(Base):
         "Validate `attrs` as a context."
         return parsers.datacontext.validate(attrs, **context)
 
-    @cached_method(version='modified')
+    def fingerprint(self):
+        """Returns a fingerprint of the canonical form of this context and
+        the data versions of the fields it references. Equivalent contexts
+        have the same fingerprint.
+        """
+        return fingerprint(context=self.json, versions=True)
+
+    @cached_method(key_func=query_cache_key)
     def count(self, *args, **kwargs):
         return self.apply(*args, **kwargs).values('pk').count()
 
+    def bitmap(self, tree=None, **context):
+        """Returns a bitmap of the primary keys this context matches.
+
+        Bitmaps of multiple contexts can be combined in-process with the `&`,
+        `|` and `-` operators without executing another query. The result of
+        each subtree of the context is cached, so only the conditions that
+        changed since the last evaluation are executed.
+        """
+        bitmap = self.parse(tree=tree, **context).bitmap()
+
+        if bitmap is None:
+            return bitmaps.universe(tree)
+
+        return bitmap
+
     def parse(self, tree=None, **context):
         "Returns a parsed node for this context."
         return parsers.datacontext.parse(self.json, tree=tree, **context)
 
+    def compile(self, tree=None, **context):
+        "Returns a compiled query for this context."
+        return compiled.compile(context=self.json or {}, tree=tree, **context)
+
     def apply(self, queryset=None, tree=None, **context):
         "Applies this context to a QuerySet."
         if tree is None and queryset is not None:
             tree = queryset.model
-        return self.parse(tree=tree, **context).apply(queryset=queryset)
+        return self.compile(tree=tree, **context) \
+            .apply_context(queryset=queryset)
 
     def language(self, tree=None, **context):
         return self.parse(tree=tree, **context).language
@@ -906,13 +936,19 @@ class DataView(Base):
         "Returns a parsed node for this view."
         return parsers.dataview.parse(self.json, tree=tree, **context)
 
-    def apply(self, queryset=None, tree=None, include_pk=True, **context):
+    def compile(self, tree=None, **context):
+        "Returns a compiled query for this view."
+        return compiled.compile(view=self.json or [], tree=tree, **context)
+
+    def apply(self, queryset=None, tree=None, include_pk=True, distinct=False,
+              **context):
         "Applies this context to a QuerySet."
         if tree is None and queryset is not None:
             tree = queryset.model
 
-        return self.parse(tree=tree, **context) \
-            .apply(queryset=queryset, include_pk=include_pk)
+        return self.compile(tree=tree, **context) \
+            .apply_view(queryset=queryset, include_pk=include_pk,
+                        distinct=distinct)
 
     def clean(self):
         from django.core.exceptions import ValidationError
@@ -1024,14 +1060,12 @@ class DataQuery(Base):
     @property
     def context(self):
         # An inverse pk is used to prevent colliding with saved instances.
-        # A pk is necessary for proper cache key formation.
         pk = -self.pk if self.pk else None
         return DataContext(pk=pk, json=self.context_json)
 
     @property
     def view(self):
         # An inverse pk is used to prevent colliding with saved instances.
-        # A pk is necessary for proper cache key formation.
         pk = -self.pk if self.pk else None
         return DataView(pk=pk, json=self.view_json)
 
@@ -1047,7 +1081,15 @@ class DataQuery(Base):
         "Validates `attrs` as a query."
         return parsers.dataquery.validate(attrs, **context)
 
-    @cached_method(version='modified')
+    def fingerprint(self):
+        """Returns a fingerprint of the canonical form of this query and
+        the data versions of the fields it references. Equivalent queries
+        have the same fingerprint.
+        """
+        return fingerprint(context=self.context_json, view=self.view_json,
+                           versions=True)
+
+    @cached_method(key_func=query_cache_key)
     def count(self, *args, **kwargs):
         return self.apply(*args, **kwargs).count()
 
@@ -1065,9 +1107,24 @@ class DataQuery(Base):
         if tree is None and queryset is not None:
             tree = queryset.model
 
-        return self.parse(tree=tree, **context) \
+        return self.compile(tree=tree, **context) \
             .apply(queryset=queryset, distinct=distinct, include_pk=include_pk)
 
+    def compile(self, tree=None, **context):
+        "Returns a compiled query for this query's context and view."
+        return compiled.compile(context=self.context_json or {},
+                                view=self.view_json or [],
+                                tree=tree, **context)
+
+    def plan(self, queryset=None, tree=None, **context):
+        """Returns a description of how this query will be applied, such as
+        whether DISTINCT is required and which to-many joins require it.
+        """
+        if tree is None and queryset is not None:
+            tree = queryset.model
+
+        return self.compile(tree=tree, **context).plan(queryset=queryset)
+
     def clean(self):
         from django.core.exceptions import ValidationError
         if self.template and self.default:
@@ -1154,6 +1211,11 @@ pre_delete.connect(pre_delete_uncache, sender=DataField)
 pre_delete.connect(pre_delete_uncache, sender=DataConcept)
 pre_delete.connect(pre_delete_uncache, sender=DataCategory)
 
+# Invalidate compiled queries when the metadata they were compiled from changes
+for sender in (DataField, DataConcept, DataConceptField):
+    post_save.connect(compiled.bump_metadata_version, sender=sender)
+    post_delete.connect(compiled.bump_metadata_version, sender=sender)
+
 # Register with history API
 if settings.HISTORY_ENABLED:
     history.register(DataContext, fields=('name', 'description', 'json'))
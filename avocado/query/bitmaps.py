@@ -0,0 +1,217 @@
+"""Compressed integer bitmaps for combining sets of primary keys in-process.
+
+A `Bitmap` partitions the integer space into chunks of 65536 values keyed
+by the high 16 bits of the value (similar to Roaring bitmaps). Each chunk is
+stored as a single arbitrary-precision integer which is used as a bitset, so
+set operations are performed by the interpreter in C rather than per value.
+Empty chunks are never stored which keeps sparse sets small.
+"""
+import binascii
+from django.db.models import Q
+from modeltree.tree import trees
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_BYTES = CHUNK_SIZE // 8
+
+# Runs of consecutive values at least this long are emitted as a range
+# lookup rather than being included in the IN clause.
+MIN_RANGE_LENGTH = 8
+
+
+def _chunk_from_lows(lows):
+    "Builds a chunk bitset from a sequence of 16-bit values."
+    buff = bytearray(CHUNK_BYTES)
+
+    for low in lows:
+        buff[low >> 3] |= 1 << (low & 7)
+
+    # The buffer is little-endian, hexlify expects the most significant
+    # byte first.
+    buff.reverse()
+
+    return long(binascii.hexlify(buff), 16)
+
+
+def _lows_from_chunk(chunk):
+    "Generates the 16-bit values set in a chunk bitset in ascending order."
+    raw = '{0:x}'.format(chunk)
+
+    if len(raw) % 2:
+        raw = '0' + raw
+
+    buff = bytearray(binascii.unhexlify(raw))
+    buff.reverse()
+
+    for i, byte in enumerate(buff):
+        if not byte:
+            continue
+
+        offset = i << 3
+
+        for j in xrange(8):
+            if byte & (1 << j):
+                yield offset + j
+
+
+class Bitmap(object):
+    """Compressed set of non-negative integers.
+
+    Bitmaps support the `&`, `|`, `-` and `^` operators as well as `len`,
+    iteration (in ascending order) and membership tests. Instances are
+    picklable so they can be stored in the cache.
+    """
+    def __init__(self, values=None):
+        self._chunks = {}
+
+        if values is not None:
+            self.update(values)
+
+    @classmethod
+    def _from_chunks(cls, chunks):
+        bitmap = cls()
+        bitmap._chunks = dict((k, v) for k, v in chunks.iteritems() if v)
+        return bitmap
+
+    def __repr__(self):
+        return '<Bitmap: {0} values in {1} chunks>'.format(
+            len(self), len(self._chunks))
+
+    def __len__(self):
+        return sum(bin(c).count('1') for c in self._chunks.itervalues())
+
+    def __nonzero__(self):
+        return bool(self._chunks)
+
+    def __contains__(self, value):
+        chunk = self._chunks.get(value >> CHUNK_BITS, 0)
+        return bool(chunk & (1 << (value & CHUNK_MASK)))
+
+    def __iter__(self):
+        for high in sorted(self._chunks):
+            offset = high << CHUNK_BITS
+
+            for low in _lows_from_chunk(self._chunks[high]):
+                yield offset + low
+
+    def __eq__(self, other):
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+        return self._chunks == other._chunks
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __and__(self, other):
+        chunks = {}
+
+        for high, chunk in self._chunks.iteritems():
+            if high in other._chunks:
+                chunks[high] = chunk & other._chunks[high]
+
+        return self._from_chunks(chunks)
+
+    def __or__(self, other):
+        chunks = self._chunks.copy()
+
+        for high, chunk in other._chunks.iteritems():
+            chunks[high] = chunks.get(high, 0) | chunk
+
+        return self._from_chunks(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+
+        for high, chunk in self._chunks.iteritems():
+            chunks[high] = chunk & ~other._chunks.get(high, 0)
+
+        return self._from_chunks(chunks)
+
+    def __xor__(self, other):
+        chunks = self._chunks.copy()
+
+        for high, chunk in other._chunks.iteritems():
+            chunks[high] = chunks.get(high, 0) ^ chunk
+
+        return self._from_chunks(chunks)
+
+    def update(self, values):
+        "Adds an iterable of non-negative integers to the bitmap."
+        groups = {}
+
+        for value in values:
+            if value < 0:
+                raise ValueError('bitmaps only support non-negative integers')
+
+            groups.setdefault(value >> CHUNK_BITS, []) \
+                .append(value & CHUNK_MASK)
+
+        for high, lows in groups.iteritems():
+            chunk = _chunk_from_lows(lows)
+            self._chunks[high] = self._chunks.get(high, 0) | chunk
+
+    def add(self, value):
+        "Adds a single value to the bitmap."
+        self.update((value,))
+
+    def count(self):
+        "Returns the number of values in the bitmap."
+        return len(self)
+
+    def complement(self, universe):
+        "Returns the values in `universe` that are not in this bitmap."
+        return universe - self
+
+    def ranges(self):
+        "Generates inclusive (start, end) pairs of consecutive values."
+        start = end = None
+
+        for value in self:
+            if start is None:
+                start = end = value
+            elif value == end + 1:
+                end = value
+            else:
+                yield start, end
+                start = end = value
+
+        if start is not None:
+            yield start, end
+
+    def as_condition(self, lookup='pk'):
+        """Returns a `Q` object that matches the values in this bitmap.
+
+        Long runs of consecutive values are expressed as range lookups to
+        keep the SQL compact, the remaining values use an IN lookup.
+        """
+        condition = None
+        singles = []
+
+        for start, end in self.ranges():
+            if end - start + 1 < MIN_RANGE_LENGTH:
+                singles.extend(xrange(start, end + 1))
+                continue
+
+            q = Q(**{'{0}__range'.format(lookup): (start, end)})
+            condition = q if condition is None else condition | q
+
+        if singles or condition is None:
+            q = Q(**{'{0}__in'.format(lookup): singles})
+            condition = q if condition is None else condition | q
+
+        return condition
+
+    def filter(self, queryset, lookup='pk'):
+        "Restricts `queryset` to the rows whose `lookup` is in this bitmap."
+        return queryset.filter(self.as_condition(lookup=lookup))
+
+
+def get_bitmap(queryset):
+    "Returns a bitmap of the distinct primary keys in `queryset`."
+    return Bitmap(queryset.values_list('pk', flat=True).distinct())
+
+
+def universe(tree=None):
+    "Returns a bitmap of all primary keys for the root model of `tree`."
+    return get_bitmap(trees[tree].get_queryset())
@@ -0,0 +1,216 @@
+"""Canonical forms of context and view JSON.
+
+Equivalent contexts can be written in many ways: the children of a branch
+can be in any order, conditions can be repeated and clients annotate nodes
+with errors, warnings and language. The canonical form removes these
+differences so equivalent queries produce the same fingerprint and share
+cached results regardless of which user or session issued them.
+"""
+import json
+from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from avocado.core import utils
+from avocado.core.cache.model import cache_key, cache_key_func
+from avocado.query.oldparsers.dataview import convert_legacy
+
+# Keys that affect the result of a condition. Everything else, such as
+# errors, warnings, language and cleaned values, is informational.
+CONDITION_KEYS = ('concept', 'operator', 'value', 'nulls')
+
+# Keys that affect the output of a facet.
+FACET_KEYS = ('concept', 'sort', 'sort_index', 'visible')
+
+# Operators whose value is an unordered collection.
+SET_OPERATORS = ('in', '-in')
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, cls=DjangoJSONEncoder)
+
+
+def _value(value):
+    "Extracts raw values from `{value, label}` objects."
+    if isinstance(value, dict):
+        return value.get('value')
+    if isinstance(value, (list, tuple)):
+        return [_value(x) for x in value]
+    return value
+
+
+def _field_key(key):
+    # List-based natural keys are equivalent to dotted keys
+    if isinstance(key, (list, tuple)):
+        return '.'.join(key)
+    return key
+
+
+def canonical_context(attrs):
+    """Returns the canonical form of a context tree or None if the tree does
+    not restrict the result set.
+
+    Disabled nodes are removed, nested branches of the same type are
+    flattened and branch children are de-duplicated and sorted. Branches
+    with a single child are replaced by the child.
+    """
+    if not attrs or not isinstance(attrs, dict):
+        return
+
+    if attrs.get('enabled') is False:
+        return
+
+    if 'composite' in attrs:
+        return {'composite': attrs['composite']}
+
+    if 'operator' in attrs and 'value' in attrs:
+        node = {'field': _field_key(attrs.get('field', attrs.get('id')))}
+
+        for key in CONDITION_KEYS:
+            if attrs.get(key) is not None:
+                node[key] = attrs[key]
+
+        node['value'] = _value(attrs['value'])
+
+        if node['operator'] in SET_OPERATORS and \
+                isinstance(node['value'], list):
+            try:
+                node['value'] = sorted(set(node['value']))
+            except TypeError:
+                pass
+
+        return node
+
+    if 'type' not in attrs or 'children' not in attrs:
+        return
+
+    branch_type = attrs['type'].lower()
+    children = {}
+
+    for child in attrs['children'] or ():
+        child = canonical_context(child)
+
+        if child is None:
+            continue
+
+        # (a AND (b AND c)) is equivalent to (a AND b AND c)
+        if child.get('type') == branch_type:
+            grandchildren = child['children']
+        else:
+            grandchildren = [child]
+
+        for node in grandchildren:
+            children[_dumps(node)] = node
+
+    if not children:
+        return
+
+    if len(children) == 1:
+        return children.values()[0]
+
+    return {
+        'type': branch_type,
+        'children': [children[key] for key in sorted(children)],
+    }
+
+
+def canonical_view(facets):
+    """Returns the canonical form of a view. The order of the facets is
+    significant and is preserved, disabled facets are removed.
+    """
+    if not facets:
+        return []
+
+    if isinstance(facets, dict):
+        facets = convert_legacy(facets)
+
+    view = []
+
+    for facet in facets:
+        if not isinstance(facet, dict) or facet.get('enabled') is False:
+            continue
+
+        view.append(dict((k, facet[k]) for k in FACET_KEYS
+                         if facet.get(k) is not None))
+
+    return view
+
+
+def _collect(attrs, fields, composites):
+    if not attrs:
+        return
+
+    if 'composite' in attrs:
+        composites.append(attrs['composite'])
+    elif 'children' in attrs:
+        for child in attrs['children']:
+            _collect(child, fields, composites)
+    else:
+        fields.append(attrs['field'])
+
+
+def data_versions(context=None, view=None):
+    """Returns the data versions of the fields referenced by the canonical
+    `context` and `view` and the modified times of referenced composite
+    contexts. Cached results keyed with these are invalidated when the
+    underlying data changes.
+    """
+    from avocado.models import DataContext, DataField
+
+    keys = []
+    composites = []
+    _collect(context, keys, composites)
+
+    condition = Q()
+
+    for key in keys:
+        try:
+            condition |= Q(**utils.parse_field_key(key))
+        except (TypeError, ValueError, UnboundLocalError):
+            continue
+
+    concepts = [facet['concept'] for facet in view or ()
+                if 'concept' in facet]
+
+    if concepts:
+        condition |= Q(concepts__pk__in=concepts)
+
+    versions = []
+
+    if condition:
+        versions.extend(DataField.objects.filter(condition)
+                        .values_list('pk', 'data_version')
+                        .order_by('pk').distinct())
+
+    if composites:
+        versions.extend(DataContext.objects.filter(pk__in=composites)
+                        .values_list('pk', 'modified').order_by('pk'))
+
+    return versions
+
+
+def fingerprint(context=None, view=None, versions=False):
+    """Returns a stable hash for the canonical forms of `context` and `view`.
+
+    If `versions` is true, the data versions of the referenced fields are
+    included so the fingerprint changes when the underlying data does.
+    """
+    context = canonical_context(context)
+    view = canonical_view(view)
+
+    key = ['fingerprint', _dumps(context), _dumps(view)]
+
+    if versions:
+        key.append(_dumps(data_versions(context, view)))
+
+    return cache_key_func(key)
+
+
+def query_cache_key(instance, label=None, version=None, args=None,
+                    kwargs=None):
+    """Cache key function for `cached_method` that keys on the fingerprint
+    of a context, view or query rather than the identity of the instance.
+
+    The instance must implement a `fingerprint` method.
+    """
+    label = cache_key_func([label, instance.fingerprint()])
+
+    return cache_key(label=label, args=args, kwargs=kwargs)
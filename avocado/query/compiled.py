@@ -0,0 +1,290 @@
+"""Compiled queries are the result of parsing and translating a context and
+view. They hold the final condition, annotations, extra, select and order by
+so they can be applied any number of times without resolving fields or
+validating values again.
+
+Compiled queries are picklable and are stored in the query cache keyed by a
+fingerprint of the JSON they were compiled from, the context arguments and
+the metadata version, so identical queries issued by different sessions
+share the result of the parse and translate phase.
+
+The metadata version changes when a field, concept or concept field is
+saved or deleted through the ORM, which invalidates all compiled queries.
+Changes made otherwise, e.g. by `QuerySet.update`, and changes to the data
+are not detected. Since values are validated against the data when a query
+is translated, e.g. against the choices of a field, compiled queries are
+only kept for `COMPILED_QUERY_TIMEOUT` seconds.
+"""
+import time
+from django.db import models
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.core.cache import get_cache
+from modeltree.tree import trees
+from avocado.conf import settings
+from avocado.core.cache.model import cache_key_func, NEVER_EXPIRE
+from avocado.query import canonical, oldparsers as parsers
+from avocado.query.utils import encode_context, has_joins
+
+METADATA_VERSION_KEY = 'avocado:metadata_version'
+
+
+# Used while the cache does not hold a version, e.g. if the cache is
+# unavailable, so the version is stable between calls.
+_default_version = None
+
+
+def metadata_version():
+    """Returns a token identifying the current version of the metadata.
+
+    The token is replaced whenever a field, concept or concept field
+    changes, which invalidates all compiled queries.
+    """
+    global _default_version
+
+    cache = get_cache(settings.QUERY_CACHE)
+    version = cache.get(METADATA_VERSION_KEY)
+
+    if version is None:
+        if _default_version is None:
+            _default_version = repr(time.time())
+
+        # Other processes adopt this version if the cache keeps it.
+        cache.add(METADATA_VERSION_KEY, _default_version,
+                  timeout=NEVER_EXPIRE)
+        version = cache.get(METADATA_VERSION_KEY) or _default_version
+
+    return version
+
+
+def bump_metadata_version(sender=None, **kwargs):
+    "Replaces the metadata version. This is used as a signal receiver."
+    global _default_version
+
+    version = _default_version = repr(time.time())
+    cache = get_cache(settings.QUERY_CACHE)
+    cache.set(METADATA_VERSION_KEY, version, timeout=NEVER_EXPIRE)
+    return version
+
+
+def _has_composite(attrs):
+    "Returns true if the context references other contexts."
+    if not isinstance(attrs, dict):
+        return False
+
+    if 'composite' in attrs:
+        return True
+
+    return any(_has_composite(x) for x in attrs.get('children', ()))
+
+
+def fingerprint(context=None, view=None, tree=None, **kwargs):
+    """Returns a cache key for the query compiled from the arguments.
+    Equivalent contexts and views share the same key.
+
+    None is returned if the context arguments cannot be encoded, in which
+    case the query cannot be cached.
+    """
+    encoded = encode_context(kwargs)
+
+    if encoded is None:
+        return None
+
+    return cache_key_func([
+        'compiled',
+        trees[tree].alias,
+        metadata_version(),
+        canonical.fingerprint(context=context, view=view),
+        encoded,
+    ])
+
+
+class _QuerySetState(object):
+    "Pickled in place of querysets used as values, e.g. subqueries."
+    def __init__(self, queryset):
+        self.model = queryset.model
+        self.query = queryset.query
+        self.db = queryset._db
+
+    def queryset(self):
+        return QuerySet(model=self.model, query=self.query, using=self.db)
+
+
+def _map_values(node, func):
+    "Returns a copy of the `Q` object `node` with `func` applied to values."
+    if node is None:
+        return None
+
+    clone = Q()
+    clone.connector = node.connector
+    clone.negated = node.negated
+    clone.children = []
+
+    for child in node.children:
+        if isinstance(child, Q):
+            child = _map_values(child, func)
+        else:
+            child = (child[0], func(child[1]))
+        clone.children.append(child)
+
+    return clone
+
+
+def _freeze(value):
+    if isinstance(value, QuerySet):
+        return _QuerySetState(value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, _QuerySetState):
+        return value.queryset()
+    return value
+
+
+def _field_label(model, field):
+    return (model._meta.app_label, model._meta.object_name, field.name)
+
+
+def _label_field(label):
+    app_label, model_name, field_name = label
+    model = models.get_model(app_label, model_name)
+    return model, model._meta.get_field(field_name)
+
+
+class CompiledQuery(object):
+    """The product of parsing and translating a context and view relative
+    to a tree.
+
+    The context portion is applied with `apply_context`, the view portion
+    with `apply_view` and both with `apply`. These behave like the `apply`
+    methods of the respective parsed nodes.
+    """
+    def __init__(self, tree=None, context=None, view=None):
+        self.tree = trees[tree].alias
+
+        self.condition = None
+        self.annotations = None
+        self.extra = None
+        self.context_plan = {'distinct': False, 'to_many': []}
+
+        self.select = []
+        self.distinct_select = []
+        self.order_by = []
+        self.view_plan = {'distinct': False, 'to_many': []}
+
+        if context is not None:
+            self.condition = context.condition
+            self.annotations = context.annotations or None
+            self.extra = context.extra or None
+            self.context_plan = context.plan()
+
+        if view is not None:
+            self.select = [_field_label(*f) for f in view._get_select(False)]
+            self.distinct_select = [_field_label(*f)
+                                    for f in view._get_select(True)]
+            self.order_by = view._get_order_by()
+            self.view_plan = view.plan()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['condition'] = _map_values(self.condition, _freeze)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.condition = _map_values(self.condition, _thaw)
+
+    def plan(self, queryset=None):
+        "Describes how the context and view will be applied."
+        context = self.context_plan.copy()
+
+        if has_joins(queryset):
+            context['distinct'] = True
+
+        return {
+            'distinct': context['distinct'] or self.view_plan['distinct'],
+            'context': context,
+            'view': self.view_plan.copy(),
+        }
+
+    def apply_context(self, queryset=None, distinct=True):
+        if queryset is None:
+            queryset = trees[self.tree].get_queryset()
+        if distinct:
+            distinct = self.plan(queryset)['context']['distinct']
+        if self.annotations:
+            queryset = queryset.values('pk').annotate(**self.annotations)
+        if self.condition:
+            queryset = queryset.filter(self.condition)
+        if self.extra:
+            queryset = queryset.extra(**self.extra)
+        if distinct:
+            queryset = queryset.distinct()
+        return queryset
+
+    def apply_view(self, queryset=None, include_pk=True, distinct=False):
+        tree = trees[self.tree]
+
+        if queryset is None:
+            queryset = tree.get_queryset()
+
+        if distinct and not queryset.query.distinct:
+            if not include_pk or self.view_plan['distinct']:
+                queryset = queryset.distinct()
+
+        if queryset.query.distinct:
+            labels = self.distinct_select
+        else:
+            labels = self.select
+
+        fields = [_label_field(label) for label in labels]
+        queryset = tree.add_select(queryset=queryset, include_pk=include_pk,
+                                   *fields)
+
+        if self.order_by:
+            queryset = queryset.order_by(*self.order_by)
+
+        return queryset
+
+    def apply(self, queryset=None, distinct=True, include_pk=True):
+        queryset = self.apply_context(queryset=queryset, distinct=distinct)
+        return self.apply_view(queryset=queryset, include_pk=include_pk,
+                               distinct=distinct)
+
+
+def compile(context=None, view=None, tree=None, **kwargs):
+    """Returns a compiled query for the `context` and `view` JSON.
+
+    Compiled queries are cached by fingerprint unless the context references
+    other contexts which may change independently, or the context arguments
+    cannot be encoded in the fingerprint.
+    """
+    key = None
+
+    if not _has_composite(context):
+        key = fingerprint(context=context, view=view, tree=tree, **kwargs)
+
+    cacheable = key is not None
+
+    if cacheable:
+        cache = get_cache(settings.QUERY_CACHE)
+        compiled = cache.get(key)
+
+        if compiled is not None:
+            return compiled
+
+    context_node = view_node = None
+
+    if context is not None:
+        context_node = parsers.datacontext.parse(context, tree=tree, **kwargs)
+
+    if view is not None:
+        view_node = parsers.dataview.parse(view, tree=tree, **kwargs)
+
+    compiled = CompiledQuery(tree=tree, context=context_node, view=view_node)
+
+    if cacheable:
+        cache.set(key, compiled, timeout=settings.COMPILED_QUERY_TIMEOUT)
+
+    return compiled
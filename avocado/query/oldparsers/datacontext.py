@@ -1,11 +1,23 @@
+import json
+import logging
 from warnings import warn
 from django.db import models
 from avocado.core import utils
+from avocado.core.cache.model import cache_key_func
+from avocado.core.timing import timed
+from avocado.conf import settings
+from avocado.query.bitmaps import get_bitmap
+from avocado.query.utils import encode_context, get_to_many_models, \
+    has_joins
 from modeltree.tree import trees
 from django.db.models.query import QuerySet
+from django.core.cache import get_cache
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.encoding import smart_unicode
 
+log = logging.getLogger(__name__)
+
 AND = 'AND'
 OR = 'OR'
 BRANCH_KEYS = ('children', 'type')
@@ -50,9 +62,95 @@ class Node(object):
         self.tree = tree
         self.context = context
 
+    @property
+    def signature(self):
+        """Canonical hash of this node relative to the tree. Nodes that do not
+        restrict the result set have no signature.
+        """
+
+    @property
+    def cacheable(self):
+        "True if the result of this node can be cached by its signature."
+        return True
+
+    def _tree_label(self):
+        opts = trees[self.tree].root_model._meta
+        return u'{0}.{1}'.format(opts.app_label, opts.module_name)
+
+    def _evaluate(self):
+        """Evaluates this node against the database and returns a bitmap of
+        the matching primary keys.
+        """
+        return get_bitmap(self.apply())
+
+    def bitmap(self):
+        """Returns a bitmap of the primary keys of the root model matching
+        this node or None if this node does not restrict the result set.
+
+        Results are cached by the node's signature, so re-evaluating a tree
+        only hits the database for the subtrees that have changed.
+        """
+        key = self.signature
+
+        if key is None:
+            return
+
+        if not self.cacheable:
+            return self._evaluate()
+
+        cache = get_cache(settings.QUERY_CACHE)
+        bitmap = cache.get(key)
+
+        if bitmap is None:
+            bitmap = self._evaluate()
+            cache.set(key, bitmap)
+
+        return bitmap
+
+    def count(self):
+        "Returns the number of root model rows matching this node."
+        bitmap = self.bitmap()
+
+        if bitmap is None:
+            return trees[self.tree].get_queryset().count()
+
+        return len(bitmap)
+
+    def _to_many_models(self):
+        "Returns the models joined by this node that may multiply rows."
+        return []
+
+    def plan(self, queryset=None):
+        """Describes how this node will be applied to `queryset`.
+
+        DISTINCT is only required if a to-many relationship is joined. Joins
+        that cannot be inspected, such as those added by `extra` or already
+        present on `queryset`, are assumed to multiply rows.
+        """
+        related = []
+
+        for model in self._to_many_models():
+            if model not in related:
+                related.append(model)
+
+        distinct = bool(related or self.extra or has_joins(queryset))
+
+        return {
+            'distinct': distinct,
+            'to_many': [u'{0}.{1}'.format(m._meta.app_label,
+                                          m._meta.module_name)
+                        for m in related],
+        }
+
     def apply(self, queryset=None, distinct=True):
         if queryset is None:
             queryset = trees[self.tree].get_queryset()
+        if distinct:
+            plan = self.plan(queryset)
+            distinct = plan['distinct']
+            log.debug(u'DISTINCT {0} for {1}, to-many joins: {2}'.format(
+                'applied' if distinct else 'skipped', self._tree_label(),
+                ', '.join(plan['to_many']) or 'none'))
         if self.annotations:
             queryset = queryset.values('pk').annotate(**self.annotations)
         if self.condition:
@@ -113,6 +211,45 @@ class Condition(Node):
                 self._field = DataField.objects.get(**field_key)
         return self._field
 
+    @property
+    def signature(self):
+        if not hasattr(self, '_signature'):
+            field = self.field
+
+            # The data version is included to invalidate the result when the
+            # underlying data changes. The context, e.g. the user, is passed
+            # to the translator and may change the result as well.
+            self._signature = cache_key_func([
+                'datacontext',
+                self._tree_label(),
+                field.pk,
+                field.data_version,
+                self.concept_key,
+                self.operator,
+                json.dumps(self.value, sort_keys=True, cls=DjangoJSONEncoder),
+                encode_context(self.context),
+            ])
+        return self._signature
+
+    @property
+    def cacheable(self):
+        # Contexts that cannot be encoded are not part of the signature.
+        return encode_context(self.context) is not None
+
+    def _to_many_models(self):
+        # Conditions applied as subqueries do not join the related tables.
+        if self._meta['query_modifiers'].get('semi_join'):
+            return []
+
+        field = self.field
+        related = get_to_many_models(self.tree, field.model)
+
+        # Conditions on a many-to-many field join the related table as well.
+        if isinstance(field.field, models.ManyToManyField):
+            related.append(field.field.rel.to)
+
+        return related
+
     @property
     def condition(self):
         return self._meta['query_modifiers'].get('condition', None)
@@ -146,6 +283,51 @@ class Branch(Node):
             return q1 | q2
         return q1 & q2
 
+    @property
+    def signature(self):
+        if not hasattr(self, '_signature'):
+            keys = [node.signature for node in self.children]
+            keys = [key for key in keys if key is not None]
+
+            if keys:
+                # Children of a branch are commutative, so the order is
+                # normalized to share results across equivalent trees.
+                self._signature = cache_key_func(
+                    ['datacontext', self.type] + sorted(keys))
+            else:
+                self._signature = None
+        return self._signature
+
+    @property
+    def cacheable(self):
+        return all(node.cacheable for node in self.children)
+
+    def _evaluate(self):
+        # Each child is evaluated (or read from the cache) independently and
+        # the results are combined in-process.
+        bitmap = None
+
+        for node in self.children:
+            other = node.bitmap()
+
+            if other is None:
+                continue
+
+            if bitmap is None:
+                bitmap = other
+            elif self.type == OR:
+                bitmap = bitmap | other
+            else:
+                bitmap = bitmap & other
+
+        return bitmap
+
+    def _to_many_models(self):
+        related = []
+        for node in self.children:
+            related.extend(node._to_many_models())
+        return related
+
     @property
     def condition(self):
         if not hasattr(self, '_condition'):
@@ -196,6 +378,7 @@ class Branch(Node):
         return out
 
 
+@timed('context.validate')
 def validate(attrs, **context):
     if not attrs:
         return None
@@ -237,8 +420,11 @@ def validate(attrs, **context):
                 field = concept.fields.get(**field_key)
             else:
                 field = DataField.objects.get(**field_key)
-            field.validate(operator=attrs['operator'], value=attrs['value'])
+
+            # The condition is validated when it is translated to produce
+            # the language. The field is reused rather than fetched again.
             node = parse(attrs, **context)
+            node._field = field
             attrs['language'] = node.language['language']
 
             value = node._meta['cleaned_data']['value']
@@ -313,6 +499,7 @@ def validate(attrs, **context):
     return attrs
 
 
+@timed('context.parse')
 def parse(attrs, **context):
     if not attrs or attrs.get('enabled') is False:
         node = Node(**context)
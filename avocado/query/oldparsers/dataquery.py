@@ -1,3 +1,4 @@
+from avocado.core.timing import timed
 from . import datacontext as datacontext_parser
 from . import dataview as dataview_parser
 
@@ -13,10 +14,23 @@ class Node(object):
     def apply(self, queryset=None, distinct=True, include_pk=True):
         queryset = \
             self.datacontext_node.apply(queryset=queryset, distinct=distinct)
-        return \
-            self.dataview_node.apply(queryset=queryset, include_pk=include_pk)
+        return self.dataview_node.apply(queryset=queryset,
+                                        include_pk=include_pk,
+                                        distinct=distinct)
 
+    def plan(self, queryset=None):
+        "Describes how the context and view will be applied."
+        context = self.datacontext_node.plan(queryset)
+        view = self.dataview_node.plan()
 
+        return {
+            'distinct': context['distinct'] or view['distinct'],
+            'context': context,
+            'view': view,
+        }
+
+
+@timed('query.validate')
 def validate(attrs, **context):
     if not attrs:
         return
@@ -34,6 +48,7 @@ def validate(attrs, **context):
     return ret_attrs
 
 
+@timed('query.parse')
 def parse(attrs, tree=None, **context):
     if not attrs:
         return Node(**context)
@@ -4,6 +4,8 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 from modeltree.tree import trees
+from avocado.core.timing import timed
+from avocado.query.utils import get_to_many_models
 
 
 SORT_DIRECTIONS = ('asc', 'desc')
@@ -138,13 +140,45 @@ class Node(object):
 
         return order_by
 
+    def plan(self):
+        """Describes how this view will be applied. DISTINCT is only required
+        if a selected or ordered field is reached through a to-many join.
+        """
+        ids = list(self.concept_ids)
+        ordering = self.ordering
+
+        if ordering:
+            ids += list(zip(*ordering)[0])
+
+        related = []
+
+        for fields in self._get_fields_for_concepts(ids).values():
+            for f in fields:
+                for model in get_to_many_models(self.tree, f.model):
+                    if model not in related:
+                        related.append(model)
+
+        return {
+            'distinct': bool(related),
+            'to_many': [u'{0}.{1}'.format(m._meta.app_label,
+                                          m._meta.module_name)
+                        for m in related],
+        }
+
     # Primary method for apply this view to a QuerySet
-    def apply(self, queryset=None, include_pk=True):
+    def apply(self, queryset=None, include_pk=True, distinct=False):
         tree = trees[self.tree]
 
         if queryset is None:
             queryset = tree.get_queryset()
 
+        # Without the primary key the rows are de-duplicated by value, so
+        # DISTINCT is always required. Otherwise it is only required if the
+        # view itself joins a to-many relationship.
+        if distinct and not queryset.query.distinct:
+            if not include_pk or self.plan()['distinct']:
+                queryset = queryset.distinct()
+
         # Add the fields to the queryset
         fields = self._get_select(queryset.query.distinct)
         queryset = tree.add_select(queryset=queryset,
@@ -221,6 +255,7 @@ def convert_legacy(attrs):
     return facets
 
 
+@timed('view.validate')
 def validate(facets, **context):
     if not facets:
         return None
@@ -234,6 +269,12 @@ def validate(facets, **context):
              DeprecationWarning)
         facets = convert_legacy(facets)
 
+    # Fetch the concepts of all facets at once rather than one at a time.
+    # They are keyed by the string pk since facets may reference either.
+    concepts = DataConcept.objects.in_bulk(
+        [attrs['concept'] for attrs in facets if attrs.get('concept')])
+    concepts = dict((str(pk), c) for pk, c in concepts.items())
+
     for attrs in facets:
         enabled = attrs.pop('enabled', None)
         attrs.pop('errors', None)
@@ -247,9 +288,9 @@ def validate(facets, **context):
             enabled = False
             errors.append('Concept is required')
         else:
-            try:
-                concept = DataConcept.objects.get(pk=attrs.get('concept'))
-            except DataConcept.DoesNotExist:
+            concept = concepts.get(str(attrs['concept']))
+
+            if concept is None:
                 enabled = False
                 errors.append('Concept does not exist')
 
@@ -272,6 +313,7 @@ def validate(facets, **context):
     return facets
 
 
+@timed('view.parse')
 def parse(facets, **context):
     if not facets:
         return Node(**context)
@@ -1,7 +1,7 @@
 import logging
 from django.core.exceptions import ValidationError
-from avocado.query import operators
-from avocado.query.validators import Validator, FieldValidator
+from avocado.query import operators, oldparsers
+from avocado.query.validators import Validator, FieldValidator, Resolver
 from avocado.models import DataContext
 
 __all__ = ('BranchParser', 'ConditionParser', 'CompositeParser', 'TreeParser')
@@ -35,6 +35,23 @@ def is_composite(data):
     return 'composite' in data
 
 
+def collect_keys(data, resolver):
+    "Registers the concepts and fields referenced in a context tree."
+    if not data or not isinstance(data, dict):
+        return
+
+    if is_condition(data):
+        resolver.add(concept=data.get('concept'), field=data.get('field'))
+    elif is_branch(data):
+        for child in data['children'] or ():
+            collect_keys(child, resolver)
+
+
+def is_enabled(parser):
+    "Returns true if the parser validated and the node is not disabled."
+    return not parser.errors and parser.data.get('enabled') is not False
+
+
 def get_parser(data):
     if not data or not isinstance(data, dict):
         return
@@ -80,16 +97,49 @@ class BranchParser(Validator):
         cleaned_children = []
 
         if children:
+            self.data['children'] = []
+
             for child in children:
                 parser = get_parser(child)
                 if not parser:
                     self.warn('invalid_child')
+                    self.data['children'].append(child)
                     continue
-                cleaned_children.append(parser(child, **self.context))
+
+                parser = parser(child, **self.context)
+
+                if not parser.is_valid():
+                    self.warn('invalid_child')
+
+                # The child data is annotated with errors and warnings
+                self.data['children'].append(parser.data)
+                cleaned_children.append(parser)
         else:
             self.warn('empty_branch')
         return cleaned_children
 
+    def node(self, tree=None, **context):
+        """Returns an appliable node for this branch or None if no children
+        are enabled.
+        """
+        if not is_enabled(self):
+            return
+
+        children = []
+
+        for parser in self.cleaned_data.get('children', ()):
+            node = parser.node(tree=tree, **context)
+            if node is not None:
+                children.append(node)
+
+        if not children:
+            return
+
+        node = oldparsers.datacontext.Branch(type=self.cleaned_data['type'],
+                                             tree=tree, **context)
+        node.children = children
+        return node
+
 
 class ConditionParser(FieldValidator):
     error_messages = {
@@ -107,20 +157,24 @@ class ConditionParser(FieldValidator):
     error_messages.update(FieldValidator.error_messages)
     warning_messages.update(FieldValidator.warning_messages)
 
-    fields = ('concept', 'field', 'value', 'operator', 'nulls')
+    fields = ('concept', 'field', 'operator', 'value', 'nulls')
 
     def validate_value(self):
-        "Checks the value is valid for the field."
+        "Checks the value is valid for the field and operator."
         field = self.cleaned_data.get('field')
+        operator = self.cleaned_data.get('operator')
 
-        if not field:
+        if not field or not operator:
             return
 
         try:
-            return field.to_python(self.data.get('value'))
+            operator, value = field.validate(operator=operator.uid,
+                                             value=self.data.get('value'))
         except ValidationError:
             self.error('invalid_value_type')
 
+        return value
+
     def validate_operator(self):
         "Checks the operator is valid for the field"
         field = self.cleaned_data.get('field')
@@ -130,8 +184,13 @@ class ConditionParser(FieldValidator):
 
         operator = self.data.get('operator')
 
+        allowed = [uid for uid, name in field.operators]
+
+        if field.nullable:
+            allowed += ['isnull', '-isnull']
+
         # Check if this is a valid operator for the field
-        if operator not in field.operators:
+        if operator not in allowed:
             self.error('invalid_operator')
 
         # Double check this is also registered (in case the above
@@ -154,6 +213,25 @@ class ConditionParser(FieldValidator):
             self.warn('field_not_nullable')
         return nulls
 
+    def node(self, tree=None, **context):
+        "Returns an appliable node for this condition."
+        if not is_enabled(self):
+            return
+
+        field = self.cleaned_data['field']
+        concept = self.cleaned_data.get('concept')
+
+        node = oldparsers.datacontext.Condition(
+            value=self.data['value'], operator=self.data['operator'],
+            field=field.pk, concept=concept and concept.pk, tree=tree,
+            **context)
+
+        # Avoid resolving these again
+        node._field = field
+        node._concept = concept
+
+        return node
+
 
 class CompositeParser(Validator):
     error_messages = {
@@ -170,29 +248,79 @@ class CompositeParser(Validator):
     fields = ('context',)
 
     def validate_context(self):
-        context = self.data.get('context')
+        context = self.data.get('composite')
 
         if not context:
             self.warn('context_not_defined')
 
         kwargs = {'pk': context}
         if 'user' in self.context:
-            kwargs = {'user': self.context['user']}
+            kwargs['user'] = self.context['user']
 
         try:
             return DataContext.objects.get(**kwargs)
         except DataContext.DoesNotExist:
             self.error('context_does_not_exist')
 
+    def node(self, tree=None, **context):
+        "Returns an appliable node for the referenced context."
+        if not is_enabled(self) or not self.cleaned_data.get('context'):
+            return
+
+        parser = TreeParser(self.cleaned_data['context'].json, **self.context)
+
+        if parser.is_valid():
+            return parser.node(tree=tree, **context)
+
 
 class TreeParser(Validator):
+    """Parser for a context tree.
+
+    The concepts and fields referenced by the tree are resolved up front,
+    so validating the tree takes a constant number of queries regardless
+    of its size.
+    """
     error_messages = {
         'invalid': 'invalid data',
     }
 
     def validate(self):
         parser = get_parser(self.data)
-        if parser:
-            self.cleaned_data['tree'] = parser(self.data, **self.context)
-        else:
-            self.error('invalid')
+
+        if not parser:
+            self.errors.append('invalid')
+            return
+
+        if 'resolver' not in self.context:
+            resolver = Resolver(**self.context)
+            collect_keys(self.data, resolver)
+            resolver.resolve()
+            self.context['resolver'] = resolver
+
+        parser = parser(self.data, **self.context)
+
+        if not parser.is_valid():
+            self.errors.extend(parser.errors)
+
+        self.cleaned_data['tree'] = parser
+
+    def _post_validate(self):
+        super(TreeParser, self)._post_validate()
+
+        # Expose the annotated data of the root node
+        if 'tree' in self.cleaned_data:
+            self.data = self.cleaned_data['tree'].data
+
+    def node(self, tree=None, **context):
+        """Returns an appliable node for the tree. Disabled and invalid nodes
+        are excluded.
+        """
+        node = None
+
+        if 'tree' in self.cleaned_data:
+            node = self.cleaned_data['tree'].node(tree=tree, **context)
+
+        if node is None:
+            node = oldparsers.datacontext.Node(tree=tree, **context)
+
+        return node
@@ -0,0 +1,68 @@
+from avocado.query import oldparsers
+from avocado.query.validators import Validator, Resolver
+from . import context as context_parsers, view as view_parsers
+
+__all__ = ('QueryParser',)
+
+
+class QueryParser(Validator):
+    """Parser for a query composed of a context and view.
+
+    The concepts and fields referenced by both the context and the view are
+    resolved together in a constant number of queries.
+    """
+    fields = ('context', 'view')
+
+    def _validate(self):
+        if 'resolver' not in self.context:
+            resolver = Resolver(**self.context)
+
+            context_parsers.collect_keys(self.data.get('context'), resolver)
+            view_parsers.collect_keys(
+                view_parsers.get_facets(self.data.get('view')), resolver)
+
+            resolver.resolve()
+            self.context['resolver'] = resolver
+
+        super(QueryParser, self)._validate()
+
+    def validate_context(self):
+        data = self.data.get('context')
+
+        if not data:
+            return
+
+        parser = context_parsers.TreeParser(data, **self.context)
+        parser.is_valid()
+
+        self.data['context'] = parser.data
+        return parser
+
+    def validate_view(self):
+        data = self.data.get('view')
+
+        if not data:
+            return
+
+        parser = view_parsers.ViewParser(data, **self.context)
+        parser.is_valid()
+
+        self.data['view'] = parser.data['facets']
+        return parser
+
+    def node(self, tree=None, **context):
+        "Returns an appliable node for the context and view."
+        context_parser = self.cleaned_data.get('context')
+        view_parser = self.cleaned_data.get('view')
+
+        if context_parser:
+            context_node = context_parser.node(tree=tree, **context)
+        else:
+            context_node = oldparsers.datacontext.Node(tree=tree, **context)
+
+        if view_parser:
+            view_node = view_parser.node(tree=tree, **context)
+        else:
+            view_node = oldparsers.dataview.Node(tree=tree, **context)
+
+        return oldparsers.dataquery.Node(context_node, view_node)
@@ -0,0 +1,123 @@
+from warnings import warn
+from avocado.query import oldparsers
+from avocado.query.oldparsers.dataview import SORT_DIRECTIONS, convert_legacy
+from avocado.query.validators import Validator, FieldValidator, Resolver
+from .context import is_enabled
+
+__all__ = ('FacetParser', 'ViewParser')
+
+
+def get_facets(data):
+    "Returns the list of facets for a view, converting the legacy format."
+    if isinstance(data, dict):
+        warn('The dict-based view structure has been deprecated. '
+             'A list of facets objects must now be provided.',
+             DeprecationWarning)
+        return convert_legacy(data)
+    return data or []
+
+
+def collect_keys(facets, resolver):
+    "Registers the concepts referenced by a list of facets."
+    for facet in facets:
+        if isinstance(facet, dict):
+            resolver.add(concept=facet.get('concept'))
+
+
+class FacetParser(FieldValidator):
+    "Parser and validator for a view facet."
+
+    error_messages = {
+        'concept_required': 'concept required',
+    }
+
+    warning_messages = {
+        'invalid_sort': 'invalid sort direction, must be "asc" or "desc"',
+        'concept_not_sortable': 'cannot sort by concept',
+    }
+
+    error_messages.update(FieldValidator.error_messages)
+    warning_messages.update(FieldValidator.warning_messages)
+
+    fields = ('concept', 'sort')
+
+    def validate_concept(self):
+        if not self.data.get('concept'):
+            self.error('concept_required')
+        return super(FacetParser, self).validate_concept()
+
+    def validate_sort(self):
+        sort = self.data.get('sort')
+
+        if not sort:
+            return
+
+        if sort not in SORT_DIRECTIONS:
+            self.warn('invalid_sort')
+
+        concept = self.cleaned_data.get('concept')
+
+        if concept and not concept.sortable:
+            self.warn('concept_not_sortable')
+
+        return sort
+
+
+class ViewParser(Validator):
+    """Parser for a view. The concepts of all facets are resolved up front
+    in a constant number of queries.
+    """
+    error_messages = {
+        'invalid': 'invalid data',
+    }
+
+    warning_messages = {
+        'invalid_facet': 'one or more facets are invalid',
+    }
+
+    error_messages.update(Validator.error_messages)
+    warning_messages.update(Validator.warning_messages)
+
+    fields = ('facets',)
+
+    def __init__(self, data, **context):
+        super(ViewParser, self).__init__({'facets': get_facets(data)},
+                                         **context)
+
+    def validate_facets(self):
+        facets = self.data['facets']
+
+        if not isinstance(facets, (list, tuple)):
+            self.error('invalid')
+
+        if 'resolver' not in self.context:
+            resolver = Resolver(**self.context)
+            collect_keys(facets, resolver)
+            resolver.resolve()
+            self.context['resolver'] = resolver
+
+        parsers = []
+        self.data['facets'] = []
+
+        for facet in facets:
+            if not isinstance(facet, dict):
+                self.warn('invalid_facet')
+                continue
+
+            parser = FacetParser(facet, **self.context)
+
+            if not parser.is_valid():
+                self.warn('invalid_facet')
+
+            # The facet data is annotated with errors and warnings
+            self.data['facets'].append(parser.data)
+            parsers.append(parser)
+
+        return parsers
+
+    def node(self, tree=None, **context):
+        "Returns an appliable node for the enabled facets."
+        facets = [p.data for p in self.cleaned_data.get('facets', ())
+                  if is_enabled(p)]
+
+        return oldparsers.dataview.Node(facets, tree=tree, **context)
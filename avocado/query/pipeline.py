@@ -1,12 +1,149 @@
+import os
+import sys
+import time
+import uuid
+import heapq
+import functools
+import hashlib
+import threading
+from collections import deque
+from Queue import Queue, Full
+from django.db import connections
+from django.db.models import Max, Min
+from django.db.models import fields as model_fields
 from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.utils.importlib import import_module
 from modeltree.tree import trees
 from avocado.formatters import RawFormatter
 from avocado.conf import settings
+from avocado.core import timing
+from avocado.export import Checkpoint
+from avocado.query.utils import approximate_count, close_connection, \
+    isolate_queryset
 
 
 QUERY_PROCESSOR_DEFAULT_ALIAS = 'default'
 
+# Put on the queue of a shard once all of its rows have been put.
+_SHARD_DONE = object()
+
+# Returned for the first row of a query with no results.
+_NO_ROWS = object()
+
+
+class _ShardError(object):
+    "Put on the queue of a shard if reading the shard fails."
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class _Descending(object):
+    "Reverses the ordering of a value in a sort key."
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _null_key(value, nulls_last):
+    """Returns a sort key for `value` that orders NULLs the way the
+    database does, i.e. after all values if `nulls_last` is true and before
+    them otherwise, without comparing them to values.
+    """
+    if value is None:
+        return (1 if nulls_last else -1, None)
+
+    return (0, value)
+
+
+# Fields whose values are ordered the same way by the database and Python,
+# which is required to merge shards ordered by them. Text is not, since
+# databases order it by collation.
+_MERGEABLE_FIELDS = (
+    model_fields.AutoField,
+    model_fields.IntegerField,
+    model_fields.FloatField,
+    model_fields.DecimalField,
+    model_fields.DateField,
+    model_fields.TimeField,
+    model_fields.BooleanField,
+    model_fields.NullBooleanField,
+)
+
+
+def _put(queue, item, stopped):
+    """Puts `item` on the bounded `queue`, giving up if the `stopped` event
+    is set while waiting. Returns false if the item was not put.
+    """
+    while True:
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            if stopped.is_set():
+                return False
+
+
+def _read_shard(name, queryset, queue, stopped, width, read):
+    """Reads the rows of a shard on a connection of its own and puts
+    `(key, row)` pairs on `queue`. The last `width` columns of each row are
+    the values it is ordered by and are split off as the key. If `read` is
+    given, it formats the rows.
+    """
+    try:
+        queryset = isolate_queryset(name, queryset)
+
+        try:
+            compiler = queryset.query.get_compiler(queryset.db)
+            keys = deque()
+
+            def rows():
+                for row in compiler.results_iter():
+                    if width:
+                        keys.append(tuple(row[-width:]))
+                        row = row[:-width]
+                    yield row
+
+            if read is not None:
+                rows = read(rows())
+            else:
+                rows = rows()
+
+            for row in rows:
+                key = keys.popleft() if width else None
+
+                if not _put(queue, (key, row), stopped):
+                    break
+        finally:
+            close_connection(name)
+    except Exception:
+        _put(queue, _ShardError(sys.exc_info()), stopped)
+    finally:
+        _put(queue, _SHARD_DONE, stopped)
+
+
+def _shard_rows(queue):
+    while True:
+        item = queue.get()
+
+        if item is _SHARD_DONE:
+            break
+
+        if isinstance(item, _ShardError):
+            raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+
+        yield item
+
 
 class QueryProcessor(object):
     """Prepares and builds a QuerySet for export.
@@ -20,14 +157,18 @@ class QueryProcessor(object):
         self.tree = tree
         self.include_pk = include_pk
 
+    @timing.timed('query.build')
     def get_queryset(self, queryset=None, **kwargs):
         "Returns a queryset with the context and view and view applied."
         if self.context:
             queryset = self.context.apply(queryset=queryset, tree=self.tree)
 
         if self.view:
+            # Rows multiplied by to-many joins in the view are collapsed if a
+            # context is applied, consistent with `DataQuery.apply`.
             queryset = self.view.apply(queryset=queryset, tree=self.tree,
-                                       include_pk=self.include_pk)
+                                       include_pk=self.include_pk,
+                                       distinct=bool(self.context))
 
         if queryset is None:
             queryset = trees[self.tree].get_queryset()
@@ -38,9 +179,10 @@ class QueryProcessor(object):
         """Prepares and returns an exporter for the bound view.
 
         If include_pk is true, a raw formatter is prepended to handle the
-        primary key value.
+        primary key value. Keyword arguments such as `compression` are
+        passed to the exporter.
         """
-        exporter = klass(self.view)
+        exporter = klass(self.view, **kwargs)
 
         if self.include_pk:
             pk_name = trees[self.tree].root_model._meta.pk.name
@@ -48,6 +190,254 @@ class QueryProcessor(object):
 
         return exporter
 
+    def track_progress(self, exporter, name=None, callback=None,
+                       approximate=False, queryset=None, **kwargs):
+        """Tracks the progress of the export by `exporter` of the rows of
+        `queryset` or the processor's queryset. Keyword arguments are passed
+        to `BaseExporter.track_progress`.
+
+        The total is the number of rows of the queryset. If `approximate`
+        is true, the database's estimate is used where it provides one
+        rather than counting the rows, which can take as long as the
+        export itself.
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        total = None
+
+        if approximate:
+            total = approximate_count(queryset)
+
+        if total is None:
+            total = queryset.count()
+
+        return exporter.track_progress(name=name, total=total,
+                                       callback=callback, **kwargs)
+
+    def get_shards(self, shards, method='bounds'):
+        """Splits the primary keys of the root model into `shards` ranges.
+
+        Returns a list of `(lower, upper)` pairs where `lower` is inclusive
+        and `upper` is exclusive. The first and last ranges are open ended,
+        i.e. `None`, so every row belongs to exactly one range.
+
+        The `bounds` method divides the span between the minimum and
+        maximum primary key evenly, which requires integer keys. The
+        `quantiles` method splits at evenly spaced positions in primary key
+        order so each shard has about the same number of rows, at the cost
+        of a query per boundary.
+        """
+        queryset = trees[self.tree].get_queryset()
+
+        if method == 'bounds':
+            bounds = queryset.aggregate(lower=Min('pk'), upper=Max('pk'))
+            lower, upper = bounds['lower'], bounds['upper']
+            boundaries = []
+
+            if lower is not None:
+                step = (upper - lower + 1) / float(shards)
+                boundaries = [lower + int(step * i)
+                              for i in xrange(1, shards)
+                              if int(step * i) > 0]
+        elif method == 'quantiles':
+            count = queryset.count()
+            pks = queryset.order_by('pk').values_list('pk', flat=True)
+
+            boundaries = [pks[count * i // shards]
+                          for i in xrange(1, shards)
+                          if count * i // shards > 0]
+        else:
+            raise ValueError('unknown shard method: {0}'.format(method))
+
+        edges = [None] + sorted(set(boundaries)) + [None]
+
+        return zip(edges[:-1], edges[1:])
+
+    def get_shard_queryset(self, queryset, lower=None, upper=None):
+        "Restricts `queryset` to the root primary key range of a shard."
+        if lower is not None:
+            queryset = queryset.filter(pk__gte=lower)
+
+        if upper is not None:
+            queryset = queryset.filter(pk__lt=upper)
+
+        return queryset
+
+    def _get_order_keys(self):
+        "Returns the model, field and direction of each ordered field."
+        if not self.view:
+            return []
+
+        node = self.view.parse(tree=self.tree)
+        ordering = node.ordering
+
+        if not ordering:
+            return []
+
+        groups = node._get_fields_for_concepts(zip(*ordering)[0])
+        keys = []
+
+        for pk, direction in ordering:
+            for f in groups[pk]:
+                keys.append((f.model, f.order_field,
+                             direction.lower() == 'desc'))
+
+        return keys
+
+    def _get_select_lookups(self):
+        "Returns the lookups of the fields selected for a distinct query."
+        if not self.view:
+            return []
+
+        tree = trees[self.tree]
+        node = self.view.parse(tree=self.tree)
+
+        return [tree.query_string_for_field(field, model=model)
+                for model, field in node._get_select(True)]
+
+    def _has_to_many(self, queryset):
+        """Returns true if several rows of `queryset` may have the same root
+        primary key because of a to-many join.
+        """
+        if self.view and self.view.parse(tree=self.tree).plan()['distinct']:
+            return True
+
+        # Rows multiplied by the context are collapsed by DISTINCT.
+        if self.context and not queryset.query.distinct:
+            return self.context.parse(tree=self.tree).plan()['distinct']
+
+        return False
+
+    def get_sharded_iterable(self, shards=4, method='bounds', queryset=None,
+                             exporter=None, buffer_size=1000,
+                             reader='process_read', processes=None,
+                             **kwargs):
+        """Returns an iterable of the rows of the query which are read in
+        parallel in `shards` ranges of the root primary key.
+
+        Each shard is read in a thread of its own on an isolated connection
+        (see `get_shards` for `method`). If the view is ordered, the shards
+        are merged in that order by comparing the ordering values in Python,
+        otherwise they are concatenated in primary key order. Since Python
+        must order the values the same way as the database, the view can
+        only be ordered by numeric, date, time and boolean fields. NULLs are
+        placed as the database places them.
+
+        If an `exporter` is given, the rows of each shard are formatted by
+        its `reader` method and the iterable yields formatted rows. With
+        `process_read`, the shards share a pool of `processes` worker
+        processes so the rows are formatted in parallel. Other readers
+        format the rows in the shard's thread, so only the queries overlap
+        and formatting is limited by the GIL. The reader must produce one
+        row per row read, so `manual_read` cannot be used. At most
+        `buffer_size` rows per shard are held in memory.
+        """
+        if reader == 'manual_read':
+            raise ValueError('manual_read cannot be used by sharded reads '
+                             'since rows may be dropped')
+
+        if queryset is None:
+            queryset = self.get_queryset(**kwargs)
+
+        if isinstance(queryset, EmptyQuerySet):
+            return iter(())
+
+        keys = self._get_order_keys()
+
+        for model, field, desc in keys:
+            if not isinstance(field, _MERGEABLE_FIELDS):
+                raise ValueError('Sharded reads cannot be ordered by {0}.{1} '
+                                 'since the database and Python may order '
+                                 'its values differently'.format(
+                                     model._meta.object_name, field.name))
+
+        # The values rows are ordered by are appended to the selected
+        # columns so the shards can be merged.
+        if keys:
+            queryset = queryset._clone()
+            select = list(queryset.query.select)
+
+            queryset = trees[self.tree].add_select(
+                queryset=queryset, include_pk=False,
+                *[(model, field) for model, field, desc in keys])
+
+            queryset.query.select = select + list(queryset.query.select)
+
+        read = None
+        pool = None
+
+        # The exporter is shared by the shard threads, so its plan is built
+        # up front rather than lazily by the first thread to use it. The
+        # worker processes are started before the threads as well.
+        if exporter is not None:
+            exporter._get_plan()
+
+            if reader == 'process_read':
+                pool = exporter.get_process_pool(processes)
+                read = functools.partial(exporter.process_read,
+                                         processes=processes, pool=pool)
+            else:
+                read = getattr(exporter, reader)
+
+        # PostgreSQL and Oracle order NULLs as if larger than any value.
+        nulls_last = connections[queryset.db].vendor in ('postgresql',
+                                                         'oracle')
+
+        name = uuid.uuid4().hex
+        stopped = threading.Event()
+        queues = []
+
+        for i, (lower, upper) in enumerate(self.get_shards(shards, method)):
+            queue = Queue(maxsize=buffer_size)
+            queues.append(queue)
+
+            thread = threading.Thread(target=_read_shard, args=(
+                '{0}-{1}'.format(name, i),
+                self.get_shard_queryset(queryset, lower, upper),
+                queue, stopped, len(keys), read))
+
+            thread.daemon = True
+            thread.start()
+
+        return self._merge_shards(queues, [desc for m, f, desc in keys],
+                                  stopped, nulls_last, pool)
+
+    def _merge_shards(self, queues, descending, stopped, nulls_last=False,
+                      pool=None):
+        try:
+            if not descending:
+                for queue in queues:
+                    for key, row in _shard_rows(queue):
+                        yield row
+                return
+
+            def keyed(i, queue):
+                for n, (key, row) in enumerate(_shard_rows(queue)):
+                    key = tuple(_null_key(v, nulls_last) for v in key)
+                    key = tuple(_Descending(v) if desc else v
+                                for v, desc in zip(key, descending))
+
+                    # The shard and position break ties without comparing
+                    # the rows themselves.
+                    yield key, i, n, row
+
+            merged = heapq.merge(*[keyed(i, queue)
+                                   for i, queue in enumerate(queues)])
+
+            for key, i, n, row in merged:
+                yield row
+        finally:
+            # Release shards that are still producing if the iterable is
+            # not fully consumed.
+            stopped.set()
+
+            # Shards submitting more rows fail once the pool is closed, which
+            # waits for the rows already submitted to be formatted.
+            if pool is not None:
+                pool.close()
+                pool.join()
+
     def get_iterable(self, offset=None, limit=None, queryset=None, **kwargs):
         "Returns an iterable that can be used by an exporter."
         if queryset is None:
@@ -67,7 +457,185 @@ class QueryProcessor(object):
 
         compiler = queryset.query.get_compiler(queryset.db)
 
-        return compiler.results_iter()
+        if not timing.enabled():
+            return compiler.results_iter()
+
+        return self._timed_results(compiler)
+
+    def _timed_results(self, compiler):
+        """Generates the results of `compiler` and records the time taken to
+        compile the SQL, execute it and fetch the rows.
+        """
+        compile_times = []
+        as_sql = compiler.as_sql
+
+        def timed_as_sql(*args, **kwargs):
+            start = time.time()
+            sql = as_sql(*args, **kwargs)
+            compile_times.append(time.time() - start)
+            return sql
+
+        compiler.as_sql = timed_as_sql
+
+        # The query is compiled and executed when the first row is
+        # requested, so the time to the first row, less the compilation,
+        # is recorded as the execution.
+        rows = timing.TimedIterator(compiler.results_iter())
+        first = next(rows, _NO_ROWS)
+
+        timing.record('query.compile', sum(compile_times))
+        timing.record('query.execute', rows.seconds - sum(compile_times))
+
+        fetched = rows.seconds
+
+        try:
+            if first is not _NO_ROWS:
+                yield first
+
+                for row in rows:
+                    yield row
+        finally:
+            timing.record('query.fetch', rows.seconds - fetched, rows.rows)
+
+    def resumable_export(self, exporter, path, reader='read',
+                         checkpoint_every=10000, queryset=None, **kwargs):
+        """Writes the export to the file at `path` on local disk,
+        checkpointing progress so a failed or cancelled export is resumed
+        from the last checkpoint rather than started over.
+
+        Every `checkpoint_every` rows the file is synced and a `Checkpoint`
+        is saved. If a checkpoint of the same export exists for `path`, the
+        file is truncated to the checkpointed size and only the remaining
+        rows are queried. If the view is not ordered, rows are read in
+        primary key order and resumed after the last primary key written,
+        otherwise the primary key breaks ties in the ordering and the rows
+        are resumed at the number of rows written. If the rows are distinct
+        and the primary key is not included, or a to-many join gives several
+        rows the same primary key, all selected columns break ties instead
+        and the rows are resumed at the number of rows written.
+
+        `reader` is the name of the exporter method that formats the rows.
+        It must produce one row per row read, so `manual_read` cannot be
+        used. Exporters that write an archive, i.e. those with a
+        `get_data_exporter` method, have the data file written resumably
+        to `path` with a `.data` suffix and the archive is built from it at
+        the end. The checkpoint and data file are removed once the export
+        is complete.
+        """
+        if reader == 'manual_read':
+            raise ValueError('manual_read cannot be used by resumable '
+                             'exports since rows may be dropped')
+
+        # The checkpointed size must fall on a boundary of the output,
+        # which a compressed stream does not have.
+        if exporter.compression is not None:
+            raise ValueError('Compressed exports cannot be resumed')
+
+        if exporter.resumable:
+            data_exporter = exporter
+            data_path = path
+        elif hasattr(exporter, 'get_data_exporter'):
+            data_exporter = exporter.get_data_exporter()
+            data_path = path + '.data'
+        else:
+            raise ValueError('{0} exporter does not support resumable '
+                             'exports'.format(exporter.short_name))
+
+        if queryset is None:
+            queryset = self.get_queryset(**kwargs)
+
+        unique_pk = not self._has_to_many(queryset)
+        keyset = self.include_pk and unique_pk and not self._get_order_keys()
+
+        if keyset:
+            queryset = queryset.order_by('pk')
+        elif unique_pk and (self.include_pk or not queryset.query.distinct):
+            queryset = queryset.order_by(
+                *(list(queryset.query.order_by) + ['pk']))
+        else:
+            # Distinct rows can only be ordered by selected columns and rows
+            # joined to many related rows share a primary key, so all of the
+            # selected columns break ties. Rows that are still tied are
+            # equal, so their order does not change the output.
+            tiebreak = self._get_select_lookups()
+
+            if self.include_pk:
+                tiebreak.append('pk')
+
+            if not tiebreak:
+                raise ValueError('The rows cannot be ordered '
+                                 'deterministically to resume the export')
+
+            queryset = queryset.order_by(
+                *(list(queryset.query.order_by) + tiebreak))
+
+        try:
+            sql = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            sql = None
+
+        key = repr((exporter.short_name, reader, sql))
+        signature = hashlib.md5(key).hexdigest()
+
+        checkpoint = Checkpoint.load(path, signature)
+        resume = checkpoint.rows > 0 and os.path.exists(data_path)
+
+        if resume:
+            f = open(data_path, 'r+b')
+            f.truncate(checkpoint.bytes)
+            f.seek(checkpoint.bytes)
+        else:
+            checkpoint.reset()
+            f = open(data_path, 'wb')
+
+        # Primary keys of the rows read but not yet written.
+        cursors = deque()
+
+        def read_rows():
+            if resume and keyset:
+                rows = self.get_iterable(
+                    queryset=queryset.filter(pk__gt=checkpoint.cursor))
+            elif resume:
+                rows = self.get_iterable(queryset=queryset,
+                                         offset=checkpoint.rows)
+            else:
+                rows = self.get_iterable(queryset=queryset)
+
+            for row in rows:
+                if keyset:
+                    cursors.append(row[0])
+
+                yield row
+
+        def written_rows(rows):
+            for row in rows:
+                yield row
+
+                # The row has been written once the next one is requested.
+                checkpoint.rows += 1
+
+                if keyset:
+                    checkpoint.cursor = cursors.popleft()
+
+                if checkpoint.rows % checkpoint_every == 0:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    checkpoint.bytes = f.tell()
+                    checkpoint.save()
+
+        try:
+            rows = getattr(exporter, reader)(read_rows())
+            data_exporter.write(written_rows(rows), f, resume=resume)
+        finally:
+            f.close()
+
+        if data_path != path:
+            exporter.write(None, path, data_file=data_path)
+            os.remove(data_path)
+
+        checkpoint.delete()
+
+        return path
 
 
 class QueryProcessors(object):
@@ -7,6 +7,7 @@ from avocado.core import loader
 from avocado.conf import settings
 from avocado.core.utils import get_form_class
 from .operators import registry as operators
+from .utils import get_to_many_models
 
 
 OPERATORS = settings.OPERATORS
@@ -150,11 +151,29 @@ class Translator(object):
         return tree.query_condition(field.model._meta.pk, 'isnull', False,
                                     model=field.model)
 
-    def _condition(self, field, operator, value, tree):
+    def _is_to_many(self, field, tree):
+        "Returns true if `field` is reached through a to-many join."
+        if isinstance(field.field, models.ManyToManyField):
+            return True
+        return bool(get_to_many_models(tree, field.model))
+
+    def _semi_join(self, condition, tree):
+        """Rewrites `condition` as a `pk IN (subquery)` filter on the root
+        model. The joins required by the condition are contained in the
+        subquery, so rows of the outer query are never multiplied and no
+        DISTINCT is required to collapse them.
+        """
+        subquery = tree.get_queryset().filter(condition).values('pk')
+        return models.Q(pk__in=subquery)
+
+    def _condition(self, field, operator, value, tree, semi_join=False):
         """Builds a `Q` object for `field` relative to `tree`.
         This handles a few edge cases such as passing a `None` in the list
         of values for an 'in' lookup and ensuring lookups for NULL values do
         not include filled in rows. Read more in `_get_not_null_pk`.
+
+        If `semi_join` is true and `field` is reached through a to-many
+        join, the condition is applied as a subquery. See `_semi_join`.
         """
 
         # Ensure this is a ModelTree instance
@@ -211,6 +230,12 @@ class Translator(object):
             else:
                 condition = null_condition
 
+        # The subquery is built from the non-negated condition so a negated
+        # operator excludes roots having *any* matching related row, which is
+        # consistent with how Django handles negated multi-valued lookups.
+        if semi_join and self._is_to_many(field, tree):
+            condition = self._semi_join(condition, tree)
+
         if operator.negated:
             return ~condition
         return condition
@@ -258,10 +283,17 @@ class Translator(object):
 
         It should be noted that no checks are performed to prevent the same
         name being used for annotations.
+
+        If `semi_join` is true, conditions on fields reached through to-many
+        relationships are applied as subqueries rather than joins. This
+        defaults to the `SEMI_JOIN_TO_MANY` setting.
         """
+        semi_join = kwargs.pop('semi_join', settings.SEMI_JOIN_TO_MANY)
+
         operator, value = \
             self.validate(field, roperator, rvalue, tree, **kwargs)
-        condition = self._condition(field, operator, value, tree)
+        condition = self._condition(field, operator, value, tree,
+                                    semi_join=semi_join)
         language = self.language(field, operator, value, **kwargs)
 
         return {
@@ -277,6 +309,7 @@ class Translator(object):
                 'condition': condition,
                 'annotations': None,
                 'extra': None,
+                'semi_join': semi_join and self._is_to_many(field, tree),
             }
         }
 
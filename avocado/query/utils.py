@@ -1,7 +1,12 @@
+import re
+import json
 import logging
 import django
-from django.db import connections, DEFAULT_DB_ALIAS, DatabaseError
+from django.db import connections, models, DEFAULT_DB_ALIAS, DatabaseError
 from django.core.cache import get_cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.sql.datastructures import EmptyResultSet
+from modeltree.tree import trees
 from avocado.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -10,6 +15,34 @@ logger = logging.getLogger(__name__)
 TEMP_DB_ALIAS_PREFIX = '_db:{0}'
 
 
+class _ContextEncoder(DjangoJSONEncoder):
+    def default(self, obj):
+        # Model instances are referenced by their key
+        if isinstance(obj, models.Model):
+            opts = obj._meta
+            return u'{0}.{1}:{2}'.format(opts.app_label, opts.module_name,
+                                         obj.pk)
+        return super(_ContextEncoder, self).default(obj)
+
+
+def encode_context(context):
+    """Returns the context arguments of a parse or translation, e.g. the
+    user, encoded as JSON for use in cache keys, or None if any of them
+    cannot be encoded.
+    """
+    context = context.copy()
+
+    # Users, including anonymous users which are not model instances, are
+    # referenced by their primary key.
+    if 'user' in context:
+        context['user'] = getattr(context['user'], 'pk', None)
+
+    try:
+        return json.dumps(context, sort_keys=True, cls=_ContextEncoder)
+    except (TypeError, ValueError):
+        return None
+
+
 def ensure_connection(conn):
     if django.VERSION < (1, 6):
         conn.cursor()
@@ -32,6 +65,70 @@ def isolate_queryset(name, queryset):
     return queryset
 
 
+def is_to_many(node):
+    """Returns true if joining `node` to its parent may produce more than
+    one row per parent row.
+    """
+    if node.relation == 'manytomany':
+        return True
+
+    return node.relation == 'foreignkey' and bool(node.reverse)
+
+
+def get_to_many_models(tree, model):
+    """Returns the models along the join path from the root of `tree` to
+    `model` that may multiply the rows of the root model.
+
+    If `model` is not reachable from the root, it is assumed to be to-many.
+    """
+    path = trees[tree]._node_path(model)
+
+    if path is None:
+        return [model]
+
+    return [node.model for node in path if is_to_many(node)]
+
+
+def has_joins(queryset):
+    "Returns true if `queryset` already joins tables to the base table."
+    if queryset is None:
+        return False
+
+    query = queryset.query
+
+    return len([a for a in query.tables if query.alias_refcount[a]]) > 1
+
+
+def approximate_count(queryset):
+    """Returns the query planner's estimate of the number of rows of
+    `queryset`, which is much cheaper than counting them for large queries.
+
+    Only PostgreSQL provides an estimate, None is returned for other
+    backends.
+    """
+    conn = connections[queryset.db]
+    engine = conn.settings_dict['ENGINE']
+
+    if engine != 'django.db.backends.postgresql_psycopg2':
+        return
+
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+
+    c = conn.cursor()
+    c.execute('EXPLAIN ' + sql, params)
+
+    # The first line of the plan is the top node which has the estimated
+    # number of rows returned, e.g. `Seq Scan on t (cost=... rows=42 ...)`
+    plan, = c.fetchone()
+    match = re.search(r'\brows=(\d+)', plan)
+
+    if match:
+        return int(match.group(1))
+
+
 def named_connection(name, db=DEFAULT_DB_ALIAS):
     """Initializes a named connection to a database.
 
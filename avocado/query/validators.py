@@ -1,12 +1,138 @@
 import logging
+from django.db.models import Q
 from django.core.exceptions import ValidationError
 from avocado.core import utils
 from avocado.conf import settings
-from avocado.models import DataConcept, DataField
+from avocado.models import DataConcept, DataField, DataConceptField
 
 log = logging.getLogger(__name__)
 
 
+def _field_key(key):
+    "Returns a hashable lookup for a field key or None if it is invalid."
+    try:
+        return tuple(sorted(utils.parse_field_key(key).items()))
+    except (TypeError, ValueError, UnboundLocalError):
+        return None
+
+
+def _field_matches(field, lookup):
+    for attr, value in lookup:
+        if getattr(field, attr) != value:
+            return False
+    return True
+
+
+class Resolver(object):
+    """Resolves the concepts and fields referenced by a tree of nodes in a
+    constant number of queries.
+
+    Keys are registered with `add` and fetched in bulk by `resolve`.
+    Validators sharing the resolver (passed as the `resolver` context
+    variable) then look up their concept and field in memory. Keys that
+    were not registered fall back to a query.
+    """
+    def __init__(self, **context):
+        self.context = context
+
+        self._concept_keys = set()
+        self._field_keys = set()
+
+        self._concepts = {}
+        self._concept_fields = {}
+        self._fields = []
+
+    def _concept_queryset(self):
+        if 'user' in self.context:
+            return DataConcept.objects.published(user=self.context['user'])
+        return DataConcept.objects.all()
+
+    def _field_queryset(self):
+        if 'user' in self.context:
+            return DataField.objects.published(user=self.context['user'])
+        return DataField.objects.all()
+
+    def add(self, concept=None, field=None):
+        "Registers a concept and/or field key to be resolved."
+        if concept:
+            try:
+                self._concept_keys.add(int(concept))
+            except (TypeError, ValueError):
+                pass
+
+        if field:
+            key = _field_key(field)
+
+            if key is not None:
+                self._field_keys.add(key)
+
+    def resolve(self):
+        "Fetches all registered concepts and fields."
+        if self._concept_keys:
+            queryset = self._concept_queryset() \
+                .filter(pk__in=self._concept_keys)
+
+            self._concepts = dict((c.pk, c) for c in queryset)
+
+            cfields = DataConceptField.objects \
+                .filter(concept__pk__in=self._concepts.keys()) \
+                .select_related('field')
+
+            for cf in cfields:
+                self._concept_fields.setdefault(cf.concept_id, []) \
+                    .append(cf.field)
+
+        if self._field_keys:
+            condition = Q()
+
+            for key in self._field_keys:
+                condition |= Q(**dict(key))
+
+            self._fields = list(self._field_queryset().filter(condition))
+
+    def get_concept(self, pk):
+        "Returns the concept for `pk` or raises `DataConcept.DoesNotExist`."
+        pk = int(pk)
+
+        if pk in self._concepts:
+            return self._concepts[pk]
+
+        # Resolved, but not found
+        if pk in self._concept_keys:
+            raise DataConcept.DoesNotExist
+
+        return self._concept_queryset().get(pk=pk)
+
+    def get_field(self, key, concept=None):
+        """Returns the field for `key`, restricted to the fields of `concept`
+        if given. Raises `DataField.DoesNotExist` or
+        `DataField.MultipleObjectsReturned`.
+        """
+        lookup = _field_key(key)
+
+        if lookup is None:
+            raise DataField.DoesNotExist
+
+        if concept is not None:
+            if concept.pk in self._concepts:
+                fields = self._concept_fields.get(concept.pk, [])
+            else:
+                fields = list(concept.fields.all())
+        elif lookup in self._field_keys:
+            fields = self._fields
+        else:
+            fields = list(self._field_queryset().filter(**dict(lookup)))
+
+        matches = [f for f in fields if _field_matches(f, lookup)]
+
+        if not matches:
+            raise DataField.DoesNotExist
+        if len(matches) > 1:
+            raise DataField.MultipleObjectsReturned
+
+        return matches[0]
+
+
 class Validator(object):
     error_messages = {}
     warning_messages = {}
@@ -153,6 +279,12 @@ class FieldValidator(Validator):
         except ValueError:
             self.error('concept_wrong_format')
 
+        if 'resolver' in self.context:
+            try:
+                return self.context['resolver'].get_concept(kwargs['pk'])
+            except DataConcept.DoesNotExist:
+                self.error('concept_does_not_exist')
+
         if 'user' in self.context:
             queryset = DataConcept.objects.published(user=self.context['user'])
         else:
@@ -172,7 +304,7 @@ class FieldValidator(Validator):
         field = self.data.get('field')
 
         if not field:
-            self.error('field_not_defined')
+            self.error('field_required')
 
         concept = self.cleaned_data.get('concept')
 
@@ -183,16 +315,20 @@ class FieldValidator(Validator):
 
         kwargs = utils.parse_field_key(field)
 
-        # If the concept is defined, restrict to the concept, otherwise
-        # get from the entire set.
-        if concept:
-            queryset = concept.fields.all()
-        elif 'user' in self.context:
-            queryset = DataField.objects.published(user=self.context['user'])
-        else:
-            queryset = DataField.objects.all()
-
         try:
+            if 'resolver' in self.context:
+                return self.context['resolver'].get_field(field, concept)
+
+            # If the concept is defined, restrict to the concept, otherwise
+            # get from the entire set.
+            if concept:
+                queryset = concept.fields.all()
+            elif 'user' in self.context:
+                queryset = DataField.objects.published(
+                    user=self.context['user'])
+            else:
+                queryset = DataField.objects.all()
+
             return queryset.get(**kwargs)
         except DataField.DoesNotExist:
             if concept:
@@ -0,0 +1,66 @@
+"""Compares the results of two runs of the benchmark suite.
+
+Usage:
+
+    python benchmarks/compare.py base.json head.json [--threshold=0.1]
+
+The median times of the benchmarks present in both runs are compared and
+benchmarks that are slower by more than `threshold`, as a fraction of the
+base time, are marked as regressions. Exits with a non-zero status if
+there are any regressions.
+"""
+import sys
+import json
+
+
+def compare(base, head, threshold=0.1):
+    "Prints the comparison and returns the names of regressed benchmarks."
+    regressions = []
+
+    print('{0:<45} {1:>10} {2:>10} {3:>8}'.format(
+        'benchmark', 'base', 'head', 'change'))
+
+    for name in sorted(set(base['benchmarks']) & set(head['benchmarks'])):
+        old = base['benchmarks'][name]
+        new = head['benchmarks'][name]
+
+        if 'error' in old or 'error' in new:
+            print('{0:<45} {1:>10}'.format(name, 'failed'))
+            continue
+
+        change = (new['median'] - old['median']) / (old['median'] or 1e-9)
+        marker = ''
+
+        if change > threshold:
+            regressions.append(name)
+            marker = ' *'
+
+        print('{0:<45} {1:>10.4f} {2:>10.4f} {3:>+7.1%}{4}'.format(
+            name, old['median'], new['median'], change, marker))
+
+    return regressions
+
+
+def main(base_path, head_path, threshold=0.1):
+    with open(base_path) as f:
+        base = json.load(f)
+
+    with open(head_path) as f:
+        head = json.load(f)
+
+    regressions = compare(base, head, threshold)
+
+    if regressions:
+        print('\n{0} regression(s) between {1} and {2}'.format(
+            len(regressions), base['commit'], head['commit']))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    options = dict(arg.lstrip('-').split('=')
+                   for arg in sys.argv[1:] if arg.startswith('--'))
+
+    sys.exit(main(paths[0], paths[1],
+                  threshold=float(options.get('threshold', 0.1))))
@@ -0,0 +1,144 @@
+"""Generates synthetic data for the benchmarks.
+
+Usage:
+
+    python benchmarks/data.py [--employees=1000000] [--seed=0]
+
+The tables of the `tests` models are created if needed and filled with
+`employees` employees and a proportional number of offices, titles,
+projects and meetings. Existing data is removed first. The data is random
+but the same for a given seed, so results are comparable across runs.
+Avocado fields and concepts are then created for the models.
+"""
+import os
+import sys
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+from django.core import management
+from django.db import transaction
+
+from tests.models import Employee, Meeting, Office, Project, Title
+
+# Number of objects inserted per query.
+BATCH_SIZE = 5000
+
+FIRST_NAMES = ('Aaron', 'Ada', 'Ben', 'Clara', 'Eric', 'Erin', 'Jane',
+               'John', 'Mary', 'Miguel', 'Priya', 'Sam', 'Wei', 'Zac')
+
+LAST_NAMES = ('Garcia', 'Johnson', 'Kim', 'Miller', 'Nguyen', 'Patel',
+              'Smith', 'Williams')
+
+LOCATIONS = ('Boston', 'Chicago', 'Denver', 'New York', 'Philadelphia',
+             'Seattle')
+
+TITLES = ('Analyst', 'Architect', 'Developer', 'Director', 'Engineer',
+          'Manager', 'Programmer', 'Scientist')
+
+
+def bulk_create(model, objects):
+    "Inserts `objects` of `model` in batches."
+    batch = []
+
+    for obj in objects:
+        batch.append(obj)
+
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def generate(employees=1000000, seed=0):
+    "Replaces the data of the `tests` models with generated data."
+    rand = random.Random(seed)
+
+    offices = max(1, employees // 1000)
+    titles = max(1, min(employees // 100, 500))
+    projects = max(1, employees // 10)
+    meetings = max(1, employees // 20)
+
+    for model in (Meeting.attendees.through, Meeting,
+                  Project.employees.through, Project, Employee, Title,
+                  Office):
+        model.objects.all().delete()
+
+    bulk_create(Office, (
+        Office(id=i, location='{0} {1}'.format(rand.choice(LOCATIONS), i))
+        for i in xrange(1, offices + 1)))
+
+    bulk_create(Title, (
+        Title(id=i, name='{0} {1}'.format(rand.choice(TITLES), i),
+              salary=rand.randrange(10000, 200000, 1000),
+              boss=rand.random() < 0.1)
+        for i in xrange(1, titles + 1)))
+
+    bulk_create(Employee, (
+        Employee(id=i,
+                 first_name=rand.choice(FIRST_NAMES),
+                 last_name=rand.choice(LAST_NAMES),
+                 title_id=rand.randint(1, titles),
+                 office_id=rand.randint(1, offices),
+                 is_manager=rand.random() < 0.1)
+        for i in xrange(1, employees + 1)))
+
+    start = date(2010, 1, 1)
+
+    bulk_create(Project, (
+        Project(id=i, name='Project {0}'.format(i),
+                manager_id=rand.randint(1, employees),
+                due_date=start + timedelta(days=rand.randint(0, 3650)),
+                budget=Decimal(rand.randint(0, 9999999)) / 100)
+        for i in xrange(1, projects + 1)))
+
+    Through = Project.employees.through
+
+    bulk_create(Through, (
+        Through(project_id=i, employee_id=e)
+        for i in xrange(1, projects + 1)
+        for e in rand.sample(xrange(1, employees + 1),
+                             min(employees, 5))))
+
+    start = datetime(2010, 1, 1, 9)
+
+    def meeting(i):
+        start_time = start + timedelta(hours=rand.randint(0, 87600))
+        return Meeting(id=i, office_id=rand.randint(1, offices),
+                       start_time=start_time,
+                       end_time=start_time + timedelta(hours=1))
+
+    bulk_create(Meeting, (meeting(i) for i in xrange(1, meetings + 1)))
+
+    Through = Meeting.attendees.through
+
+    bulk_create(Through, (
+        Through(meeting_id=i, employee_id=e)
+        for i in xrange(1, meetings + 1)
+        for e in rand.sample(xrange(1, employees + 1),
+                             min(employees, 4))))
+
+
+def main(employees=1000000, seed=0):
+    management.call_command('syncdb', interactive=False, verbosity=0)
+
+    with transaction.commit_on_success():
+        generate(employees, seed)
+
+    management.call_command('avocado', 'init', 'tests', quiet=True)
+
+    print('employees: {0}'.format(Employee.objects.count()))
+    print('projects: {0}'.format(Project.objects.count()))
+    print('meetings: {0}'.format(Meeting.objects.count()))
+
+
+if __name__ == '__main__':
+    options = dict(arg.lstrip('-').split('=') for arg in sys.argv[1:])
+
+    main(employees=int(options.get('employees', 1000000)),
+         seed=int(options.get('seed', 0)))
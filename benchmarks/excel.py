@@ -0,0 +1,56 @@
+"""Benchmarks writing a large Excel export.
+
+Usage:
+
+    python benchmarks/excel.py [--rows=1100000] [--columns=10]
+
+The default row count exceeds the worksheet limit so the rollover to
+additional data sheets is exercised. Reports the elapsed time, the peak
+resident memory of the process and the size of the workbook.
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+from avocado.export import ExcelExporter
+from avocado.formatters import RawFormatter
+
+
+def rows(count, columns):
+    for i in xrange(count):
+        yield tuple([i] + [u'value {0}'.format(i)] * (columns - 1))
+
+
+def main(count=1100000, columns=10):
+    exporter = ExcelExporter()
+    keys = ['column_{0}'.format(i) for i in xrange(columns)]
+    exporter.add_formatter(RawFormatter, keys=keys)
+
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as f:
+        start = time.time()
+        exporter.write(exporter.read(rows(count, columns)), buff=f)
+        elapsed = time.time() - start
+        f.flush()
+        size = os.path.getsize(f.name)
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    print('rows: {0}'.format(count))
+    print('columns: {0}'.format(columns))
+    print('seconds: {0:.2f}'.format(elapsed))
+    print('rows/second: {0:.0f}'.format(count / elapsed))
+    print('peak memory (MB): {0:.1f}'.format(peak))
+    print('file size (MB): {0:.1f}'.format(size / 1024.0 / 1024))
+
+
+if __name__ == '__main__':
+    options = dict(arg.lstrip('-').split('=') for arg in sys.argv[1:])
+
+    main(count=int(options.get('rows', 1100000)),
+         columns=int(options.get('columns', 10)))
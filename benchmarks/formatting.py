@@ -0,0 +1,54 @@
+"""Benchmarks formatting wide rows with the exporter readers.
+
+Usage:
+
+    python benchmarks/formatting.py [--rows=20000] [--columns=300]
+
+Rows are formatted by one formatter per column, as they are for a view
+with one concept per column. Both passthrough formatters (no applicable
+format methods) and formatters applying the `string` and `number` formats
+are measured.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+from avocado.export import BaseExporter
+from avocado.formatters import Formatter
+
+
+def exporter(columns, formats):
+    exporter = BaseExporter(preferred_formats=formats)
+
+    for i in xrange(columns):
+        exporter.add_formatter(Formatter, keys=['column_{0}'.format(i)])
+
+    return exporter
+
+
+def main(count=20000, columns=300):
+    rows = [tuple(xrange(i, i + columns)) for i in xrange(count)]
+
+    for formats in ((), ('string',), ('number', 'string')):
+        exp = exporter(columns, formats)
+
+        for reader in ('read', 'cached_read', 'batch_read'):
+            start = time.time()
+
+            for row in getattr(exp, reader)(rows):
+                pass
+
+            elapsed = time.time() - start
+
+            print('{0} formats={1}: {2:.0f} rows/second'.format(
+                reader, ','.join(formats) or 'none', count / elapsed))
+
+
+if __name__ == '__main__':
+    options = dict(arg.lstrip('-').split('=') for arg in sys.argv[1:])
+
+    main(count=int(options.get('rows', 20000)),
+         columns=int(options.get('columns', 300)))
@@ -0,0 +1,162 @@
+"""Runs the benchmark suite and writes the results as JSON.
+
+Usage:
+
+    python benchmarks/data.py --employees=1000000
+    python benchmarks/run.py [--output=results.json] [--only=export.csv]
+                             [--repeat=5] [--rows=10000] [--points=2000]
+
+The database is populated by `benchmarks/data.py` beforehand. `only`
+restricts the run to benchmarks whose names start with the given prefix,
+`rows` is the number of rows each export benchmark writes and `points` is
+the number of points clustered by the k-means benchmarks.
+
+Each benchmark runs in a process of its own so the memory measurements
+are independent. The timings of `repeat` runs are reported in seconds,
+along with the peak growth in resident memory in kilobytes after the
+benchmark is prepared. The results also record the commit and environment
+so they can be compared with `benchmarks/compare.py`.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import traceback
+import subprocess
+import cPickle as pickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+from django.db import connection, connections
+
+from benchmarks.suite import BENCHMARKS
+from tests.models import Employee
+
+
+def get_commit():
+    "Returns the current commit of the repository, if known."
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(setup, options):
+    "Runs the benchmark prepared by `setup` and returns its measurements."
+    func = setup(options)
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Run once so lazily loaded modules and connections are not timed.
+    func()
+
+    times = []
+
+    for i in xrange(options['repeat']):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on OS X.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == 'darwin':
+        peak_rss, start_rss = peak_rss / 1024, start_rss / 1024
+
+    times.sort()
+
+    return {
+        'repeat': len(times),
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+        'memory': peak_rss - start_rss,
+    }
+
+
+def run(setup, options):
+    """Runs the benchmark in a forked process and returns its measurements,
+    or the traceback if it fails.
+    """
+    # Connections are not shared with the child.
+    for conn in connections.all():
+        conn.close()
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read_fd)
+
+        try:
+            result = measure(setup, options)
+        except Exception:
+            result = {'error': traceback.format_exc()}
+
+        with os.fdopen(write_fd, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+
+        os._exit(0)
+
+    os.close(write_fd)
+
+    with os.fdopen(read_fd, 'rb') as f:
+        data = f.read()
+
+    os.waitpid(pid, 0)
+
+    if not data:
+        return {'error': 'benchmark process exited unexpectedly'}
+
+    return pickle.loads(data)
+
+
+def main(output=None, only=None, repeat=5, rows=10000, points=2000):
+    options = {'repeat': repeat, 'rows': rows, 'points': points}
+
+    results = {
+        'commit': get_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'employees': Employee.objects.count(),
+        'options': options,
+        'benchmarks': {},
+    }
+
+    for name, setup in BENCHMARKS.items():
+        if only and not name.startswith(only):
+            continue
+
+        result = run(setup, options)
+        results['benchmarks'][name] = result
+
+        if 'error' in result:
+            sys.stderr.write('{0}: failed\n{1}\n'.format(
+                name, result['error']))
+        else:
+            sys.stderr.write('{0}: {1:.4f}s median, {2} KB\n'.format(
+                name, result['median'], result['memory']))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    options = dict(arg.lstrip('-').split('=') for arg in sys.argv[1:])
+
+    main(output=options.get('output'),
+         only=options.get('only'),
+         repeat=int(options.get('repeat', 5)),
+         rows=int(options.get('rows', 10000)),
+         points=int(options.get('points', 2000)))
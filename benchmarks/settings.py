@@ -0,0 +1,31 @@
+"""Settings for the benchmark suite.
+
+These extend the test settings with a database of their own, so generated
+data does not interfere with the tests, and a local memory cache so the
+cached data methods can be measured. Postgres is used with the same
+environment variables as the tests, e.g.:
+
+    ENABLE_POSTGRES=1 DEFAULT_ENGINE=postgres python benchmarks/run.py
+"""
+import os
+
+from tests.settings import *  # noqa
+
+if 'sqlite' in DATABASES:  # noqa
+    DATABASES['sqlite']['NAME'] = os.environ.get(  # noqa
+        'BENCHMARK_SQLITE_NAME',
+        os.path.join(os.path.dirname(__file__), 'benchmarks.db'))
+
+# Tables are created directly by syncdb rather than by migrations.
+INSTALLED_APPS = tuple(app for app in INSTALLED_APPS  # noqa
+                       if app != 'south')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+AVOCADO = dict(AVOCADO, DATA_CACHE_ENABLED=True)  # noqa
+
+DEBUG = False
@@ -0,0 +1,234 @@
+"""The benchmarks run by `benchmarks/run.py`.
+
+Each benchmark is a function registered with `benchmark` which takes the
+options of the run, prepares what is measured and returns the function
+that is timed. The preparation is not included in the measurements.
+"""
+import random
+import tempfile
+from collections import OrderedDict
+from django.core.cache import cache
+from django.template import Template
+from avocado import export
+from avocado.models import DataConcept, DataContext, DataField, \
+    DataQuery, DataView
+from avocado.query import compiled, oldparsers as parsers
+from avocado.query.pipeline import QueryProcessor
+from avocado.stats import kmeans
+from avocado.stats.agg import Aggregator
+from tests.models import Employee
+
+BENCHMARKS = OrderedDict()
+
+READERS = ('read', 'cached_read', 'batch_read', 'threaded_read',
+           'cached_threaded_read', 'process_read', 'manual_read')
+
+CONTEXT = {
+    'type': 'and',
+    'children': [{
+        'field': 'tests.employee.first_name',
+        'operator': 'in',
+        'value': ['Aaron', 'Ada', 'Clara', 'Eric', 'Priya'],
+    }, {
+        'field': 'tests.title.salary',
+        'operator': 'gt',
+        'value': 50000,
+    }, {
+        'type': 'or',
+        'children': [{
+            'field': 'tests.employee.is_manager',
+            'operator': 'exact',
+            'value': True,
+        }, {
+            'field': 'tests.office.location',
+            'operator': 'icontains',
+            'value': 'New',
+        }],
+    }, {
+        'field': 'tests.project.name',
+        'operator': 'icontains',
+        'value': '1',
+    }],
+}
+
+VIEW_CONCEPTS = ('First Name', 'Last Name', 'Is Manager', 'Salary',
+                 'Location')
+
+HTML_TEMPLATE = """
+<table>
+    {% for row in rows %}
+        <tr>{% for value in row %}<td>{{ value }}</td>{% endfor %}</tr>
+    {% endfor %}
+</table>
+"""
+
+
+def benchmark(name):
+    "Registers the decorated function as the benchmark `name`."
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def get_field(model_name, field_name):
+    return DataField.objects.get_by_natural_key('tests', model_name,
+                                                field_name)
+
+
+def get_view():
+    return [{'concept': DataConcept.objects.get(name=name).pk}
+            for name in VIEW_CONCEPTS]
+
+
+@benchmark('context.validate')
+def context_validate(options):
+    return lambda: DataContext.validate(CONTEXT, tree=Employee)
+
+
+@benchmark('context.parse')
+def context_parse(options):
+    def run():
+        # Nodes are translated lazily, so the translation is forced.
+        node = parsers.datacontext.parse(CONTEXT, tree=Employee)
+        node.condition
+        node.annotations
+        node.extra
+
+    return run
+
+
+@benchmark('context.apply')
+def context_apply(options):
+    context = DataContext(json=CONTEXT)
+
+    def run():
+        # Invalidate the compiled query so it is parsed and translated.
+        compiled.bump_metadata_version()
+        context.apply(tree=Employee)
+
+    return run
+
+
+@benchmark('context.apply.cached')
+def context_apply_cached(options):
+    context = DataContext(json=CONTEXT)
+    return lambda: context.apply(tree=Employee)
+
+
+@benchmark('translator.translate')
+def translator_translate(options):
+    field = get_field('employee', 'first_name')
+    return lambda: field.translate('in', ['Aaron', 'Ada'], tree=Employee)
+
+
+@benchmark('query.count')
+def query_count(options):
+    query = DataQuery(context_json=CONTEXT, view_json=get_view())
+    return lambda: query.apply(tree=Employee).count()
+
+
+def export_benchmark(klass, reader, **exporter_kwargs):
+    def setup(options):
+        context = DataContext(json=CONTEXT)
+        view = DataView(json=get_view())
+
+        # The primary key is not included since the archive exporters
+        # describe each column by its field.
+        processor = QueryProcessor(context=context, view=view,
+                                   tree=Employee, include_pk=False)
+
+        exporter = processor.get_exporter(klass, **exporter_kwargs)
+        kwargs = {}
+
+        if klass is export.HTMLExporter:
+            kwargs['template'] = Template(HTML_TEMPLATE)
+
+        def run():
+            iterable = processor.get_iterable(limit=options['rows'])
+            rows = getattr(exporter, reader)(iterable)
+
+            with tempfile.TemporaryFile() as f:
+                exporter.write(rows, buff=f, **kwargs)
+
+        return run
+    return setup
+
+
+for name, label in export.registry.choices:
+    for reader in READERS:
+        benchmark('export.{0}.{1}'.format(name, reader))(
+            export_benchmark(export.registry[name], reader))
+
+for compression in export.codecs:
+    benchmark('export.csv.{0}'.format(compression))(
+        export_benchmark(export.CSVExporter, 'read', compression=compression))
+
+
+@benchmark('cached_method.miss')
+def cached_method_miss(options):
+    field = get_field('employee', 'first_name')
+
+    def run():
+        field.values.flush(field)
+        field.values()
+
+    return run
+
+
+@benchmark('cached_method.hit')
+def cached_method_hit(options):
+    field = get_field('employee', 'first_name')
+    cache.clear()
+    field.values()
+
+    return lambda: field.values()
+
+
+@benchmark('aggregator.count')
+def aggregator_count(options):
+    field = get_field('employee', 'first_name')
+    return lambda: Aggregator(field.field).count(distinct=True)
+
+
+@benchmark('aggregator.groupby')
+def aggregator_groupby(options):
+    field = get_field('employee', 'first_name')
+    return lambda: list(Aggregator(field.field).groupby('first_name'))
+
+
+@benchmark('aggregator.stats')
+def aggregator_stats(options):
+    field = get_field('title', 'salary')
+    aggregator = Aggregator(field.field)
+
+    def run():
+        aggregator.avg()
+        aggregator.min()
+        aggregator.max()
+
+    return run
+
+
+@benchmark('kmeans')
+def kmeans_benchmark(options):
+    rand = random.Random(0)
+    points = [[rand.random(), rand.random()]
+              for i in xrange(options['points'])]
+
+    # Fixed initial centroids make the iterations repeatable.
+    return lambda: kmeans.kmeans(points, points[:5])
+
+
+@benchmark('kmeans_optm')
+def kmeans_optm_benchmark(options):
+    rand = random.Random(0)
+    points = [[rand.random(), rand.random()]
+              for i in xrange(options['points'])]
+
+    def run():
+        # The initial centroids are chosen randomly.
+        random.seed(0)
+        kmeans.kmeans_optm(points, k=5)
+
+    return run
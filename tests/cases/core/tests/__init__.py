@@ -2,3 +2,5 @@ from .backup import *       # noqa
 from .cache import *        # noqa
 from .utils import *        # noqa
 from .registry import *     # noqa
+from .timing import *       # noqa
+from .queries import *      # noqa
@@ -0,0 +1,122 @@
+from django.core import management
+from django.db import connection
+from django.test import TestCase
+from avocado import export
+from avocado.core.queries import capture_queries, normalize, query_budget, \
+    QueryBudgetExceeded
+from avocado.models import DataConcept, DataContext, DataField, DataView
+from tests.models import Employee
+
+
+class QueryLogTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize('SELECT "t"."id" FROM "t" WHERE "t"."x" = 10 AND\n'
+                      '"t"."y" IN (%s, %s, %s) AND "t"."z" = \'a\'\'b\' '
+                      'LIMIT 21'),
+            'SELECT "t"."id" FROM "t" WHERE "t"."x" = ? AND '
+            '"t"."y" IN (...) AND "t"."z" = ? LIMIT ?')
+
+    def test_capture(self):
+        use_debug_cursor = connection.use_debug_cursor
+
+        with capture_queries() as outer:
+            for pk in (1, 2, 3):
+                Employee.objects.get(pk=pk)
+
+            with capture_queries() as inner:
+                Employee.objects.count()
+
+        self.assertEqual(connection.use_debug_cursor, use_debug_cursor)
+        self.assertFalse('make_debug_cursor' in connection.__dict__)
+
+        self.assertEqual(len(outer), 4)
+        self.assertEqual(len(inner), 1)
+        self.assertEqual(outer.queries[0]['params'], (1,))
+
+        repeated = outer.repeated()
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][1], 3)
+
+        # Not recorded after the block.
+        Employee.objects.count()
+        self.assertEqual(len(outer), 4)
+
+    def test_sampling(self):
+        with capture_queries(sample_rate=0) as query_log:
+            Employee.objects.count()
+
+        self.assertFalse(query_log.sampled)
+        self.assertEqual(len(query_log), 0)
+
+    def test_budget(self):
+        with query_budget(max_queries=1):
+            Employee.objects.count()
+
+        def exceed(**kwargs):
+            with query_budget(**kwargs):
+                for pk in (1, 2, 3):
+                    Employee.objects.get(pk=pk)
+
+        self.assertRaises(QueryBudgetExceeded, exceed, max_queries=2)
+        self.assertRaises(QueryBudgetExceeded, exceed, max_repeats=2)
+
+
+class QueryBudgetTestCase(TestCase):
+    "Upper bounds on the queries issued by key APIs."
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+
+        DataField.objects.update(published=True)
+        DataConcept.objects.update(published=True)
+
+        self.view = DataView(json=[{'concept': c.pk}
+                                   for c in DataConcept.objects.all()])
+
+        self.context = {
+            'type': 'and',
+            'children': [{
+                'field': 'tests.employee.first_name',
+                'operator': 'in',
+                'value': ['Aaron', 'Eric'],
+            }, {
+                'field': 'tests.title.salary',
+                'operator': 'gt',
+                'value': 1000,
+            }, {
+                'field': 'tests.employee.is_manager',
+                'operator': 'exact',
+                'value': True,
+            }],
+        }
+
+    def test_view(self):
+        with query_budget(max_queries=1):
+            DataView.validate(self.view.json, tree=Employee)
+
+        with query_budget(max_queries=0):
+            self.view.parse(tree=Employee)
+
+    def test_context(self):
+        # The distinct values of enumerable fields are looked up while
+        # validating, which are cached if the data cache is enabled.
+        with query_budget(max_queries=15):
+            DataContext.validate(self.context, tree=Employee)
+
+        with query_budget(max_queries=0):
+            DataContext(json=self.context).parse(tree=Employee)
+
+    def test_exporter(self):
+        with query_budget(max_queries=2):
+            export.CSVExporter(self.view)
+
+    def test_published(self):
+        with query_budget(max_queries=1):
+            list(DataConcept.objects.published())
+
+        with query_budget(max_queries=1):
+            list(DataField.objects.published())
@@ -0,0 +1,141 @@
+import logging
+from django.core import management
+from django.test import TestCase
+from avocado import export
+from avocado.core import timing
+from avocado.models import DataConcept, DataContext, DataView
+from avocado.query.pipeline import QueryProcessor
+from tests.models import Employee
+
+
+class TimingTestCase(TestCase):
+    def test_disabled(self):
+        calls = []
+
+        @timing.timed('stage')
+        def func():
+            calls.append(timing.enabled())
+
+        func()
+
+        self.assertEqual(calls, [False])
+
+    def test_sinks(self):
+        received = []
+
+        def sink(t):
+            received.append(t.stage)
+
+        timing.add_sink(sink)
+
+        try:
+            with timing.collect() as collector:
+                with timing.stage('outer') as s:
+                    s.rows = 10
+
+                    # Nested blocks of the same stage are not timed.
+                    with timing.stage('outer'):
+                        pass
+        finally:
+            timing.remove_sink(sink)
+
+        with timing.stage('after'):
+            pass
+
+        self.assertEqual(received, ['outer'])
+        self.assertEqual(collector.stages(), ['outer'])
+        self.assertEqual(collector.totals()['outer']['rows'], 10)
+
+    def test_failing_sink(self):
+        def sink(t):
+            raise ValueError
+
+        timing.add_sink(sink)
+
+        try:
+            with timing.collect() as collector:
+                timing.record('stage', 1.0)
+        finally:
+            timing.remove_sink(sink)
+
+        self.assertEqual(len(collector.timings), 1)
+
+    def test_timed_iter(self):
+        with timing.collect() as collector:
+            source = timing.TimedIterator(xrange(5))
+            rows = list(timing.timed_iter('stage', (x * 2 for x in source),
+                                          source))
+
+        self.assertEqual(rows, [0, 2, 4, 6, 8])
+
+        t, = collector.timings
+        self.assertEqual(t.rows, 5)
+        self.assertTrue(t.seconds >= 0)
+
+    def test_logging_sink(self):
+        logger = logging.getLogger('avocado.timing.test')
+        logger.setLevel(logging.INFO)
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        handler = Handler()
+        logger.addHandler(handler)
+
+        try:
+            sink = timing.LoggingSink(logger='avocado.timing.test')
+            sink(timing.Timing('export.write', 0.5, 10, 100, 'CSV'))
+        finally:
+            logger.removeHandler(handler)
+
+        self.assertEqual(records, ['export.write 0.500000s label=CSV '
+                                   'rows=10 bytes=100'])
+
+
+class PipelineTimingTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+
+        concept = DataConcept.objects.get(name='First Name')
+
+        self.context = DataContext(json={
+            'field': 'tests.title.salary',
+            'operator': 'gt',
+            'value': 10000,
+        })
+        self.view = DataView(json=[{'concept': concept.pk}])
+
+    def test_export(self):
+        with timing.collect() as collector:
+            self.context.parse(tree=Employee)
+
+            p = QueryProcessor(context=self.context, view=self.view,
+                               tree=Employee)
+            exporter = p.get_exporter(export.CSVExporter)
+            buff = exporter.write(exporter.read(p.get_iterable()))
+
+        totals = collector.totals()
+        count = p.get_queryset().count()
+
+        for stage in ('context.parse', 'view.parse', 'query.build',
+                      'query.compile', 'query.execute', 'query.fetch',
+                      'export.format', 'export.write'):
+            self.assertTrue(stage in totals, stage)
+
+        self.assertEqual(totals['query.fetch']['rows'], count)
+        self.assertEqual(totals['export.format']['rows'], count)
+        self.assertEqual(totals['export.write']['rows'], count)
+        self.assertEqual(totals['export.write']['bytes'], buff.tell())
+
+    def test_no_rows(self):
+        p = QueryProcessor(tree=Employee)
+        queryset = p.get_queryset().filter(pk=0)
+
+        with timing.collect() as collector:
+            self.assertEqual(list(p.get_iterable(queryset=queryset)), [])
+
+        self.assertEqual(collector.totals()['query.fetch']['rows'], 0)
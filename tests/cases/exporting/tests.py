@@ -1,11 +1,19 @@
 import os
+import bz2
+import json
+import zlib
+from decimal import Decimal
+from zipfile import ZipFile
+from cStringIO import StringIO
 from django.test import TestCase
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template import Template
 from django.core import management
 from avocado import export
 from avocado.models import DataField, DataConcept, DataConceptField, DataView
 from avocado.query.pipeline import QueryProcessor
+from avocado.formatters import Formatter, RawFormatter
+from avocado.export._distinct import UniqueRows
 from ... import models
 
 
@@ -75,6 +83,30 @@ class ExportTestCase(TestCase):
         rows = list(it)
         self.assertEqual([r[0] for r in rows], self.pks)
 
+    def test_batch_read(self):
+        it = self.exporter.batch_read(self.iterable, batch_size=4)
+        rows = list(it)
+        self.assertEqual([r[0] for r in rows], self.pks)
+
+    def test_batched_threaded_read(self):
+        it = self.exporter.threaded_read(self.iterable, batch_size=4)
+        rows = list(it)
+        self.assertEqual([r[0] for r in rows], self.pks)
+
+    def test_process_read(self):
+        it = self.exporter.process_read(self.iterable, processes=2,
+                                        batch_size=4)
+        rows = list(it)
+        self.assertEqual([r[0] for r in rows], self.pks)
+
+    def test_process_read_close(self):
+        it = self.exporter.process_read(list(self.iterable), processes=2,
+                                        batch_size=2)
+        self.assertEqual(next(it)[0], self.pks[0])
+
+        # The workers are stopped if the reader is closed early
+        it.close()
+
     def test_manual_read(self):
         it = self.exporter.manual_read(self.iterable)
         rows = list(it)
@@ -95,6 +127,122 @@ class ExportTestCase(TestCase):
         rows = list(it)
         self.assertEqual([r[0] for r in rows], self.pks[2:4])
 
+    def test_plan(self):
+        exporter = export.BaseExporter()
+        exporter.add_formatter(Formatter, keys=['a', 'b'])
+        exporter.add_formatter(Formatter, keys=['c'])
+        exporter.add_formatter(RawFormatter, keys=['d'])
+        exporter.add_formatter(Formatter, keys=['e'])
+
+        # Adjacent passthrough formatters are merged
+        self.assertEqual([(f and f.__class__, start, end)
+                          for f, start, end in exporter._get_plan()],
+                         [(None, 0, 3), (RawFormatter, 3, 4), (None, 4, 5)])
+
+        row = (1, 2, 3, [4], 5)
+        expected = []
+
+        for formatter, length in exporter.params:
+            values, row = row[:length], row[length:]
+            expected.extend(formatter(values))
+
+        self.assertEqual(exporter._format_row((1, 2, 3, [4], 5)),
+                         tuple(expected))
+        self.assertEqual(list(exporter.cached_read([(1, 2, 3, (4,), 5)])),
+                         [tuple(expected)])
+
+    def test_format_cache(self):
+        cache = export.FormatCache(size=2, min_hit_rate=0.5, min_samples=5)
+        calls = []
+
+        def get(key):
+            return cache.get(key, lambda: calls.append(key) or key)
+
+        self.assertEqual([get(k) for k in (1, 2, 1, 3, 2)], [1, 2, 1, 3, 2])
+
+        # 2 was evicted when 3 was added since 1 was used more recently
+        self.assertEqual(calls, [1, 2, 3, 2])
+        self.assertEqual(cache.stats(), {
+            'hits': 1,
+            'misses': 4,
+            'hit_rate': 0.2,
+            'size': 0,
+            'enabled': False,
+        })
+
+        # Values are no longer cached once disabled
+        get(2)
+        self.assertEqual(calls, [1, 2, 3, 2, 2])
+
+    def test_cached_read_stats(self):
+        exporter = export.BaseExporter(preferred_formats=('string',))
+        exporter.add_formatter(Formatter, keys=['a'])
+        exporter.add_formatter(Formatter, keys=['b'])
+        exporter.format_cache_min_samples = 10
+
+        rows = [(i % 2, i) for i in xrange(20)]
+        self.assertEqual(list(exporter.cached_read(rows)),
+                         list(exporter.read(rows)))
+
+        stats = exporter.format_cache_stats()
+
+        self.assertEqual(stats[0]['hits'], 18)
+        self.assertTrue(stats[0]['enabled'])
+
+        # Unique values are not worth caching
+        self.assertEqual(stats[1]['hits'], 0)
+        self.assertFalse(stats[1]['enabled'])
+        self.assertEqual(stats[1]['size'], 0)
+
+    def test_unique_rows(self):
+        unique = UniqueRows(max_size=3)
+        rows = [(1, 'a'), (2, 'b'), (1, 'a'), (3, 'c'), (2, 'b'), (4, 'd'),
+                (3, 'c'), (5, 'e')]
+
+        self.assertEqual([unique.add(r) for r in rows],
+                         [True, True, False, True, False, True, False, True])
+
+        # Keys were moved to disk once the limit was reached
+        self.assertTrue(unique._db is not None)
+        self.assertEqual(len(unique), 5)
+
+        path = unique._path
+        unique.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_unique_rows_equal_values(self):
+        unique = UniqueRows()
+        self.assertTrue(unique.add((1, u'a', Decimal('1.5'))))
+
+        # Equal values of different types are the same row
+        self.assertFalse(unique.add((1L, 'a', Decimal('1.50'))))
+        self.assertFalse(unique.add((Decimal('1.0'), u'a', Decimal('1.5'))))
+        self.assertFalse(unique.add((1.0, 'a', Decimal('15E-1'))))
+
+        self.assertTrue(unique.add((1, u'a', Decimal('1.05'))))
+        self.assertTrue(unique.add((1, u'\xe9', Decimal('1.5'))))
+        self.assertTrue(unique.add((1, '\xc3\xa9', Decimal('1.5'))))
+        self.assertEqual(len(unique), 4)
+
+    def test_manual_read_spill(self):
+        self.exporter.distinct_memory_rows = 2
+
+        it = self.exporter.manual_read(list(self.iterable) * 2)
+        rows = list(it)
+        self.assertEqual([r[0] for r in rows], self.pks)
+
+    def test_preload(self):
+        concepts = [f.concepts.all()[0] for f in DataField.objects.all()]
+        view = DataView(json=[{'concept': c.pk} for c in concepts])
+
+        # The concepts, then the concept fields and fields of all concepts
+        with self.assertNumQueries(2):
+            exporter = export.CSVExporter(view)
+
+        self.assertEqual(len(exporter.params), len(concepts))
+        self.assertEqual(exporter.header,
+                         export.CSVExporter(concepts).header)
+
     def test_write(self):
         it = self.exporter.read(self.iterable)
         rows = list(self.exporter.write(it))
@@ -181,6 +329,30 @@ class FileExportTestCase(TestCase):
 
         os.remove(name)
 
+    def test_excel_sheets(self):
+        from openpyxl import load_workbook
+
+        exporter = export.ExcelExporter(self.concepts)
+        exporter.max_rows = 3
+
+        it = exporter.read(self.query)
+        buff = exporter.write(it)
+        buff.seek(0)
+
+        wb = load_workbook(buff)
+
+        self.assertEqual(wb.get_sheet_names(), [
+            'Data', 'Data (2)', 'Data (3)', 'Data Dictionary'])
+
+        rows = []
+
+        for title in wb.get_sheet_names()[:-1]:
+            ws_rows = list(wb.get_sheet_by_name(title).rows)
+            self.assertEqual(len(ws_rows), 3)
+            rows.extend(ws_rows[1:])
+
+        self.assertEqual(len(rows), self.query.count())
+
     def test_sas(self):
         name = 'sas_export.zip'
         exp_size = 1340
@@ -219,8 +391,34 @@ class FileExportTestCase(TestCase):
         size = os.path.getsize(name)
         self.assertAlmostEqual(size, exp_size, delta=delta)
 
+        with open(name) as f:
+            data = json.load(f)
+
+        self.assertEqual(len(data), self.query.count())
+        self.assertEqual(set(data[0]), set(f['name']
+                                           for f in exporter.header))
+
         os.remove(name)
 
+    def test_ndjson(self):
+        name = 'export.ndjson'
+
+        exporter = export.NDJSONExporter(self.concepts)
+        it = exporter.read(self.query)
+
+        exporter.write(it, buff=name)
+
+        with open(name) as f:
+            records = [json.loads(line) for line in f]
+
+        os.remove(name)
+
+        json_exporter = export.JSONExporter(self.concepts)
+        buff = json_exporter.write(json_exporter.read(self.query))
+
+        self.assertEqual(records, json.loads(buff.getvalue()))
+        self.assertTrue('ndjson' in export.registry)
+
     def test_html(self):
         name = 'export.html'
         exp_size = 1960
@@ -249,6 +447,89 @@ class ResponseExportTestCase(FileExportTestCase):
 
         self.assertAlmostEqual(len(response.content), exp_size, delta=delta)
 
+    def test_batch_read(self):
+        for exporter_class in (export.CSVExporter, export.RExporter,
+                               export.JSONExporter):
+            exporter = exporter_class(self.concepts)
+            rows = list(exporter.read(self.query))
+
+            it = exporter.batch_read(self.query, batch_size=4)
+            self.assertEqual(list(it), rows)
+
+    def test_process_read(self):
+        exporter = export.CSVExporter(self.concepts)
+        rows = list(exporter.read(self.query))
+
+        it = exporter.process_read(self.query, processes=2, batch_size=4)
+        self.assertEqual(list(it), rows)
+
+    def test_csv_stream(self):
+        exporter = export.CSVExporter(self.concepts)
+
+        buff = exporter.write(exporter.read(self.query))
+        chunks = list(exporter.stream(exporter.read(self.query),
+                                      chunk_size=50))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), buff.getvalue())
+
+        for reader in ('cached_read', 'threaded_read'):
+            it = getattr(exporter, reader)(self.query)
+            response = StreamingHttpResponse(exporter.stream(it))
+            self.assertEqual(''.join(response.streaming_content),
+                             buff.getvalue())
+
+    def test_compression(self):
+        decompress = {
+            'gzip': lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS),
+            'bzip2': bz2.decompress,
+        }
+
+        for exporter_class in (export.CSVExporter, export.JSONExporter,
+                               export.NDJSONExporter):
+            exporter = exporter_class(self.concepts)
+            data = exporter.write(exporter.read(self.query)).getvalue()
+
+            for compression in decompress:
+                codec = export.codecs[compression]
+                exporter = exporter_class(self.concepts,
+                                          compression=compression)
+
+                self.assertEqual(exporter.file_extension, '{0}.{1}'.format(
+                    exporter_class.file_extension, codec.extension))
+                self.assertEqual(exporter.content_type, codec.content_type)
+
+                response = HttpResponse()
+                exporter.write(exporter.read(self.query), buff=response)
+
+                self.assertEqual(
+                    decompress[compression](response.content), data)
+
+    def test_compressed_stream(self):
+        exporter = export.CSVExporter(self.concepts)
+        data = exporter.write(exporter.read(self.query)).getvalue()
+
+        exporter = export.CSVExporter(self.concepts, compression='gzip')
+        response = StreamingHttpResponse(
+            exporter.stream(exporter.read(self.query), chunk_size=50))
+
+        content = ''.join(response.streaming_content)
+        self.assertEqual(zlib.decompress(content, 16 + zlib.MAX_WBITS), data)
+
+    def test_compression_errors(self):
+        self.assertRaises(ValueError, export.CSVExporter, self.concepts,
+                          compression='rar')
+        self.assertRaises(ValueError, export.RExporter, self.concepts,
+                          compression='gzip')
+
+        class FailingFile(object):
+            def write(self, data):
+                raise IOError
+
+        exporter = export.CSVExporter(self.concepts, compression='gzip')
+        self.assertRaises(IOError, exporter.write,
+                          exporter.read(self.query), FailingFile())
+
     def test_excel(self):
         exp_size = 6120
 
@@ -282,6 +563,23 @@ class ResponseExportTestCase(FileExportTestCase):
 
         self.assertAlmostEqual(len(response.content), exp_size, delta=delta)
 
+    def test_zip_contents(self):
+        for exporter_class in (export.RExporter, export.SASExporter):
+            response = HttpResponse()
+            exporter = exporter_class(self.concepts)
+
+            it = exporter.read(self.query)
+            exporter.write(it, buff=response)
+
+            data_exporter = export.CSVExporter(
+                self.concepts, preferred_formats=exporter.preferred_formats)
+            it = data_exporter.read(self.query)
+            data = data_exporter.write(it).getvalue()
+
+            zip_file = ZipFile(StringIO(response.content))
+            self.assertEqual(zip_file.read('data.csv'), data)
+            self.assertEqual(len(zip_file.namelist()), 2)
+
     def test_json(self):
         exp_size = 630
 
@@ -306,6 +604,81 @@ class ResponseExportTestCase(FileExportTestCase):
         self.assertAlmostEqual(len(response.content), exp_size, delta=delta)
 
 
+class ProgressTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+
+        concept = DataConcept.objects.get(name='First Name')
+        view = DataView(json=[{'concept': concept.pk}])
+
+        self.processor = QueryProcessor(view=view, tree=models.Employee)
+        self.count = self.processor.get_queryset().count()
+
+    def test_write(self):
+        snapshots = []
+
+        p = self.processor
+        exporter = p.get_exporter(export.CSVExporter)
+        progress = p.track_progress(exporter, name='test-write',
+                                    callback=snapshots.append, interval=0)
+
+        self.assertEqual(progress.total, self.count)
+
+        buff = exporter.write(exporter.read(p.get_iterable()))
+
+        # Reported for each row written and once finished.
+        running = [s for s in snapshots if s['state'] == 'running']
+        self.assertTrue(running)
+        self.assertTrue(all(s['fetched'] >= s['formatted'] >= s['written']
+                            for s in running))
+
+        snapshot = snapshots[-1]
+        self.assertEqual(snapshot['state'], 'done')
+        self.assertEqual(snapshot['fetched'], self.count)
+        self.assertEqual(snapshot['formatted'], self.count)
+        self.assertEqual(snapshot['written'], self.count)
+        self.assertEqual(snapshot['bytes'], buff.tell())
+        self.assertEqual(snapshot['percent'], 100.0)
+        self.assertEqual(snapshot['eta'], None)
+        self.assertTrue(snapshot['rows_per_second'] > 0)
+
+        self.assertEqual(export.get_progress('test-write'), snapshot)
+        export.clear_progress('test-write')
+        self.assertEqual(export.get_progress('test-write'), None)
+
+    def test_stream(self):
+        p = self.processor
+        exporter = p.get_exporter(export.CSVExporter)
+        progress = p.track_progress(exporter, approximate=True)
+
+        chunks = list(exporter.stream(exporter.read(p.get_iterable()),
+                                      chunk_size=50))
+
+        self.assertEqual(progress.state, 'done')
+        self.assertEqual(progress.written, self.count)
+        self.assertEqual(progress.bytes, len(''.join(chunks)))
+
+    def test_fail(self):
+        p = self.processor
+        exporter = p.get_exporter(export.CSVExporter)
+        progress = exporter.track_progress()
+
+        def rows():
+            for i, row in enumerate(p.get_iterable()):
+                if i == 2:
+                    raise RuntimeError
+                yield row
+
+        self.assertRaises(RuntimeError, exporter.write,
+                          exporter.read(rows()))
+
+        self.assertEqual(progress.state, 'failed')
+        self.assertEqual(progress.fetched, 2)
+        self.assertEqual(progress.total, None)
+
+
 class ForceDistinctRegressionTestCase(TestCase):
     fixtures = ['tests/fixtures/employee_data.json']
 
@@ -1,7 +1,13 @@
+from collections import namedtuple
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 from django.test import TestCase
 from django.core import management
 from avocado.models import DataField, DataConcept, DataConceptField
-from avocado.formatters import Formatter
+from avocado.formatters import Codebook, ExpectedFormatterException, \
+    Formatter
 
 
 class FormatterTestCase(TestCase):
@@ -75,6 +81,63 @@ class FormatterTestCase(TestCase):
 
         self.assertEqual(fvalues, expected)
 
+    def test_prepare_coded(self):
+        name = DataField.objects.get_by_natural_key('tests', 'title', 'name')
+        name.code_field_name = 'id'
+        name.save()
+
+        f = Formatter(self.concept, formats=['coded'])
+        f.prepare()
+
+        self.assertEqual(f._codebooks.keys(), [name.pk])
+
+        with self.assertNumQueries(0):
+            fvalues = f(self.values)
+
+        self.assertEqual(fvalues, Formatter(self.concept,
+                                            formats=['coded'])(self.values))
+
+    def test_codebook(self):
+        codebook = Codebook([(0, 'a'), (1, 'b'), (2, 'c')])
+        self.assertEqual(codebook.array, ['a', 'b', 'c'])
+        self.assertEqual([codebook.get(k) for k in (0, 2, 3, -1, 1.0, True)],
+                         ['a', 'c', None, None, 'b', 'b'])
+
+        codebook = Codebook([(1, 'a'), ('x', 'b')])
+        self.assertEqual(codebook.array, None)
+        self.assertEqual(codebook.get('x'), 'b')
+
+    def test_format_batch(self):
+        Pair = namedtuple('Pair', ('a', 'b'))
+
+        class StringFormatter(Formatter):
+            def to_string(self, value, **context):
+                return u'<{0}>'.format(value)
+
+            def to_pair(self, value, **context):
+                if value is None:
+                    raise ExpectedFormatterException
+                return (value, value)
+
+            def to_dict(self, value, **context):
+                return OrderedDict([('a', value), ('b', value)])
+
+            def to_record(self, value, **context):
+                return Pair(value, value)
+
+        rows = [self.values, ['QA', '1.5', None], [None, 'x', False]]
+
+        for formats in (['string'], ['number', 'string'], ['boolean'],
+                        ['coded', 'number'], ['pair', 'string'], ['dict'],
+                        ['record'], []):
+            for cls in (Formatter, StringFormatter):
+                f = cls(self.concept, formats=formats)
+                self.assertEqual(f.format_batch(rows), [f(v) for v in rows])
+
+        # Batch methods do not bypass overridden single value methods
+        f = StringFormatter(self.concept, formats=['string'])
+        self.assertEqual(f._batch_formats, {})
+
     def test_to_html(self):
         class HtmlFormatter(Formatter):
             def to_html(self, values, **context):
@@ -625,7 +625,7 @@ class DataQueryTestCase(TestCase):
 
         self.assertEqual(
             unicode(query.apply(tree=Employee).query).replace(' ', ''),
-            'SELECT DISTINCT "tests_employee"."id", '
+            'SELECT "tests_employee"."id", '
             '"tests_office"."location" FROM '
             '"tests_employee" INNER JOIN "tests_title" ON '
             '("tests_employee"."title_id" = "tests_title"."id") INNER JOIN '
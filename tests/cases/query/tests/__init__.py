@@ -3,3 +3,6 @@ from .parsers import *          # noqa
 from .translators import *      # noqa
 from .utils import *            # noqa
 from .pipeline import *         # noqa
+from .bitmaps import *          # noqa
+from .compiled import *         # noqa
+from .canonical import *        # noqa
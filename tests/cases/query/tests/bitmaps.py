@@ -0,0 +1,94 @@
+import cPickle as pickle
+from django.test import TestCase
+from django.core import management
+from avocado.models import DataContext
+from avocado.query.bitmaps import Bitmap, universe
+from ....models import Employee
+
+
+class BitmapTestCase(TestCase):
+    def test_values(self):
+        values = [0, 1, 7, 65535, 65536, 70000, 10 ** 9]
+        bm = Bitmap(values)
+
+        self.assertEqual(list(bm), values)
+        self.assertEqual(len(bm), 7)
+        self.assertTrue(70000 in bm)
+        self.assertFalse(70001 in bm)
+
+    def test_empty(self):
+        bm = Bitmap()
+        self.assertFalse(bm)
+        self.assertEqual(len(bm), 0)
+        self.assertEqual(list(bm), [])
+
+    def test_negative(self):
+        self.assertRaises(ValueError, Bitmap, [-1])
+
+    def test_operators(self):
+        a = Bitmap([1, 2, 3, 100000])
+        b = Bitmap([2, 3, 4, 200000])
+
+        self.assertEqual(list(a & b), [2, 3])
+        self.assertEqual(list(a | b), [1, 2, 3, 4, 100000, 200000])
+        self.assertEqual(list(a - b), [1, 100000])
+        self.assertEqual(list(a ^ b), [1, 4, 100000, 200000])
+        self.assertEqual(list(a.complement(a | b)), [4, 200000])
+
+        # Empty chunks are dropped
+        self.assertEqual((a & b)._chunks.keys(), [0])
+
+    def test_ranges(self):
+        bm = Bitmap([1, 2, 3, 5, 7, 8])
+        self.assertEqual(list(bm.ranges()), [(1, 3), (5, 5), (7, 8)])
+
+    def test_condition(self):
+        bm = Bitmap(range(10, 30) + [40, 42])
+        condition = bm.as_condition()
+
+        self.assertEqual(unicode(condition),
+                         "(OR: ('pk__range', (10, 29)), "
+                         "('pk__in', [40, 42]))")
+
+    def test_pickle(self):
+        bm = Bitmap([1, 2, 65536 * 3])
+        self.assertEqual(pickle.loads(pickle.dumps(bm)), bm)
+
+
+class ContextBitmapTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+
+        self.programmers = DataContext({
+            'field': 'tests.title.name',
+            'operator': 'exact',
+            'value': 'Programmer',
+        })
+
+        self.smiths = DataContext({
+            'field': 'tests.employee.last_name',
+            'operator': 'exact',
+            'value': 'Smith',
+        })
+
+    def test_bitmap(self):
+        bm = self.programmers.bitmap(tree=Employee)
+        self.assertEqual(list(bm), [1, 3, 5])
+        self.assertEqual(len(bm), self.programmers.count(tree=Employee))
+
+    def test_combine(self):
+        a = self.programmers.bitmap(tree=Employee)
+        b = self.smiths.bitmap(tree=Employee)
+
+        self.assertEqual(list(a & b), [1, 3])
+        self.assertEqual(list(a | b), [1, 3, 5])
+        self.assertEqual(list(a.complement(universe(Employee))), [2, 4, 6])
+
+    def test_filter(self):
+        bm = self.programmers.bitmap(tree=Employee)
+        queryset = bm.filter(Employee.objects.all())
+
+        self.assertEqual(sorted(queryset.values_list('pk', flat=True)),
+                         [1, 3, 5])
@@ -0,0 +1,105 @@
+from django.test import TestCase
+from django.core import management
+from django.core.cache import cache
+from avocado.models import DataContext, DataField
+from avocado.query.canonical import canonical_context, canonical_view, \
+    fingerprint
+
+
+def condition(field, value, operator='exact', **kwargs):
+    attrs = {'field': field, 'operator': operator, 'value': value}
+    attrs.update(kwargs)
+    return attrs
+
+
+class CanonicalTestCase(TestCase):
+    def test_condition(self):
+        attrs = condition(['tests', 'title', 'name'], 'CEO',
+                          language='Name is CEO', errors=[], warnings=[])
+
+        self.assertEqual(canonical_context(attrs),
+                         condition('tests.title.name', 'CEO'))
+
+    def test_set_value(self):
+        attrs = condition('tests.title.name', [{'value': 'b', 'label': 'B'},
+                                               'a', 'b'], operator='in')
+
+        self.assertEqual(canonical_context(attrs)['value'], ['a', 'b'])
+
+    def test_branch(self):
+        a = condition('tests.title.name', 'CEO')
+        b = condition('tests.employee.first_name', 'Eric')
+        c = condition('tests.employee.last_name', 'Smith')
+
+        one = {'type': 'and', 'children': [a, b, c, a]}
+        two = {'type': 'AND', 'children': [
+            c, {'type': 'and', 'children': [b, a]},
+            condition('tests.office.location', 'Boston', enabled=False),
+        ]}
+
+        self.assertEqual(canonical_context(one), canonical_context(two))
+        self.assertEqual(len(canonical_context(one)['children']), 3)
+
+        # Different branch types are not flattened
+        three = {'type': 'and', 'children': [
+            c, {'type': 'or', 'children': [b, a]},
+        ]}
+        self.assertNotEqual(canonical_context(one),
+                            canonical_context(three))
+
+    def test_single_child(self):
+        a = condition('tests.title.name', 'CEO')
+        self.assertEqual(canonical_context({'type': 'or', 'children': [a]}),
+                         a)
+        self.assertEqual(canonical_context({'type': 'or', 'children': []}),
+                         None)
+
+    def test_view(self):
+        view = [{'concept': 1, 'visible': True, 'errors': []},
+                {'concept': 2, 'enabled': False},
+                {'concept': 3, 'sort': 'desc'}]
+
+        self.assertEqual(canonical_view(view), [
+            {'concept': 1, 'visible': True},
+            {'concept': 3, 'sort': 'desc'},
+        ])
+
+        # Order is significant
+        self.assertNotEqual(fingerprint(view=view),
+                            fingerprint(view=list(reversed(view))))
+
+
+class FingerprintCacheTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        cache.clear()
+
+        a = condition('tests.title.name', 'Programmer')
+        b = condition('tests.employee.last_name', 'Smith')
+
+        self.one = DataContext({'type': 'and', 'children': [a, b]})
+        self.one.save()
+
+        self.two = DataContext({'type': 'and', 'children': [
+            b, dict(a, language='Name is Programmer')]})
+
+    def test_fingerprint(self):
+        self.assertEqual(self.one.fingerprint(), self.two.fingerprint())
+
+    def test_shared_count(self):
+        self.assertEqual(self.one.count(), 2)
+
+        # The unsaved, equivalent context uses the cached count
+        with self.assertNumQueries(1):
+            self.assertEqual(self.two.count(), 2)
+
+    def test_data_version(self):
+        key = self.one.fingerprint()
+
+        field = DataField.objects.get_by_natural_key('tests.title.name')
+        field.data_version += 1
+        field.save()
+
+        self.assertNotEqual(self.one.fingerprint(), key)
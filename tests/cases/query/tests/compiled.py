@@ -0,0 +1,165 @@
+import cPickle as pickle
+from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import management
+from django.core.cache import cache
+from avocado.models import DataConcept, DataConceptField, DataContext, \
+    DataField, DataQuery, DataView
+from avocado.query import compiled, oldparsers as parsers
+from ....models import Employee
+
+CONTEXT = {
+    'type': 'and',
+    'children': [{
+        'field': 'tests.title.boss',
+        'operator': 'exact',
+        'value': True,
+    }, {
+        'field': 'tests.project.name',
+        'operator': 'exact',
+        'value': 'Project X',
+    }]
+}
+
+
+class CompiledQueryTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        cache.clear()
+
+        f = DataField.objects.get_by_natural_key('tests', 'office',
+                                                 'location')
+        self.c = DataConcept()
+        self.c.save()
+        DataConceptField(concept=self.c, field=f).save()
+
+        self.view = [{'concept': self.c.pk, 'sort': 'desc'}]
+
+    def _sql(self, queryset):
+        return unicode(queryset.query)
+
+    def test_apply(self):
+        query = compiled.compile(context=CONTEXT, view=self.view,
+                                 tree=Employee)
+
+        node = parsers.dataquery.parse({
+            'context': CONTEXT,
+            'view': self.view,
+        }, tree=Employee)
+
+        self.assertEqual(self._sql(query.apply()), self._sql(node.apply()))
+        self.assertEqual(self._sql(query.apply(include_pk=False)),
+                         self._sql(node.apply(include_pk=False)))
+        self.assertEqual(query.plan(), node.plan())
+
+    def test_pickle(self):
+        query = compiled.compile(context=CONTEXT, view=self.view,
+                                 tree=Employee, semi_join=True)
+        clone = pickle.loads(pickle.dumps(query, pickle.HIGHEST_PROTOCOL))
+
+        self.assertEqual(self._sql(clone.apply()), self._sql(query.apply()))
+
+    def test_cache(self):
+        query = compiled.compile(context=CONTEXT, view=self.view,
+                                 tree=Employee)
+
+        # The parse and translate phase is skipped for identical queries
+        parse = parsers.datacontext.parse
+        parsers.datacontext.parse = None
+
+        try:
+            cached = compiled.compile(context=CONTEXT, view=self.view,
+                                      tree=Employee)
+        finally:
+            parsers.datacontext.parse = parse
+
+        self.assertEqual(self._sql(cached.apply()), self._sql(query.apply()))
+
+        # Changes to metadata invalidate compiled queries
+        key = compiled.fingerprint(context=CONTEXT, view=self.view,
+                                   tree=Employee)
+        self.c.save()
+        self.assertNotEqual(compiled.fingerprint(context=CONTEXT,
+                                                 view=self.view,
+                                                 tree=Employee), key)
+
+    def test_unavailable_cache(self):
+        dummy = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            }
+        }
+
+        # The version is stable if the cache does not keep it
+        with self.settings(CACHES=dummy):
+            key = compiled.fingerprint(context=CONTEXT, view=self.view,
+                                       tree=Employee)
+            self.assertEqual(compiled.fingerprint(context=CONTEXT,
+                                                  view=self.view,
+                                                  tree=Employee), key)
+
+            self.c.save()
+            self.assertNotEqual(compiled.fingerprint(context=CONTEXT,
+                                                     view=self.view,
+                                                     tree=Employee), key)
+
+    def test_model(self):
+        query = DataQuery({'context': CONTEXT, 'view': self.view})
+
+        self.assertEqual(
+            self._sql(query.apply(tree=Employee)),
+            self._sql(query.parse(tree=Employee).apply()))
+
+    def test_user(self):
+        user = User.objects.create_user('compiled', 'compiled@example.com')
+
+        # Conditions pass the context to the translators, which do not take
+        # a user, so the view and an empty context are applied.
+        view = DataView(json=self.view)
+        query = DataQuery({'view': self.view})
+
+        for u in (AnonymousUser(), user):
+            self.assertEqual(
+                self._sql(view.apply(tree=Employee, user=u)),
+                self._sql(view.apply(tree=Employee)))
+            self.assertEqual(
+                self._sql(query.apply(tree=Employee, user=u)),
+                self._sql(query.apply(tree=Employee)))
+            self.assertEqual(
+                self._sql(DataContext().apply(tree=Employee, user=u)),
+                self._sql(DataContext().apply(tree=Employee)))
+
+        # Users are keyed by their primary key
+        self.assertEqual(
+            compiled.fingerprint(context=CONTEXT, tree=Employee, user=user),
+            compiled.fingerprint(context=CONTEXT, tree=Employee,
+                                 user=User.objects.get(pk=user.pk)))
+        self.assertNotEqual(
+            compiled.fingerprint(context=CONTEXT, tree=Employee, user=user),
+            compiled.fingerprint(context=CONTEXT, tree=Employee,
+                                 user=AnonymousUser()))
+
+    def test_uncacheable(self):
+        # Arguments that cannot be encoded bypass the cache
+        self.assertEqual(compiled.fingerprint(context=CONTEXT, tree=Employee,
+                                              other=object()), None)
+
+        parse = parsers.dataview.parse
+        calls = []
+
+        def counting_parse(*args, **kwargs):
+            calls.append(1)
+            return parse(*args, **kwargs)
+
+        parsers.dataview.parse = counting_parse
+
+        try:
+            for i in range(2):
+                compiled.compile(view=self.view, tree=Employee,
+                                 other=object())
+        finally:
+            parsers.dataview.parse = parse
+
+        self.assertEqual(len(calls), 2)
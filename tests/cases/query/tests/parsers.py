@@ -1,5 +1,6 @@
 from copy import deepcopy
 from django.test import TestCase
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core import management
 from avocado.query import oldparsers as parsers
@@ -212,7 +213,7 @@ class DataContextParserTestCase(TestCase):
 
         self.assertEqual(
             unicode(node.apply().values('id').query).replace(' ', ''),
-            'SELECT DISTINCT "tests_employee"."id" FROM "tests_employee" '
+            'SELECT "tests_employee"."id" FROM "tests_employee" '
             'INNER JOIN "tests_title" ON ("tests_employee"."title_id" = '
             '"tests_title"."id") WHERE "tests_title"."boss" = True '
             .replace(' ', ''))
@@ -240,7 +241,7 @@ class DataContextParserTestCase(TestCase):
 
         self.assertEqual(
             unicode(node.apply().values('id').query).replace(' ', ''),
-            'SELECT DISTINCT "tests_employee"."id" FROM "tests_employee" '
+            'SELECT "tests_employee"."id" FROM "tests_employee" '
             'INNER JOIN "tests_title" ON ("tests_employee"."title_id" = '
             '"tests_title"."id") WHERE ("tests_employee"."first_name" = John '
             'AND "tests_title"."boss" = True )'.replace(' ', ''))
@@ -260,6 +261,141 @@ class DataContextParserTestCase(TestCase):
             }]
         })
 
+    def test_apply_to_many(self):
+        node = parsers.datacontext.parse({
+            'type': 'or',
+            'children': [{
+                'field': 'tests.title.boss',
+                'operator': 'exact',
+                'value': True,
+            }, {
+                'field': 'tests.project.name',
+                'operator': 'exact',
+                'value': 'Project 1',
+            }]
+        }, tree=Employee)
+
+        self.assertEqual(node.plan(), {
+            'distinct': True,
+            'to_many': [u'tests.project'],
+        })
+        self.assertTrue(node.apply().query.distinct)
+
+        # Explicitly disabled
+        self.assertFalse(node.apply(distinct=False).query.distinct)
+
+        # Only the to-one child
+        node = node.children[0]
+        self.assertEqual(node.plan(), {
+            'distinct': False,
+            'to_many': [],
+        })
+        self.assertFalse(node.apply().query.distinct)
+
+        # Existing joins on the queryset are not inspected
+        queryset = Employee.objects.filter(office__location='Boston')
+        self.assertTrue(node.plan(queryset)['distinct'])
+        self.assertTrue(node.apply(queryset).query.distinct)
+
+    def test_apply_semi_join(self):
+        node = parsers.datacontext.parse({
+            'field': 'tests.project.name',
+            'operator': 'exact',
+            'value': 'Project 1',
+        }, tree=Employee, semi_join=True)
+
+        # The to-many join is contained in a subquery
+        self.assertEqual(node.plan(), {
+            'distinct': False,
+            'to_many': [],
+        })
+        self.assertFalse(node.apply().query.distinct)
+
+
+class DataContextIncrementalTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        cache.clear()
+
+    def _parse(self, last_name, **context):
+        return parsers.datacontext.parse({
+            'type': 'and',
+            'children': [{
+                'field': 'tests.title.name',
+                'operator': 'exact',
+                'value': 'Programmer',
+            }, {
+                'field': 'tests.employee.last_name',
+                'operator': 'exact',
+                'value': last_name,
+            }]
+        }, tree=Employee, **context)
+
+    def test_bitmap(self):
+        node = self._parse('Smith')
+        self.assertEqual(list(node.bitmap()), [1, 3])
+        self.assertEqual(node.count(), 2)
+
+        # Empty nodes do not restrict the set
+        node = parsers.datacontext.parse({}, tree=Employee)
+        self.assertIsNone(node.bitmap())
+        self.assertEqual(node.count(), 6)
+
+    def test_signature(self):
+        node = self._parse('Smith')
+        other = self._parse('Smith')
+
+        # Order of children does not matter
+        other.children.reverse()
+        self.assertEqual(node.signature, other.signature)
+
+        self.assertNotEqual(node.signature, self._parse('Cook').signature)
+
+    def test_context_signature(self):
+        node = self._parse('Smith')
+        other = self._parse('Smith', semi_join=True)
+
+        # The context is passed to the translators
+        self.assertNotEqual(node.signature, other.signature)
+        self.assertEqual(other.signature,
+                         self._parse('Smith', semi_join=True).signature)
+
+    def test_uncacheable(self):
+        node = self._parse('Smith')
+        bitmap = node.children[1].bitmap()
+
+        # Custom translators may accept context that cannot be encoded.
+        node.children[1].context = {'other': object()}
+        self.assertFalse(node.cacheable)
+
+        # Contexts that cannot be encoded are not cached.
+        calls = []
+
+        def evaluate():
+            calls.append(1)
+            return bitmap
+
+        node.children[1]._evaluate = evaluate
+
+        self.assertEqual(list(node.bitmap()), [1, 3])
+        node.bitmap()
+        self.assertEqual(len(calls), 2)
+
+    def test_reuse(self):
+        self._parse('Smith').bitmap()
+
+        node = self._parse('Cook')
+
+        # The unchanged condition must be read from the cache.
+        def evaluate():
+            self.fail('unchanged condition was re-evaluated')
+
+        node.children[0]._evaluate = evaluate
+
+        self.assertEqual(list(node.bitmap()), [5])
+
 
 class DataViewParserTestCase(TestCase):
     fixtures = ['tests/fixtures/employee_data.json']
@@ -526,7 +662,7 @@ class DataQueryParserTestCase(TestCase):
 
         self.assertEqual(
             unicode(node.apply().query).replace(' ', ''),
-            'SELECT DISTINCT "tests_employee"."id", '
+            'SELECT "tests_employee"."id", '
             '"tests_employee"."first_name", "tests_employee"."last_name" FROM '
             '"tests_employee" INNER JOIN "tests_title" ON '
             '("tests_employee"."title_id" = "tests_title"."id") '
@@ -543,7 +679,7 @@ class DataQueryParserTestCase(TestCase):
 
         self.assertEqual(
             unicode(node.apply().query).replace(' ', ''),
-            'SELECT DISTINCT "tests_employee"."id", '
+            'SELECT "tests_employee"."id", '
             '"tests_employee"."first_name", '
             '"tests_employee"."last_name" FROM "tests_employee" '
             'ORDER BY "tests_employee"."first_name" DESC, '
@@ -560,7 +696,7 @@ class DataQueryParserTestCase(TestCase):
 
         self.assertEqual(
             unicode(node.apply().values('id').query).replace(' ', ''),
-            'SELECT DISTINCT "tests_employee"."id" FROM "tests_employee" '
+            'SELECT "tests_employee"."id" FROM "tests_employee" '
             'INNER JOIN "tests_title" ON ("tests_employee"."title_id" = '
             '"tests_title"."id") WHERE "tests_title"."boss" = True '
             .replace(' ', ''))
@@ -572,3 +708,35 @@ class DataQueryParserTestCase(TestCase):
             'field': f.pk,
             'value': True
         })
+
+    def test_plan(self):
+        c = DataConcept()
+        c.save()
+
+        f = DataField.objects.get_by_natural_key('tests', 'project', 'name')
+        DataConceptField(concept=c, field=f).save()
+
+        node = parsers.dataquery.parse({
+            'context': {
+                'field': 'tests.title.boss',
+                'operator': 'exact',
+                'value': True
+            },
+            'view': [{
+                'concept': c.pk,
+            }],
+        }, tree=Employee)
+
+        self.assertEqual(node.plan(), {
+            'distinct': True,
+            'context': {
+                'distinct': False,
+                'to_many': [],
+            },
+            'view': {
+                'distinct': True,
+                'to_many': [u'tests.project'],
+            },
+        })
+        self.assertTrue(node.apply().query.distinct)
+        self.assertFalse(node.apply(distinct=False).query.distinct)
@@ -1,8 +1,14 @@
+import os
+import json
+import shutil
+import tempfile
+from zipfile import ZipFile
 from django.core import management
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from avocado import export
 from avocado.query.pipeline import QueryProcessor
-from avocado.models import DataConcept, DataView
-from tests.models import Employee
+from avocado.models import DataConcept, DataContext, DataField, DataView
+from tests.models import Employee, Office, Project, Title
 
 
 class QueryProcessorTestCase(TestCase):
@@ -45,3 +51,307 @@ class QueryProcessorTestCase(TestCase):
         i = p.get_iterable(queryset=q)
 
         self.assertEqual(len(list(i)), 0)
+
+
+class ShardedQueryProcessorTestCase(TransactionTestCase):
+    def setUp(self):
+        management.call_command('loaddata',
+                                'tests/fixtures/employee_data.json',
+                                verbosity=0)
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+
+        self.first_name = DataConcept.objects.get(name='First Name')
+        self.salary = DataConcept.objects.get(name='Salary')
+
+    def _rows(self, view, **kwargs):
+        p = QueryProcessor(view=view, tree=Employee)
+        expected = list(p.get_iterable())
+        rows = list(p.get_sharded_iterable(**kwargs))
+
+        return expected, rows
+
+    def test_shards(self):
+        p = QueryProcessor(tree=Employee)
+
+        self.assertEqual(p.get_shards(3), [(None, 3), (3, 5), (5, None)])
+        self.assertEqual(p.get_shards(3, method='quantiles'),
+                         [(None, 3), (3, 5), (5, None)])
+        self.assertEqual(p.get_shards(20), [(None, 2), (2, 3), (3, 4),
+                                            (4, 5), (5, 6), (6, None)])
+
+        self.assertRaises(ValueError, p.get_shards, 2, method='random')
+
+    def test_concatenated(self):
+        view = DataView(json=[{'concept': self.first_name.pk}])
+        expected, rows = self._rows(view, shards=3)
+
+        self.assertEqual(sorted(rows), sorted(expected))
+        self.assertEqual([r[0] for r in rows], range(1, 7))
+
+    def test_ordered(self):
+        view = DataView(json=[
+            {'concept': self.first_name.pk},
+            {'concept': self.salary.pk, 'sort': 'desc', 'visible': False},
+        ])
+
+        expected, rows = self._rows(view, shards=3, method='quantiles')
+
+        self.assertEqual(len(rows[0]), len(expected[0]))
+        self.assertEqual(rows, expected)
+
+    def test_nulls(self):
+        office = Office.objects.get(pk=1)
+        title = Title.objects.create(name='Intern', salary=None)
+
+        Employee.objects.create(first_name='Ann', last_name='Lee',
+                                office=office, title=title)
+        Employee.objects.create(first_name='Bo', last_name='Ng',
+                                office=office, title=None)
+
+        salaries = dict(Employee.objects.values_list('pk', 'title__salary'))
+
+        for sort in ('asc', 'desc'):
+            view = DataView(json=[
+                {'concept': self.first_name.pk},
+                {'concept': self.salary.pk, 'sort': sort, 'visible': False},
+            ])
+
+            expected, rows = self._rows(view, shards=3)
+
+            # Rows with the same salary may be in any order.
+            self.assertEqual(sorted(rows), sorted(expected))
+            self.assertEqual([salaries[r[0]] for r in rows],
+                             [salaries[r[0]] for r in expected])
+
+    def test_text_ordering(self):
+        # Databases order text by collation, e.g. case-insensitively, which
+        # cannot be reproduced when merging shards.
+        office = Office.objects.get(pk=1)
+        Employee.objects.create(first_name='aaron', last_name='Lee',
+                                office=office)
+
+        view = DataView(json=[
+            {'concept': self.first_name.pk, 'sort': 'asc'},
+        ])
+
+        p = QueryProcessor(view=view, tree=Employee)
+        self.assertRaises(ValueError, p.get_sharded_iterable, shards=2)
+
+    def test_exporter(self):
+        view = DataView(json=[
+            {'concept': self.first_name.pk},
+            {'concept': self.salary.pk, 'sort': 'asc'},
+        ])
+
+        p = QueryProcessor(view=view, tree=Employee)
+        exporter = p.get_exporter(export.CSVExporter)
+
+        expected = list(exporter.read(p.get_iterable()))
+
+        # Shards are formatted by worker processes by default
+        rows = list(p.get_sharded_iterable(shards=2, exporter=exporter,
+                                           processes=2))
+        self.assertEqual(rows, expected)
+
+        rows = list(p.get_sharded_iterable(shards=2, exporter=exporter,
+                                           reader='read'))
+        self.assertEqual(rows, expected)
+
+        # The worker processes are stopped if the iterable is closed early
+        it = p.get_sharded_iterable(shards=2, exporter=exporter, processes=2)
+        self.assertEqual(next(it), expected[0])
+        it.close()
+
+        self.assertRaises(ValueError, p.get_sharded_iterable, shards=2,
+                          exporter=exporter, reader='manual_read')
+
+
+class FailingCSVExporter(export.CSVExporter):
+    "Fails after reading `fail_after` rows."
+    fail_after = None
+
+    def read(self, *args, **kwargs):
+        rows = super(FailingCSVExporter, self).read(*args, **kwargs)
+
+        for i, row in enumerate(rows):
+            if i == self.fail_after:
+                raise RuntimeError('export failed')
+
+            yield row
+
+
+class ResumableExportTestCase(TestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+
+        self.first_name = DataConcept.objects.get(name='First Name')
+        self.salary = DataConcept.objects.get(name='Salary')
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def test_resume_keyset(self):
+        view = DataView(json=[{'concept': self.first_name.pk}])
+        p = QueryProcessor(view=view, tree=Employee)
+
+        expected = p.resumable_export(p.get_exporter(export.CSVExporter),
+                                      self._path('expected.csv'))
+
+        path = self._path('export.csv')
+        exporter = p.get_exporter(FailingCSVExporter)
+        exporter.fail_after = 5
+
+        self.assertRaises(RuntimeError, p.resumable_export, exporter, path,
+                          checkpoint_every=2)
+
+        checkpoint = export.Checkpoint(path)
+
+        with open(checkpoint.checkpoint_path) as f:
+            state = json.load(f)
+
+        self.assertEqual(state['rows'], 4)
+        self.assertEqual(state['cursor'], 4)
+
+        # Only the remaining rows are read when resuming.
+        exporter.fail_after = 2
+        p.resumable_export(exporter, path, checkpoint_every=2)
+
+        self.assertEqual(open(path).read(), open(expected).read())
+        self.assertFalse(os.path.exists(checkpoint.checkpoint_path))
+
+    def test_resume_ordered(self):
+        view = DataView(json=[
+            {'concept': self.first_name.pk},
+            {'concept': self.salary.pk, 'sort': 'desc', 'visible': False},
+        ])
+        p = QueryProcessor(view=view, tree=Employee)
+        exporter = p.get_exporter(export.JSONExporter)
+        path = self._path('export.json')
+
+        # A partial write after the last checkpoint is discarded.
+        class Interrupted(Exception):
+            pass
+
+        def interrupted(rows):
+            for i, row in enumerate(exporter.read(rows)):
+                if i == 3:
+                    raise Interrupted
+
+                yield row
+
+        exporter.interrupted_read = interrupted
+
+        self.assertRaises(Interrupted, p.resumable_export, exporter, path,
+                          reader='interrupted_read', checkpoint_every=2)
+
+        p.resumable_export(exporter, path, checkpoint_every=2)
+
+        with open(path) as f:
+            data = json.load(f)
+
+        expected = list(exporter.read(p.get_iterable()))
+
+        self.assertEqual([r['id'] for r in data], [r[0] for r in expected])
+
+    def test_resume_distinct_ties(self):
+        # Rows are distinct without the primary key and many have the same
+        # value of the ordering column, so the selected columns must break
+        # ties for the rows to be resumed at an offset.
+        boss = DataConcept.objects.get(name='Boss')
+        view = DataView(json=[
+            {'concept': self.first_name.pk},
+            {'concept': boss.pk, 'sort': 'asc'},
+        ])
+        context = DataContext(json={
+            'field': 'tests.title.salary',
+            'operator': 'gt',
+            'value': 0,
+        })
+
+        p = QueryProcessor(context=context, view=view, tree=Employee,
+                           include_pk=False)
+        queryset = p.get_queryset()
+        self.assertTrue(queryset.query.distinct)
+
+        exporter = p.get_exporter(FailingCSVExporter)
+        exporter.fail_after = 3
+        path = self._path('export.csv')
+
+        self.assertRaises(RuntimeError, p.resumable_export, exporter, path,
+                          checkpoint_every=2)
+
+        exporter.fail_after = None
+        p.resumable_export(exporter, path, checkpoint_every=2)
+
+        with open(path) as f:
+            rows = f.read().splitlines()[1:]
+
+        expected = export.CSVExporter(view).write(
+            p.get_iterable()).getvalue().splitlines()[1:]
+
+        self.assertEqual(len(rows), len(set(rows)))
+        self.assertEqual(sorted(rows), sorted(expected))
+
+    def test_resume_to_many(self):
+        # Rows joined to several projects share the primary key, so they
+        # cannot be resumed after the last primary key written.
+        Project.objects.get(pk=1).employees.add(1, 2)
+        Project.objects.get(pk=2).employees.add(1)
+
+        project = DataField.objects.get_by_natural_key(
+            'tests', 'project', 'name').concepts.all()[0]
+        view = DataView(json=[
+            {'concept': self.first_name.pk},
+            {'concept': project.pk},
+        ])
+        p = QueryProcessor(view=view, tree=Employee)
+
+        expected = p.resumable_export(p.get_exporter(export.CSVExporter),
+                                      self._path('expected.csv'))
+
+        path = self._path('export.csv')
+        exporter = p.get_exporter(FailingCSVExporter)
+        exporter.fail_after = 1
+
+        self.assertRaises(RuntimeError, p.resumable_export, exporter, path,
+                          checkpoint_every=1)
+
+        exporter.fail_after = None
+        p.resumable_export(exporter, path, checkpoint_every=1)
+
+        with open(expected) as f:
+            rows = f.read()
+
+        self.assertTrue('1,Eric,Project X' in rows)
+        self.assertTrue('1,Eric,Project Y' in rows)
+        self.assertEqual(open(path).read(), rows)
+
+    def test_resume_archive(self):
+        view = DataView(json=[{'concept': self.first_name.pk}])
+        p = QueryProcessor(view=view, tree=Employee, include_pk=False)
+        path = self._path('export.zip')
+
+        p.resumable_export(p.get_exporter(export.RExporter), path)
+
+        zip_file = ZipFile(path)
+
+        self.assertEqual(sorted(zip_file.namelist()),
+                         ['data.csv', 'script.R'])
+        self.assertEqual(len(zip_file.read('data.csv').splitlines()), 7)
+        self.assertFalse(os.path.exists(path + '.data'))
+
+    def test_unsupported(self):
+        p = QueryProcessor(tree=Employee)
+        exporter = p.get_exporter(export.CSVExporter)
+
+        self.assertRaises(ValueError, p.resumable_export, exporter,
+                          self._path('export.csv'), reader='manual_read')
+        self.assertRaises(ValueError, p.resumable_export,
+                          p.get_exporter(export.ExcelExporter),
+                          self._path('export.xlsx'))
@@ -106,3 +106,53 @@ class TranslatorValueDictTestCase(BaseTestCase):
             value={'value': 'Robert', 'label': 'Robert'}, tree=Employee)
         self.assertEqual(unicode(trans['query_modifiers']['condition']),
                          "(AND: ('first_name__exact', u'Robert'))")
+
+
+class SemiJoinTranslatorTestCase(BaseTestCase):
+    fixtures = ['tests/fixtures/employee_data.json']
+
+    def setUp(self):
+        super(SemiJoinTranslatorTestCase, self).setUp()
+        Project.objects.get(pk=1).employees.add(1, 2, 3)
+        Project.objects.get(pk=2).employees.add(3, 4)
+
+    def _filter(self, field, **kwargs):
+        trans = field.translate(tree=Employee, **kwargs)
+        condition = trans['query_modifiers']['condition']
+        return Employee.objects.filter(condition)
+
+    def test_to_many(self):
+        trans = self.budget.translate(value=5000, tree=Employee,
+                                      semi_join=True)
+        self.assertTrue(trans['query_modifiers']['semi_join'])
+
+        queryset = self._filter(self.budget, value=5000, semi_join=True)
+        sql = unicode(queryset.query)
+
+        # The project table is only joined in the subquery
+        outer, subquery = sql.split(' WHERE ', 1)
+        self.assertFalse('JOIN' in outer)
+        self.assertTrue('IN (SELECT' in subquery)
+        self.assertTrue('tests_project' in subquery)
+        self.assertEqual(sorted(queryset.values_list('pk', flat=True)),
+                         [1, 2, 3])
+
+    def test_equivalent(self):
+        for kwargs in ({'value': 5000},
+                       {'value': None},
+                       {'value': 5000, 'operator': '-exact'}):
+            joined = self._filter(self.budget, **kwargs).distinct()
+            semi = self._filter(self.budget, semi_join=True, **kwargs)
+
+            self.assertEqual(sorted(semi.values_list('pk', flat=True)),
+                             sorted(joined.values_list('pk', flat=True)))
+
+            # No duplicate rows without DISTINCT
+            self.assertEqual(semi.count(), joined.count())
+
+    def test_to_one(self):
+        trans = self.salary.translate(value=50000, tree=Employee,
+                                      semi_join=True)
+        self.assertFalse(trans['query_modifiers']['semi_join'])
+        self.assertEqual(unicode(trans['query_modifiers']['condition']),
+                         "(AND: ('title__salary__exact', 50000.0))")
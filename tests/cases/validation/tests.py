@@ -1,7 +1,10 @@
 from django.test import TestCase
 from django.core import management
 from avocado.models import DataField, DataConcept, DataConceptField
+from avocado.query import oldparsers
+from avocado.query.parsers import TreeParser, QueryParser
 from avocado.query.validators import Validator, FieldValidator
+from ...models import Employee
 
 
 class ValidatorTestCase(TestCase):
@@ -149,3 +152,105 @@ class FieldValidatorTestCase(ValidatorTestCase):
         self.assertTrue('errors' in v.data)
         self.assertEqual(v.errors[0], 'ambiguous_field')
         self.assertFalse(v.data['enabled'])
+
+
+class TreeParserTestCase(ValidatorTestCase):
+    def _tree(self, *fields):
+        return {
+            'type': 'and',
+            'children': [{
+                'field': field,
+                'operator': 'gt',
+                'value': 10,
+            } for field in fields]
+        }
+
+    def test_valid(self):
+        data = self._tree('tests.title.salary')
+        p = TreeParser(data)
+
+        self.assertTrue(p.is_valid())
+        self.assertEqual(p.data, data)
+
+    def test_invalid_child(self):
+        data = self._tree('tests.title.salary', 'invalid.lookup')
+        p = TreeParser(data)
+        p.is_valid()
+
+        self.assertEqual(p.data['warnings'], ['invalid_child'])
+        self.assertEqual(p.data['children'][1]['errors'],
+                         ['field_does_not_exist'])
+
+        # New warnings disable the branch until it is re-enabled
+        self.assertFalse(p.data['enabled'])
+        self.assertEqual(unicode(p.node(tree=Employee).condition), 'None')
+
+        p.data['enabled'] = True
+        p = TreeParser(p.data)
+        p.is_valid()
+
+        # Only the valid condition is applied
+        node = p.node(tree=Employee)
+        self.assertEqual(unicode(node.condition),
+                         "(AND: ('title__salary__gt', 10.0))")
+
+    def test_batched(self):
+        data = self._tree('tests.title.salary', 'tests.project.budget',
+                          'tests.title.salary', 'tests.project.budget')
+
+        # Both fields are fetched in a single query
+        with self.assertNumQueries(1):
+            p = TreeParser(data)
+            self.assertTrue(p.is_valid())
+
+    def test_node(self):
+        data = self._tree('tests.title.salary', 'tests.project.budget')
+        p = TreeParser(data)
+        p.is_valid()
+
+        node = p.node(tree=Employee)
+        old = oldparsers.datacontext.parse(data, tree=Employee)
+
+        self.assertEqual(unicode(node.apply().query),
+                         unicode(old.apply().query))
+
+
+class QueryParserTestCase(ValidatorTestCase):
+    def setUp(self):
+        super(QueryParserTestCase, self).setUp()
+        self.concept = DataConcept(name='Salary')
+        self.concept.save()
+        DataConceptField(concept=self.concept, field=DataField.objects
+                         .get_by_natural_key('tests.title.salary')).save()
+
+    def test_valid(self):
+        data = {
+            'context': {
+                'field': 'tests.title.salary',
+                'operator': 'gt',
+                'value': 10,
+            },
+            'view': [{
+                'concept': self.concept.pk,
+                'sort': 'desc',
+            }, {
+                'concept': -1,
+            }],
+        }
+
+        # Concepts, concept fields and fields
+        with self.assertNumQueries(3):
+            p = QueryParser(data)
+            p.is_valid()
+
+        self.assertEqual(p.data['view'][1]['errors'],
+                         ['concept_does_not_exist'])
+
+        node = p.node(tree=Employee)
+        old = oldparsers.dataquery.parse({
+            'context': data['context'],
+            'view': data['view'][:1],
+        }, tree=Employee)
+
+        self.assertEqual(unicode(node.apply().query),
+                         unicode(old.apply().query))